@@ -0,0 +1,371 @@
+"""
+Пакетный прогон headless-игр для подбора баланса волн и экономики.
+
+Берёт сетку наборов параметров (стоимости, стартовые деньги, волны уровней,
+характеристики монстров) и сценарии расстановки, прогоняет все игры в пуле
+процессов на всех ядрах и сохраняет сводку: долю побед, число тиков,
+здоровье башни и кривую денег.
+
+Примеры:
+    python batch.py --grid weapon_cost=20,30,40 --grid start_money=120,180 \\
+        --strategy ring --strategy random --repeats 50 -o results.json
+    python batch.py --config sweep.json -o results.csv
+
+Файл --config (JSON):
+    {
+        "base": {"tower_health": 600, "Goblin.health": 60},
+        "grid": {"weapon_cost": [20, 30, 40], "levels": [[[["Goblin", 5, 60]]]]},
+        "strategies": ["ring", "wall"],
+        "repeats": 20,
+        "max_ticks": 20000
+    }
+Параметры вида "<Монстр>.<характеристика>" меняют speed/damage/health типа монстра,
+"levels" — список уровней, каждый уровень — список волн [тип, количество, задержка].
+"levels_file" — файл уровней (по умолчанию data/levels.json): из него берутся карта
+и стандартные уровни; "map" — карта в формате ключа "map" файла уровней.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import itertools
+import multiprocessing
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+# SDL не ставит свои обработчики SIGINT/SIGTERM: иначе pool.terminate() не останавливает процессы
+os.environ.setdefault("SDL_NO_SIGNAL_HANDLERS", "1")
+
+from main import (  # noqa: E402
+    CELL_SIZE, LEVELS_FILE, CMD_PLACE_BARRIER, CMD_PLACE_WEAPON,
+    MONSTER_TYPES, GameLevel, GameMap, Simulation, default_levels, load_map,
+)
+
+# Параметры Simulation, которые можно перебирать напрямую
+SIM_PARAMS = ("start_money", "barrier_cost", "weapon_cost", "tower_health")
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ СЦЕНАРИИ РАССТАНОВКИ -------------------------------------
+# -----------------------------------------------------------------------------------
+def cells_by_distance(center, size, min_dist=0):
+    """
+    Левые верхние углы ячеек сетки карты размером size, отсортированные по расстоянию до center.
+    """
+    cx, cy = center
+    width, height = size
+    cells = []
+    for x in range(0, width, CELL_SIZE):
+        for y in range(0, height, CELL_SIZE):
+            d2 = (x + CELL_SIZE // 2 - cx) ** 2 + (y + CELL_SIZE // 2 - cy) ** 2
+            if d2 >= min_dist ** 2:
+                cells.append((d2, x, y))
+    cells.sort()
+    return [(x, y) for _, x, y in cells]
+
+
+class IdleStrategy:
+    """
+    Ничего не ставит (нижняя граница для сравнения).
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def __call__(self, sim):
+        pass
+
+
+class RingStrategy(IdleStrategy):
+    """
+    Ставит оружие кольцом вокруг башни, как только хватает денег.
+    """
+
+    def __init__(self, rng):
+        super().__init__(rng)
+        self.slots = None
+
+    def __call__(self, sim):
+        if self.slots is None:
+            self.slots = cells_by_distance(sim.tower.rect.center, sim.map.size, min_dist=100)
+        if self.slots and sim.money >= sim.weapon_cost:
+            sim.submit(CMD_PLACE_WEAPON, *self.slots.pop(0))
+
+
+class WallStrategy(RingStrategy):
+    """
+    Сначала перегораживает баррикадами путь от каждой точки спавна к башне,
+    затем ставит оружие кольцом.
+    """
+
+    def __init__(self, rng, wall_length=4):
+        super().__init__(rng)
+        self.wall_length = wall_length
+        self.wall = None
+
+    def __call__(self, sim):
+        if self.wall is None:
+            # Баррикады на отрезках между точками спавна карты и башней
+            tx, ty = sim.tower.rect.center
+            n = self.wall_length + 1
+            self.wall = [(sx + (tx - sx) * k // n, sy + (ty - sy) * k // n)
+                         for sx, sy in sim.map.spawn_points for k in range(1, n)]
+        if self.wall:
+            if sim.money >= sim.barrier_cost:
+                sim.submit(CMD_PLACE_BARRIER, *self.wall.pop(0))
+        else:
+            super().__call__(sim)
+
+
+class RandomStrategy(IdleStrategy):
+    """
+    Случайные постройки в случайных ячейках (воспроизводимо по seed).
+    """
+
+    def __call__(self, sim):
+        if self.rng.random() > 0.02:
+            return
+        width, height = sim.map.size
+        x = self.rng.randrange(0, width, CELL_SIZE)
+        y = self.rng.randrange(0, height, CELL_SIZE)
+        if self.rng.random() < 0.3:
+            sim.submit(CMD_PLACE_BARRIER, x, y)
+        else:
+            sim.submit(CMD_PLACE_WEAPON, x, y)
+
+
+STRATEGIES = {
+    "idle": IdleStrategy,
+    "ring": RingStrategy,
+    "wall": WallStrategy,
+    "random": RandomStrategy,
+}
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ОДНА ИГРА ------------------------------------------------
+# -----------------------------------------------------------------------------------
+# Подклассы с переопределёнными характеристиками: (имя типа, характеристики) -> класс.
+# Кэши main (атласы, виды монстров) держат классы по ссылке, поэтому одинаковые
+# наборы параметров должны давать один и тот же класс, а не новый на каждую игру
+_override_types = {}
+
+
+def build_monster_types(params):
+    """
+    Типы монстров с переопределёнными характеристиками ("Orc.health": 200 и т.п.).
+    Исходные классы не меняются: для изменённых создаются подклассы (по одному на набор).
+    """
+    overrides = {}
+    for key, value in params.items():
+        if "." in key:
+            type_name, stat = key.split(".", 1)
+            if type_name not in MONSTER_TYPES:
+                raise ValueError(f"Неизвестный тип монстра: {type_name}")
+            overrides.setdefault(type_name, {})[stat] = value
+    types = dict(MONSTER_TYPES)
+    for type_name, stats in overrides.items():
+        key = (type_name, frozenset(stats.items()))
+        if key not in _override_types:
+            base = MONSTER_TYPES[type_name]
+            _override_types[key] = type(type_name, (base,),
+                                        {"__slots__": (), "stats": {**base.stats, **stats}})
+        types[type_name] = _override_types[key]
+    return types
+
+
+def build_map(params):
+    if "map" in params:
+        return GameMap.from_settings(params["map"])
+    return load_map(params.get("levels_file", LEVELS_FILE))
+
+
+def build_levels(params, types, game_map):
+    if "levels" not in params:
+        # Стандартные уровни (с подменёнными типами монстров, если они заданы)
+        return default_levels(params.get("levels_file", LEVELS_FILE), types=types, game_map=game_map)
+    return [GameLevel([(types[name], count, delay) for name, count, delay in waves],
+                      spawn_points=game_map.spawn_points)
+            for waves in params["levels"]]
+
+
+def init_worker():
+    """
+    Инициализация процесса пула: Ctrl-C получает только главный процесс,
+    а SIGTERM от pool.terminate() завершает процесс, как обычно.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def run_game(task):
+    """
+    Прогнать одну игру. task: (номер набора, параметры, сценарий, seed, max_ticks, шаг кривой).
+    """
+    set_index, params, strategy_name, seed, max_ticks, sample_every = task
+    types = build_monster_types(params)
+    game_map = build_map(params)
+    sim = Simulation(levels=build_levels(params, types, game_map), game_map=game_map,
+                     **{key: params[key] for key in SIM_PARAMS if key in params})
+    strategy = STRATEGIES[strategy_name](random.Random(seed))
+    money_curve = []
+    while sim.running and sim.tick_count < max_ticks:
+        if sim.tick_count % sample_every == 0:
+            money_curve.append(round(sim.money, 2))
+        strategy(sim)
+        sim.tick()
+    return {
+        "set": set_index,
+        "strategy": strategy_name,
+        "seed": seed,
+        "won": sim.won,
+        "ticks": sim.tick_count,
+        "tower_hp": sim.tower.health,
+        "money": round(sim.money, 2),
+        "score": sim.score,
+        "money_curve": money_curve,
+    }
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ СЕТКА, ПУЛ И СВОДКА --------------------------------------
+# -----------------------------------------------------------------------------------
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def expand_grid(base, grid):
+    """
+    Декартово произведение значений сетки поверх базовых параметров.
+    """
+    keys = list(grid)
+    for values in itertools.product(*(grid[key] for key in keys)):
+        params = dict(base)
+        params.update(zip(keys, values))
+        yield params
+
+
+def mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+def aggregate(param_sets, games):
+    """
+    Свести результаты игр по паре (набор параметров, сценарий).
+    """
+    groups = {}
+    for game in games:
+        groups.setdefault((game["set"], game["strategy"]), []).append(game)
+    summary = []
+    for (set_index, strategy), runs in sorted(groups.items()):
+        length = max(len(run["money_curve"]) for run in runs)
+        curve = [round(mean([run["money_curve"][i] for run in runs if i < len(run["money_curve"])]), 2)
+                 for i in range(length)]
+        summary.append({
+            "params": param_sets[set_index],
+            "strategy": strategy,
+            "games": len(runs),
+            "win_rate": mean([run["won"] for run in runs]),
+            "ticks_mean": mean([run["ticks"] for run in runs]),
+            "ticks_min": min(run["ticks"] for run in runs),
+            "ticks_max": max(run["ticks"] for run in runs),
+            "tower_hp_mean": mean([run["tower_hp"] for run in runs]),
+            "money_mean": mean([run["money"] for run in runs]),
+            "score_mean": mean([run["score"] for run in runs]),
+            "money_curve": curve,
+        })
+    return summary
+
+
+def write_results(path, summary, meta):
+    if path.endswith(".csv"):
+        fields = ["params", "strategy", "games", "win_rate", "ticks_mean", "ticks_min", "ticks_max",
+                  "tower_hp_mean", "money_mean", "score_mean"]
+        with open(path, mode='w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            for row in summary:
+                writer.writerow({**row, "params": json.dumps(row["params"], ensure_ascii=False)})
+    else:
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump({"meta": meta, "results": summary}, f, ensure_ascii=False, indent=1)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный прогон headless-игр для подбора баланса")
+    parser.add_argument("--config", help="JSON-файл с base/grid/strategies/repeats/max_ticks")
+    parser.add_argument("--grid", action="append", default=[], metavar="KEY=V1,V2",
+                        help="значения параметра для перебора (можно повторять)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="фиксированный параметр (можно повторять)")
+    parser.add_argument("--strategy", action="append", choices=sorted(STRATEGIES),
+                        help="сценарий расстановки (по умолчанию ring)")
+    parser.add_argument("--repeats", type=int, default=None, help="игр на каждую комбинацию")
+    parser.add_argument("--max-ticks", type=int, default=None)
+    parser.add_argument("--sample-every", type=int, default=250, help="шаг кривой денег в тиках")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="число процессов")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="batch_results.json", help="файл .json или .csv")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            config = json.load(f)
+    base = dict(config.get("base", {}))
+    grid = dict(config.get("grid", {}))
+    for item in args.set:
+        key, value = item.split("=", 1)
+        base[key] = parse_value(value)
+    for item in args.grid:
+        key, values = item.split("=", 1)
+        grid[key] = [parse_value(v) for v in values.split(",")]
+    strategies = args.strategy or config.get("strategies", ["ring"])
+    repeats = args.repeats or config.get("repeats", 1)
+    max_ticks = args.max_ticks or config.get("max_ticks", 20000)
+
+    param_sets = list(expand_grid(base, grid))
+    tasks = [(i, params, strategy, args.seed + r, max_ticks, args.sample_every)
+             for i, params in enumerate(param_sets)
+             for strategy in strategies
+             for r in range(repeats)]
+    print(f"наборов параметров: {len(param_sets)}, сценариев: {len(strategies)}, "
+          f"игр: {len(tasks)}, процессов: {args.workers}")
+
+    start = time.perf_counter()
+    games = []
+    # spawn: каждый процесс заново импортирует игру, без унаследованного состояния SDL
+    context = multiprocessing.get_context("spawn")
+    chunksize = max(1, len(tasks) // (args.workers * 8))
+    pool = context.Pool(processes=args.workers, initializer=init_worker)
+    try:
+        for n, game in enumerate(pool.imap_unordered(run_game, tasks, chunksize=chunksize), 1):
+            games.append(game)
+            if n % max(1, len(tasks) // 20) == 0 or n == len(tasks):
+                print(f"\r{n}/{len(tasks)}", end="", flush=True)
+        pool.close()
+    except BaseException:
+        # При Ctrl-C или ошибке в игре недоигранные задачи не нужны; процессы
+        # не ловят SIGTERM (см. init_worker), поэтому join() после terminate() не зависает
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    elapsed = time.perf_counter() - start
+    print(f"\nготово за {elapsed:.1f} с ({len(tasks) / elapsed:.1f} игр/с)")
+
+    summary = aggregate(param_sets, games)
+    meta = {"games": len(tasks), "workers": args.workers, "seconds": round(elapsed, 2),
+            "max_ticks": max_ticks, "sample_every": args.sample_every}
+    write_results(args.output, summary, meta)
+    print(f"результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,312 @@
+"""
+Нагрузочный бенчмарк симуляции и отрисовки.
+
+Строит синтетические сценарии (орда монстров, толпа в одном экране, крепость из сотен оружий и
+баррикад, шквал пуль, осада башни, большая карта), прогоняет их под SDL-драйвером dummy и сохраняет
+в JSON тики в секунду, время фаз тика, пиковую память, память объектов по видам
+(memory_report) и стоимость TowerDefenceGame.draw. Два таких файла можно сравнить флагом --compare.
+Отдельно проверяется, что отрисовка «грязными прямоугольниками» не медленнее полной
+(в толпе она должна переходить на целый кадр) — иначе прогон тоже завершается с ошибкой.
+
+Запуск из корня проекта:
+    python benchmarks/bench_stress.py -o bench.json
+    python benchmarks/bench_stress.py -o new.json --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame  # noqa: E402
+import main  # noqa: E402
+from main import (WIDTH, HEIGHT, CELL_SIZE, Simulation, TowerDefenceGame,  # noqa: E402
+                  FrameProfiler, GameMap, Goblin, Orc, Golem, Weapon, Barrier)
+
+# Метрики, по которым ищутся регрессии: (ключ, больше — лучше)
+COMPARED_METRICS = (
+    ("ticks_per_s", True),
+    ("tick_ms", False),
+    ("draw_ms", False),
+    ("draw_dirty_ms", False),
+    ("peak_alloc_mb", False),
+    ("entity_mb", False),
+)
+
+
+class HoldLevel:
+    """
+    Уровень, который никогда не заканчивается и ничего не спавнит:
+    население сценария задаётся заранее.
+    """
+    done = False
+
+    def update(self, monsters_group):
+        pass
+
+
+def free_cell(rng, taken, game_map):
+    """
+    Случайная свободная клетка сетки вдали от башни.
+    """
+    width, height = game_map.size
+    tower = pygame.Rect(0, 0, 160, 160)
+    tower.center = game_map.tower_pos
+    cells = (width // CELL_SIZE) * (height // CELL_SIZE)
+    if len(taken) >= cells - (tower.width // CELL_SIZE + 1) * (tower.height // CELL_SIZE + 1):
+        raise ValueError("на поле не осталось свободных клеток: уменьшите --scale")
+    while True:
+        cell = (rng.randrange(width // CELL_SIZE) * CELL_SIZE, rng.randrange(height // CELL_SIZE) * CELL_SIZE)
+        if cell not in taken and not tower.collidepoint(cell):
+            taken.add(cell)
+            return cell
+
+
+def populate(sim, rng, monsters=0, weapons=0, barriers=0, fire_delay=None, monster_health=None,
+             at_tower=False):
+    taken = set()
+    width, height = sim.map.size
+    tower_x, tower_y = sim.map.tower_pos
+    for _ in range(barriers):
+        sim.barriers.add(Barrier(*free_cell(rng, taken, sim.map)))
+    for _ in range(weapons):
+        weapon = Weapon(*free_cell(rng, taken, sim.map))
+        if fire_delay is not None:
+            weapon.fire_delay = fire_delay
+        sim.weapons.add(weapon)
+    kinds = (Goblin, Orc, Golem)
+    for i in range(monsters):
+        if at_tower:
+            # Монстр сразу у башни: весь прогон он атакует её, ожидая перезарядки удара
+            x, y = tower_x + rng.randrange(-20, 100), tower_y + rng.randrange(-20, 100)
+        else:
+            x, y = rng.randrange(width - 40), rng.randrange(height - 40)
+        monster = kinds[i % len(kinds)](x, y)
+        if monster_health is not None:
+            monster.health = monster.max_health = monster_health
+        sim.monsters.add(monster)
+
+
+# Сценарии: имя -> параметры populate() при масштабе 1
+SCENARIOS = {
+    # Тысячи монстров и немного оружия — нагрузка на движение и атаку
+    "horde": dict(monsters=3000, weapons=20, barriers=20),
+    # Сотни оружий и баррикад — нагрузка на поиск целей и коллизии
+    "fortress": dict(monsters=1000, weapons=150, barriers=100),
+    # Оружие стреляет почти каждый тик по живучим монстрам — тысячи пуль в полёте
+    "storm": dict(monsters=500, weapons=200, barriers=0, fire_delay=2, monster_health=10 ** 6),
+    # Монстры осаждают башню, сотни оружий редко стреляют — почти все ждут перезарядки
+    "siege": dict(monsters=2000, weapons=200, barriers=0, fire_delay=120, monster_health=10 ** 6, at_tower=True),
+    # Несколько сотен монстров в одном экране: «грязных» прямоугольников так много,
+    # что dirty-отрисовка должна переходить на целый кадр (см. dirty_regressions)
+    "crowd": dict(monsters=400, weapons=10, barriers=10),
+    # Карта 4x4 экрана, объекты по всей карте — в кадр попадает примерно шестнадцатая часть
+    "bigmap": dict(monsters=3000, weapons=200, barriers=200, monster_health=10 ** 6, map_scale=4),
+}
+
+
+def build_sim(name, scale, mode, seed):
+    params = dict(SCENARIOS[name])
+    for key in ("monsters", "weapons", "barriers"):
+        params[key] = int(params[key] * scale)
+    k = params.pop("map_scale", 1)
+    # Башня в центре карты, камера игры встанет над ней
+    game_map = GameMap((WIDTH * k, HEIGHT * k), (WIDTH * k // 2, HEIGHT * k // 2))
+    sim = Simulation(levels=[HoldLevel()], tower_health=10 ** 9, use_arrays=(mode == "arrays"),
+                     analytic_bullets=(mode == "analytic"), game_map=game_map)
+    populate(sim, random.Random(seed), **params)
+    return sim
+
+
+def count_bullets(sim):
+    return sim.store.bullet_count if sim.store is not None else len(sim.bullets)
+
+
+def run_case(name, mode, ticks, scale, seed, games):
+    """
+    Прогнать один сценарий: замер тиков с профилировщиком, отрисовки
+    (полной и «грязными прямоугольниками») и отдельным проходом — памяти.
+    """
+    sim = build_sim(name, scale, mode, seed)
+    population = len(sim.monsters)
+    prof = FrameProfiler(window=ticks)
+    sim.profiler = prof
+    for game in games:
+        game.sim = sim
+        game.reset_view()
+    draw_times = [[] for _ in games]
+    fallbacks = games[1].dirty_fallbacks
+    tick_time = 0.0
+    peak_bullets = 0
+
+    for _ in range(ticks):
+        start = time.perf_counter()
+        prof.begin()
+        sim.tick()
+        prof.end()
+        tick_time += time.perf_counter() - start
+        peak_bullets = max(peak_bullets, count_bullets(sim))
+
+        # Каждый кадр рисуется обоими способами по одной и той же сцене
+        for game, times in zip(games, draw_times):
+            start = time.perf_counter()
+            game.draw()
+            times.append(time.perf_counter() - start)
+
+    summary = prof.summary()
+    result = {
+        "scenario": name,
+        "mode": mode,
+        "ticks": ticks,
+        "monsters_start": population,
+        "monsters_end": len(sim.monsters),
+        "weapons": len(sim.weapons),
+        "barriers": len(sim.barriers),
+        "peak_bullets": peak_bullets,
+        "ticks_per_s": ticks / tick_time,
+        "tick_ms": tick_time / ticks * 1000,
+        "tick_p95_ms": summary["frame"]["p95_ms"],
+        "phases_ms": {phase: stats["mean_ms"] for phase, stats in summary["phases"].items()},
+        "draw_ms": mean_ms(draw_times[0]),
+        "draw_dirty_ms": mean_ms(draw_times[1]),
+        # Доля кадров, которые dirty-отрисовка отдала целиком из-за толпы
+        "draw_fallback_share": (games[1].dirty_fallbacks - fallbacks) / ticks,
+    }
+    memory = main.memory_report(sim)
+    result["entity_mb"] = memory["total"]["bytes"] / 2 ** 20
+    result["memory"] = memory
+
+    # Память меряется отдельным коротким проходом: tracemalloc сильно замедляет код
+    tracemalloc.start()
+    sim = build_sim(name, scale, mode, seed)
+    for _ in range(min(ticks, 20)):
+        sim.tick()
+    result["peak_alloc_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result
+
+
+def mean_ms(samples):
+    return sum(samples) / len(samples) * 1000 if samples else 0.0
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(results, baseline_file, tolerance):
+    """
+    Сравнить результаты с сохранённым файлом и вернуть список регрессий.
+    """
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = {(r["scenario"], r["mode"]): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\nсравнение с {baseline_file} (допуск {tolerance:.0%})")
+    for result in results:
+        old = baseline.get((result["scenario"], result["mode"]))
+        if old is None:
+            continue
+        for key, higher_is_better in COMPARED_METRICS:
+            if not old.get(key) or key not in result:
+                continue
+            ratio = result[key] / old[key]
+            worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+            mark = "  РЕГРЕССИЯ" if worse else ""
+            print(f"  {result['scenario']:>9} {result['mode']:>7} {key:>14}: "
+                  f"{old[key]:10.3f} -> {result[key]:10.3f} ({ratio:5.2f}x){mark}")
+            if worse:
+                regressions.append((result["scenario"], result["mode"], key))
+    return regressions
+
+
+def dirty_regressions(results, tolerance):
+    """
+    Случаи, где отрисовка «грязными прямоугольниками» заметно медленнее полной
+    по той же сцене: так было в толпе до перехода на целый кадр.
+    """
+    regressions = []
+    for result in results:
+        if result["draw_dirty_ms"] > result["draw_ms"] * (1 + tolerance):
+            print(f"  {result['scenario']:>9} {result['mode']:>7}: dirty {result['draw_dirty_ms']:.2f} мс "
+                  f"медленнее полного кадра {result['draw_ms']:.2f} мс  РЕГРЕССИЯ")
+            regressions.append((result["scenario"], result["mode"], "draw_dirty_ms"))
+    return regressions
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--mode", nargs="+", choices=["sprites", "arrays", "analytic"], default=None,
+                        help="хранение монстров (по умолчанию sprites и arrays, arrays — если есть numpy); "
+                             "analytic — спрайты с аналитическими пулями")
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="множитель числа объектов в сценариях")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="bench_stress.json")
+    parser.add_argument("--compare", metavar="FILE", help="файл прошлого прогона для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="допустимое ухудшение метрики при сравнении (доля)")
+    args = parser.parse_args(argv)
+
+    modes = args.mode or (["sprites", "arrays"] if main.np is not None else ["sprites"])
+    if "arrays" in modes and main.np is None:
+        parser.error("для режима arrays нужен numpy")
+
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    main.preload_images()
+    # Одна игра рисует полный кадр, вторая — «грязными прямоугольниками»
+    games = (TowerDefenceGame(screen), TowerDefenceGame(screen, dirty_rendering=True))
+
+    results = []
+    print(f"{'сценарий':>9} {'режим':>7} {'монстров':>9} {'пуль':>6} {'тиков/с':>9} "
+          f"{'тик, мс':>8} {'кадр, мс':>9} {'dirty, мс':>10} {'память, МБ':>11} {'объекты, МБ':>12}")
+    for name in args.scenario:
+        for mode in modes:
+            r = run_case(name, mode, args.ticks, args.scale, args.seed, games)
+            results.append(r)
+            print(f"{name:>9} {mode:>7} {r['monsters_start']:>9} {r['peak_bullets']:>6} {r['ticks_per_s']:>9.1f} "
+                  f"{r['tick_ms']:>8.2f} {r['draw_ms']:>9.2f} {r['draw_dirty_ms']:>10.2f} {r['peak_alloc_mb']:>11.1f} {r['entity_mb']:>12.2f}")
+            phases = "  ".join(f"{phase} {ms:.2f}" for phase, ms in r["phases_ms"].items())
+            print(f"{'':>18} фазы, мс: {phases}")
+
+    data = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "numpy": main.np.__version__ if main.np is not None else None,
+            "platform": platform.platform(),
+            "ticks": args.ticks,
+            "scale": args.scale,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"результаты сохранены в {args.output}")
+
+    regressions = dirty_regressions(results, args.tolerance)
+    if args.compare:
+        regressions += compare(results, args.compare, args.tolerance)
+    if regressions:
+        print(f"найдено регрессий: {len(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
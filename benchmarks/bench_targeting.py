@@ -0,0 +1,75 @@
+"""
+Бенчмарк поиска цели оружием: полный перебор монстров против SpatialHash.
+
+Запуск из корня проекта:
+    SDL_VIDEODRIVER=dummy python benchmarks/bench_targeting.py
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame  # noqa: E402
+from main import WIDTH, HEIGHT, CELL_SIZE, SpatialHash, Weapon, Goblin  # noqa: E402
+
+
+def make_monsters(count, rng):
+    monsters = pygame.sprite.Group()
+    for _ in range(count):
+        monsters.add(Goblin(rng.randrange(WIDTH), rng.randrange(HEIGHT)))
+    return monsters
+
+
+def make_weapons(count, rng, fire_range):
+    weapons = []
+    for _ in range(count):
+        x = rng.randrange(WIDTH // CELL_SIZE) * CELL_SIZE
+        y = rng.randrange(HEIGHT // CELL_SIZE) * CELL_SIZE
+        weapons.append(Weapon(x, y, fire_range=fire_range))
+    return weapons
+
+
+def time_tick(weapons, monsters, use_index, repeats):
+    """
+    Среднее время одного тика, в котором стреляют все оружия (мс).
+    В режиме с индексом в замер входит и перестройка сетки.
+    """
+    index = SpatialHash()
+    bullets = pygame.sprite.Group()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        if use_index:
+            index.rebuild(monsters)
+        for weapon in weapons:
+            weapon.fire_timer = 0
+            weapon.update(monsters, bullets, index if use_index else None)
+        bullets.empty()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--weapons", type=int, default=100)
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 500, 1000, 5000])
+    parser.add_argument("--range", type=int, default=None, dest="fire_range",
+                        help="дальность стрельбы (по умолчанию без ограничения)")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    weapons = make_weapons(args.weapons, rng, args.fire_range)
+    print(f"оружий: {args.weapons}, дальность: {args.fire_range or 'без ограничения'}")
+    print(f"{'монстров':>10} {'перебор, мс':>14} {'сетка, мс':>12} {'ускорение':>10}")
+    for count in args.counts:
+        monsters = make_monsters(count, rng)
+        brute = time_tick(weapons, monsters, False, args.repeats)
+        grid = time_tick(weapons, monsters, True, args.repeats)
+        print(f"{count:>10} {brute:>14.3f} {grid:>12.3f} {brute / grid:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
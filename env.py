@@ -0,0 +1,407 @@
+"""
+Среда в стиле gym для обучения ботов расстановки.
+
+TowerDefenceEnv оборачивает Simulation: reset(seed) начинает новую игру,
+step(action) ставит баррикаду или оружие в ячейку сетки CELL_SIZE и
+прогоняет несколько тиков логики, возвращая наблюдение, награду и флаги
+конца эпизода. VectorEnv шагает N независимых сред в пуле процессов,
+а наблюдения, награды и флаги складывает в общую память без копирования
+через каналы.
+
+Сетка расстановки покрывает карту из файла уровней: для стандартной карты
+размером с окно её размеры — GRID_COLS x GRID_ROWS, для карты из ключа "map"
+файла уровней — env.grid_cols x env.grid_rows (число действий и длина
+наблюдения тоже берутся у среды: env.action_count, env.obs_size).
+
+Пример:
+    env = TowerDefenceEnv()
+    obs, info = env.reset(seed=0)
+    obs, reward, terminated, truncated, info = env.step(env.weapon_action(12, 5))
+
+Замер скорости обучения (шагов среды в секунду) случайной политикой:
+    python env.py --envs 16 --workers 4 --steps 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import multiprocessing
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from main import (  # noqa: E402
+    np, CELL_SIZE, WIDTH, HEIGHT, LEVELS_FILE, GameLevel, Simulation, endless_levels, load_map, load_waves,
+)
+
+# Размер сетки расстановки на стандартной карте
+GRID_COLS = WIDTH // CELL_SIZE
+GRID_ROWS = HEIGHT // CELL_SIZE
+GRID_CELLS = GRID_COLS * GRID_ROWS
+
+# Действия: 0 — ничего не ставить, 1..GRID_CELLS — баррикада в ячейку,
+# GRID_CELLS+1..2*GRID_CELLS — оружие (ячейки нумеруются по строкам)
+ACTION_NOOP = 0
+ACTION_COUNT = 1 + 2 * GRID_CELLS
+
+# Наблюдение — плоский вектор float32: OBS_CHANNELS слоёв сетки GRID_ROWS x GRID_COLS
+# (здоровье монстров /100, число монстров, здоровье баррикад /100, оружие),
+# затем OBS_SCALARS чисел (деньги /100, доля здоровья башни, номер уровня, доля max_ticks)
+OBS_CHANNELS = 4
+OBS_SCALARS = 4
+OBS_SIZE = OBS_CHANNELS * GRID_CELLS + OBS_SCALARS
+
+
+def grid_size(game_map):
+    """
+    Размер сетки расстановки (столбцы, строки), покрывающей карту game_map.
+    """
+    width, height = game_map.size
+    return -(-width // CELL_SIZE), -(-height // CELL_SIZE)
+
+
+def observation_grid(obs, grid_cols=GRID_COLS, grid_rows=GRID_ROWS):
+    """
+    Слои сетки из плоского наблюдения: массив (OBS_CHANNELS, grid_rows, grid_cols).
+    """
+    return obs[..., :OBS_CHANNELS * grid_cols * grid_rows].reshape(
+        obs.shape[:-1] + (OBS_CHANNELS, grid_rows, grid_cols))
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ОДНА СРЕДА ------------------------------------------------
+# -----------------------------------------------------------------------------------
+class TowerDefenceEnv:
+    """
+    Одна игра как среда обучения с подкреплением.
+
+    Награда за шаг — число пройденных за шаг уровней минус доля здоровья
+    башни, потерянная за шаг. Эпизод завершается (terminated), когда игра
+    окончена победой или поражением, и обрезается (truncated) по max_ticks.
+
+    Обычные уровни детерминированы, и seed в reset() задаёт только генератор
+    rng среды; с endless=True по seed ещё и генерируются уровни.
+    Карта (размер, башня, точки спавна) и сетка действий берутся из levels_file.
+    Остальные именованные параметры передаются в Simulation
+    (tower_health, start_money, use_arrays, flow_field и т.д.).
+    """
+
+    def __init__(self, frame_skip=10, max_ticks=20000, endless=False, levels_file=LEVELS_FILE, obs_out=None,
+                 **sim_kwargs):
+        if np is None:
+            raise ImportError("Для TowerDefenceEnv нужен пакет numpy")
+        self.frame_skip = frame_skip  # тиков логики на один шаг среды
+        self.max_ticks = max_ticks
+        self.endless = endless
+        # Волны обычных уровней читаются из файла один раз, а не на каждый reset()
+        self.waves = None if endless else load_waves(levels_file)
+        self.map = load_map(levels_file)
+        self.grid_cols, self.grid_rows = grid_size(self.map)
+        self.grid_cells = self.grid_cols * self.grid_rows
+        self.action_count = 1 + 2 * self.grid_cells
+        self.obs_size = OBS_CHANNELS * self.grid_cells + OBS_SCALARS
+        self.sim_kwargs = sim_kwargs
+        self.tower_health = sim_kwargs.get("tower_health", 600)
+        # Наблюдение пишется на место: VectorEnv передаёт сюда строку общей памяти
+        self.obs = obs_out if obs_out is not None else np.zeros(self.obs_size, dtype=np.float32)
+        self._grid = observation_grid(self.obs, self.grid_cols, self.grid_rows)
+        self.rng = random.Random()
+        self.sim = None
+
+    # ------------------------ действия ------------------------
+    def barrier_action(self, col, row):
+        return 1 + row * self.grid_cols + col
+
+    def weapon_action(self, col, row):
+        return 1 + self.grid_cells + row * self.grid_cols + col
+
+    def sample_action(self, build_chance=0.1):
+        """
+        Случайное действие из rng среды: с вероятностью build_chance — постройка.
+        """
+        if self.rng.random() >= build_chance:
+            return ACTION_NOOP
+        return self.rng.randrange(1, self.action_count)
+
+    def _apply(self, action):
+        """
+        Выполнить действие. Возвращает True, если что-то построено.
+        """
+        if action == ACTION_NOOP:
+            return False
+        if not 0 < action < self.action_count:
+            raise ValueError(f"Некорректное действие: {action}")
+        cell = (action - 1) % self.grid_cells
+        x = cell % self.grid_cols * CELL_SIZE
+        y = cell // self.grid_cols * CELL_SIZE
+        if action <= self.grid_cells:
+            return self.sim.place_barrier(x, y)
+        return self.sim.place_weapon(x, y)
+
+    # ------------------------ наблюдение ------------------------
+    def _observe(self):
+        sim = self.sim
+        grid = self._grid
+        cols, rows, cells_count = self.grid_cols, self.grid_rows, self.grid_cells
+        grid.fill(0)
+        store = sim.store
+        if store is not None:
+            live = store.m_alive[:store.m_count]
+            cx = (store.m_x[:store.m_count] + store.m_w[:store.m_count] // 2)[live]
+            cy = (store.m_y[:store.m_count] + store.m_h[:store.m_count] // 2)[live]
+            health = store.m_health[:store.m_count][live]
+        else:
+            monsters = sim.monsters.sprites()
+            cx = np.fromiter((m.rect.centerx for m in monsters), dtype=np.int32, count=len(monsters))
+            cy = np.fromiter((m.rect.centery for m in monsters), dtype=np.int32, count=len(monsters))
+            health = np.fromiter((m.health for m in monsters), dtype=np.int32, count=len(monsters))
+        if len(cx):
+            # Номер ячейки по строкам; bincount заметно быстрее np.add.at на малых массивах
+            cells = np.clip(cy // CELL_SIZE, 0, rows - 1) * cols + np.clip(cx // CELL_SIZE, 0, cols - 1)
+            grid[0].flat[:] = np.bincount(cells, weights=health, minlength=cells_count) / 100
+            grid[1].flat[:] = np.bincount(cells, minlength=cells_count)
+        for barrier in sim.barriers:
+            grid[2, barrier.rect.y // CELL_SIZE, barrier.rect.x // CELL_SIZE] += barrier.health / 100
+        for weapon in sim.weapons:
+            grid[3, weapon.rect.y // CELL_SIZE, weapon.rect.x // CELL_SIZE] += 1
+        scalars = self.obs[OBS_CHANNELS * cells_count:]
+        scalars[0] = sim.money / 100
+        scalars[1] = sim.tower.health / self.tower_health
+        scalars[2] = sim.current_level_index
+        scalars[3] = sim.tick_count / self.max_ticks
+        return self.obs
+
+    def _info(self):
+        sim = self.sim
+        return {"tick": sim.tick_count, "score": sim.score, "money": sim.money,
+                "tower_hp": sim.tower.health, "won": sim.won}
+
+    # ------------------------ интерфейс gym ------------------------
+    def _reset(self, seed=None):
+        if seed is not None:
+            self.rng.seed(seed)
+        if self.endless:
+            levels = endless_levels(self.rng.randrange(2 ** 31), spawn_points=self.map.spawn_points)
+        else:
+            levels = [GameLevel(waves, spawn_points=self.map.spawn_points) for waves in self.waves]
+        self.sim = Simulation(levels=levels, game_map=self.map, **self.sim_kwargs)
+        self._observe()
+        return self._info()
+
+    def _step(self, action):
+        sim = self.sim
+        placed = self._apply(action)
+        score, health = sim.score, sim.tower.health
+        sim.step(min(self.frame_skip, self.max_ticks - sim.tick_count))
+        self._observe()
+        reward = (sim.score - score) - (health - sim.tower.health) / self.tower_health
+        # Победа видна сразу после последнего уровня, не дожидаясь следующего тика
+        terminated = not sim.running or sim.current_level is None
+        truncated = not terminated and sim.tick_count >= self.max_ticks
+        info = self._info()
+        info["placed"] = placed
+        return reward, terminated, truncated, info
+
+    def reset(self, seed=None):
+        """
+        Начать новую игру. Возвращает (наблюдение, info).
+        """
+        info = self._reset(seed)
+        return self.obs.copy(), info
+
+    def step(self, action):
+        """
+        Выполнить действие и прогнать frame_skip тиков.
+        Возвращает (наблюдение, награда, terminated, truncated, info).
+        """
+        reward, terminated, truncated, info = self._step(action)
+        return self.obs.copy(), reward, terminated, truncated, info
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ВЕКТОРНАЯ СРЕДА -------------------------------------------
+# -----------------------------------------------------------------------------------
+class EnvBatch:
+    """
+    Несколько сред одного процесса, пишущих в свои строки общих буферов.
+    Закончившаяся среда сразу начинает новый эпизод (автосброс): флаги
+    конца эпизода остаются в буферах, а наблюдение — уже нового эпизода.
+    """
+
+    def __init__(self, first, count, buffers, env_kwargs):
+        obs, self.rewards, self.terminated, self.truncated = (
+            np.frombuffer(buf, dtype=dtype).reshape(shape) for buf, dtype, shape in buffers)
+        self.first = first
+        self.envs = [TowerDefenceEnv(obs_out=obs[first + i], **env_kwargs) for i in range(count)]
+        self.episodes = [0] * count
+        self.returns = [0.0] * count
+
+    def reset(self, seeds):
+        infos = []
+        for i, (env, seed) in enumerate(zip(self.envs, seeds)):
+            self.returns[i] = 0.0
+            infos.append(env._reset(seed))
+        return infos
+
+    def step(self, actions):
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            reward, terminated, truncated, info = env._step(action)
+            n = self.first + i
+            self.rewards[n] = reward
+            self.terminated[n] = terminated
+            self.truncated[n] = truncated
+            self.returns[i] += reward
+            if terminated or truncated:
+                info["episode"] = {"return": self.returns[i], "ticks": info["tick"]}
+                self.episodes[i] += 1
+                self.returns[i] = 0.0
+                env._reset()
+            infos.append(info)
+        return infos
+
+
+def _worker(conn, first, count, buffers, env_kwargs):
+    batch = EnvBatch(first, count, buffers, env_kwargs)
+    while True:
+        command, payload = conn.recv()
+        if command == "close":
+            break
+        conn.send(getattr(batch, command)(payload))
+    conn.close()
+
+
+class VectorEnv:
+    """
+    N независимых TowerDefenceEnv в workers процессах (по непрерывному куску
+    сред на процесс). Наблюдения (N, obs_size), награды и флаги лежат в общей
+    памяти: step() только рассылает действия и ждёт ответа процессов.
+    Возвращаемые массивы — представления общих буферов и перезаписываются
+    следующим шагом. С workers=0 все среды шагают в текущем процессе.
+    """
+
+    def __init__(self, num_envs, workers=None, **env_kwargs):
+        if np is None:
+            raise ImportError("Для VectorEnv нужен пакет numpy")
+        self.num_envs = num_envs
+        # Сетка, действия и длина наблюдения — как у сред, по карте файла уровней
+        self.grid_cols, self.grid_rows = grid_size(load_map(env_kwargs.get("levels_file", LEVELS_FILE)))
+        self.action_count = 1 + 2 * self.grid_cols * self.grid_rows
+        self.obs_size = OBS_CHANNELS * self.grid_cols * self.grid_rows + OBS_SCALARS
+        workers = min(num_envs, os.cpu_count() if workers is None else workers)
+        # spawn: каждый процесс заново импортирует игру, без унаследованного состояния SDL
+        context = multiprocessing.get_context("spawn")
+        layout = (("f", np.float32, (num_envs, self.obs_size)), ("d", np.float64, (num_envs,)),
+                  ("b", np.bool_, (num_envs,)), ("b", np.bool_, (num_envs,)))
+        buffers = [(context.RawArray(code, int(np.prod(shape))), dtype, shape) for code, dtype, shape in layout]
+        self.observations, self.rewards, self.terminated, self.truncated = (
+            np.frombuffer(buf, dtype=dtype).reshape(shape) for buf, dtype, shape in buffers)
+
+        # Куски сред по процессам: (первая среда, число сред)
+        self.slices = []
+        first = 0
+        for w in range(max(1, workers)):
+            count = num_envs // max(1, workers) + (w < num_envs % max(1, workers))
+            self.slices.append((first, count))
+            first += count
+        self.local = None
+        self.conns = []
+        self.processes = []
+        if workers == 0:
+            self.local = EnvBatch(0, num_envs, buffers, env_kwargs)
+            return
+        for first, count in self.slices:
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(child, first, count, buffers, env_kwargs), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def _call(self, command, payloads):
+        if self.local is not None:
+            return getattr(self.local, command)(payloads[0])
+        for conn, payload in zip(self.conns, payloads):
+            conn.send((command, payload))
+        infos = []
+        for conn in self.conns:
+            infos.extend(conn.recv())
+        return infos
+
+    def _split(self, values):
+        return [values[first:first + count] for first, count in self.slices]
+
+    def reset(self, seed=None):
+        """
+        Начать новые игры во всех средах (среда i получает seed + i).
+        Возвращает (наблюдения, список info).
+        """
+        seeds = [None if seed is None else seed + i for i in range(self.num_envs)]
+        infos = self._call("reset", self._split(seeds))
+        return self.observations, infos
+
+    def step(self, actions):
+        """
+        Шаг всех сред. actions — N целых действий.
+        Возвращает (наблюдения, награды, terminated, truncated, список info).
+        """
+        actions = [int(action) for action in actions]
+        if len(actions) != self.num_envs:
+            raise ValueError(f"Нужно {self.num_envs} действий, передано {len(actions)}")
+        infos = self._call("step", self._split(actions))
+        return self.observations, self.rewards, self.terminated, self.truncated, infos
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("close", None))
+            except OSError:
+                pass  # процесс уже завершился
+        # join вместо terminate: SDL в процессах перехватывает SIGTERM
+        for process in self.processes:
+            process.join()
+        for conn in self.conns:
+            conn.close()
+        self.conns = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ЗАМЕР СКОРОСТИ -------------------------------------------
+# -----------------------------------------------------------------------------------
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Замер шагов среды в секунду при случайной политике")
+    parser.add_argument("--envs", type=int, default=8, help="число сред")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="число процессов (0 — все среды в текущем процессе)")
+    parser.add_argument("--steps", type=int, default=1000, help="шагов векторной среды")
+    parser.add_argument("--frame-skip", type=int, default=10, help="тиков логики на шаг")
+    parser.add_argument("--build-chance", type=float, default=0.05, help="доля шагов с постройкой")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--levels", default=LEVELS_FILE, help="файл уровней (и карты)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    with VectorEnv(args.envs, workers=args.workers, frame_skip=args.frame_skip, levels_file=args.levels) as envs:
+        envs.reset(seed=args.seed)
+        episodes = 0
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            actions = [rng.randrange(1, envs.action_count) if rng.random() < args.build_chance else ACTION_NOOP
+                       for _ in range(args.envs)]
+            _, _, terminated, truncated, _ = envs.step(actions)
+            episodes += int(terminated.sum() + truncated.sum())
+        elapsed = time.perf_counter() - start
+    steps = args.steps * args.envs
+    print(f"сред: {args.envs}, процессов: {args.workers}, шагов: {steps}, эпизодов: {episodes}")
+    print(f"{steps / elapsed:.0f} шагов/с, {steps * args.frame_skip / elapsed:.0f} тиков/с")
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,35 +1,249 @@
 import os
 import sys
 import csv
+import json
+import time
+import heapq
+import random
+import itertools
+import zlib
+import base64
+import sqlite3
+import argparse
+import math
+import threading
+import queue
+from array import array
+from collections import deque, OrderedDict
 import pygame
 
-pygame.init()
-pygame.display.set_caption("Tower Defence Example")
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для EntityStore
+    np = None
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ЗАПУСК: ЛЕНИВАЯ ИНИЦИАЛИЗАЦИЯ -----------------------------
+# -----------------------------------------------------------------------------------
+# Импорт модуля ничего не инициализирует: окно поднимает init_display(),
+# шрифты — get_font(). Звук, джойстики и прочие подсистемы pygame игре не нужны.
+WINDOW_CAPTION = "Tower Defence Example"
+
+
+def init_display(size):
+    """
+    Инициализировать только видеоподсистему и открыть окно игры.
+    """
+    pygame.display.init()
+    pygame.display.set_caption(WINDOW_CAPTION)
+    return pygame.display.set_mode(size)
+
+
+class StartupReport:
+    """
+    Замер этапов запуска до первого кадра: mark(этап) записывает время,
+    прошедшее с предыдущей отметки.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages = []  # (этап, секунды)
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self._last))
+        self._last = now
+
+    def total(self):
+        return self._last - self.started
+
+    def lines(self):
+        lines = [f"  {stage:<12} {seconds * 1000:8.1f} мс" for stage, seconds in self.stages]
+        lines.append(f"  {'итого':<12} {self.total() * 1000:8.1f} мс")
+        return lines
 
 
 # -----------------------------------------------------------------------------------
 # ------------------------ ФУНКЦИЯ ЗАГРУЗКИ ИЗОБРАЖЕНИЙ -----------------------------
 # -----------------------------------------------------------------------------------
+# Общий кэш изображений на весь процесс: (имя, colorkey) -> подготовленная поверхность.
+# Поверхности не изменяются после загрузки, поэтому их можно разделять между спрайтами.
+_image_cache = {}
+image_cache_stats = {"hits": 0, "misses": 0}
+# Пока кэш заморожен (идёт game_loop), промах кэша — ошибка, а не чтение с диска
+_image_cache_frozen = False
+
+
 def load_image(name, colorkey=None):
     """
     Загружает изображение из папки data.
     Если colorkey задан, устанавливает прозрачность.
+    Повторные вызовы с теми же аргументами возвращают закэшированную поверхность
+    без обращения к диску.
     """
+    key = (name, colorkey)
+    image = _image_cache.get(key)
+    if image is not None:
+        image_cache_stats["hits"] += 1
+        return image
+    image_cache_stats["misses"] += 1
+    if _image_cache_frozen:
+        raise RuntimeError(f"Изображение '{name}' не загружено заранее, а во время игры диск не читается")
+
     fullname = os.path.join('data', name)
     if not os.path.isfile(fullname):
         print(f"Файл с изображением '{fullname}' не найден")
         sys.exit()
-    image = pygame.image.load(fullname)
+    image = prepare_image(pygame.image.load(fullname), colorkey)
+    _image_cache[key] = image
+    return image
+
+
+def prepare_image(image, colorkey=None):
+    """
+    Подготовить декодированную поверхность: конвертировать под формат окна
+    и установить прозрачность. Вызывается только из основного потока.
+    """
+    # Без окна (headless-симуляция) конвертировать поверхность не во что
+    has_display = pygame.display.get_surface() is not None
     if colorkey is not None:
-        image = image.convert()
+        if has_display:
+            image = image.convert()
         if colorkey == -1:
             colorkey = image.get_at((0, 0))
         image.set_colorkey(colorkey)
-    else:
+    elif has_display:
         image = image.convert_alpha()
     return image
 
 
+def image_names(directory='data'):
+    """
+    Все *.png в папке directory и её подпапках — пути относительно неё.
+    """
+    names = []
+    for root, _, files in os.walk(directory):
+        for f in files:
+            if f.endswith('.png'):
+                names.append(os.path.relpath(os.path.join(root, f), directory))
+    return sorted(names)
+
+
+def preload_images(names=None, colorkey=None):
+    """
+    Заранее загружает изображения в кэш (по умолчанию — все *.png из папки data),
+    чтобы первый спавн монстра или первый выстрел не читали файл с диска.
+    """
+    if names is None:
+        names = image_names()
+    for name in names:
+        load_image(name, colorkey)
+
+
+def freeze_image_cache(frozen=True):
+    """
+    Запретить (или снова разрешить) загрузку изображений с диска:
+    в замороженном кэше промах вызывает RuntimeError.
+    """
+    global _image_cache_frozen
+    _image_cache_frozen = frozen
+
+
+def clear_image_cache():
+    """
+    Очищает кэш изображений (и собранные из них атласы и виды монстров)
+    и обнуляет счётчики попаданий/промахов.
+    """
+    _image_cache.clear()
+    _atlas_cache.clear()
+    _kind_cache.clear()
+    _monster_kinds.clear()
+    image_cache_stats["hits"] = 0
+    image_cache_stats["misses"] = 0
+
+
+class AssetLoader:
+    """
+    Фоновая загрузка изображений: рабочий поток читает и декодирует файлы,
+    а pump() в основном потоке конвертирует готовые поверхности под окно
+    (convert/convert_alpha можно звать только там) и кладёт их в общий кэш.
+    Так стартовый экран остаётся отзывчивым, а к началу игры все спрайты
+    уже в памяти.
+    """
+
+    def __init__(self, names=None, colorkey=None):
+        self.names = image_names() if names is None else list(names)
+        self.colorkey = colorkey
+        self.total = len(self.names)
+        self.loaded = 0
+        self._decoded = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """
+        Запустить рабочий поток (повторный вызов ничего не делает).
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._decode_all, name="asset-loader", daemon=True)
+            self._thread.start()
+        return self
+
+    def _decode_all(self):
+        for name in self.names:
+            try:
+                image = pygame.image.load(os.path.join('data', name))
+            except (pygame.error, OSError) as error:
+                image = error
+            self._decoded.put((name, image))
+
+    @property
+    def done(self):
+        return self.loaded == self.total
+
+    @property
+    def progress(self):
+        """
+        Доля загруженных изображений (от 0 до 1).
+        """
+        return self.loaded / self.total if self.total else 1.0
+
+    def pump(self, budget=0.005):
+        """
+        Подготовить декодированные изображения, пока не истечёт budget секунд
+        (None — без ограничения). Возвращает True, если что-то добавилось.
+        """
+        deadline = None if budget is None else time.perf_counter() + budget
+        added = False
+        while not self.done:
+            try:
+                name, image = self._decoded.get_nowait()
+            except queue.Empty:
+                break
+            self._accept(name, image)
+            added = True
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        return added
+
+    def finish(self):
+        """
+        Дождаться загрузки всех изображений (поток запускается, если ещё не запущен).
+        """
+        self.start()
+        while not self.done:
+            self._accept(*self._decoded.get())
+
+    def _accept(self, name, image):
+        self.loaded += 1
+        if isinstance(image, Exception):
+            raise image
+        # Картинку могли уже загрузить синхронно — не подменяем её
+        key = (name, self.colorkey)
+        if key not in _image_cache:
+            _image_cache[key] = prepare_image(image, self.colorkey)
+
+
 # -----------------------------------------------------------------------------------
 # ------------------------ КОНСТАНТЫ И НАСТРОЙКИ -------------------------------------
 # -----------------------------------------------------------------------------------
@@ -57,6 +271,96 @@ START_MONEY = 180
 # Размер ячейки (для «сеточного» размещения)
 CELL_SIZE = 40
 
+# Прокрутка камеры стрелками, пикселей в секунду
+CAMERA_SPEED = 600
+
+# Сторона квадратного куска (чанка) заранее собранного фона, пиксели
+CHUNK_SIZE = 256
+
+# Когда «грязных» прямоугольников больше этого числа или они покрывают
+# больше этой доли экрана, кадр дешевле перерисовать и отдать целиком
+DIRTY_MAX_RECTS = 400
+DIRTY_MAX_SHARE = 0.5
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ШРИФТЫ И КЭШ ТЕКСТА --------------------------------------
+# -----------------------------------------------------------------------------------
+# Общие объекты шрифтов: (имя, размер) -> pygame.font.Font.
+_font_cache = {}
+
+# Поиск системного шрифта по имени (то, что делает SysFont) просматривает все шрифты
+# системы, поэтому найденный путь запоминается в файле и при следующих запусках
+# берётся оттуда. Удалите файл, чтобы поискать шрифты заново.
+FONT_PATHS_FILE = "font_paths.json"
+_font_paths = None  # имя -> путь к файлу шрифта (None — шрифт по умолчанию pygame)
+
+
+def resolve_font(name):
+    """
+    Путь к системному шрифту с именем name (или None, если такого нет).
+    """
+    global _font_paths
+    if _font_paths is None:
+        try:
+            with open(FONT_PATHS_FILE, encoding="utf-8") as f:
+                _font_paths = json.load(f)
+        except (OSError, ValueError):
+            _font_paths = {}
+    path = _font_paths.get(name, "")
+    if path == "" or (path is not None and not os.path.isfile(path)):
+        # Имени нет в файле или шрифт с тех пор удалили
+        path = pygame.font.match_font(name)
+        _font_paths[name] = path
+        try:
+            with open(FONT_PATHS_FILE, "w", encoding="utf-8") as f:
+                json.dump(_font_paths, f, ensure_ascii=False, indent=2)
+        except OSError:
+            pass  # без записи кэша шрифт просто будет искаться и в следующий раз
+    return path
+
+
+def get_font(size, name="arial"):
+    """
+    Вернуть общий для всей игры шрифт заданного размера.
+    """
+    key = (name, size)
+    font = _font_cache.get(key)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        # То же, что pygame.font.SysFont(name, size), но без поиска по системе
+        font = pygame.font.Font(resolve_font(name), size)
+        _font_cache[key] = font
+    return font
+
+
+class TextLabel:
+    """
+    Текстовая надпись, которая хранит отрисованную поверхность
+    и вызывает font.render только при изменении текста.
+    """
+
+    def __init__(self, font, color, text=None):
+        self.font = font
+        self.color = color
+        self.text = None
+        self.surface = None
+        if text is not None:
+            self.render(text)
+
+    def render(self, text):
+        if text != self.text:
+            self.text = text
+            self.surface = self.font.render(text, True, self.color)
+        return self.surface
+
+    def draw(self, screen, text, pos):
+        """
+        Нарисовать текст в точке pos, возвращает занятый прямоугольник.
+        """
+        return screen.blit(self.render(text), pos)
+
 
 # -----------------------------------------------------------------------------------
 # ------------------------ КЛАСС КНОПКИ ----------------------------------------------
@@ -72,11 +376,12 @@ class Button:
         self.text = text
         self.text_color = text_color
         self.font_size = font_size
-        self.font = pygame.font.SysFont("arial", self.font_size)
+        self.font = get_font(self.font_size)
+        self.label = TextLabel(self.font, self.text_color, self.text)
 
     def draw(self, screen):
         pygame.draw.rect(screen, self.color, self.rect)
-        text_surface = self.font.render(self.text, True, self.text_color)
+        text_surface = self.label.render(self.text)
         text_rect = text_surface.get_rect(center=self.rect.center)
         screen.blit(text_surface, text_rect)
 
@@ -125,6 +430,199 @@ class ScoreTable:
         return scores[:top_n]
 
 
+class SqliteScoreTable:
+    """
+    Таблица результатов в SQLite с тем же интерфейсом, что и ScoreTable.
+    Индекс по очкам даёт вставку за O(log n) и чтение top_n без перебора
+    всех записей; WAL и ожидание блокировки позволяют нескольким копиям игры
+    безопасно писать в один файл. При первом запуске переносит записи
+    из старого CSV-файла.
+    """
+
+    def __init__(self, filename="results.db", legacy_csv="results.csv", timeout=10.0):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS scores ("
+                              "id INTEGER PRIMARY KEY, name TEXT NOT NULL, score INTEGER NOT NULL)")
+            # При равных очках раньше идёт более ранняя запись, как в ScoreTable
+            self.conn.execute("CREATE INDEX IF NOT EXISTS scores_top ON scores (score DESC, id)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_csv and os.path.exists(legacy_csv):
+            self._import_legacy(legacy_csv)
+
+    def _import_legacy(self, csv_filename):
+        """
+        Один раз импортировать старый CSV (отметка хранится в таблице meta).
+        Проверка отметки и импорт идут одной транзакцией BEGIN IMMEDIATE:
+        вторая копия игры ждёт блокировку записи и уже видит отметку первой.
+        """
+        key = "imported:" + os.path.abspath(csv_filename)
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                return
+            self._insert_csv(csv_filename, mark=key)
+
+    def add_record(self, name, score):
+        """
+        Добавить новую запись об игроке
+        """
+        with self.conn:
+            self.conn.execute("INSERT INTO scores (name, score) VALUES (?, ?)", (name, int(score)))
+
+    def get_best_scores(self, top_n=5):
+        """
+        Получить top_n лучших результатов (по индексу, без чтения всей таблицы)
+        """
+        rows = self.conn.execute("SELECT name, score FROM scores ORDER BY score DESC, id LIMIT ?",
+                                 (top_n,))
+        return rows.fetchall()
+
+    def import_csv(self, csv_filename, batch_size=50000, mark=None):
+        """
+        Пакетно загрузить записи из CSV в формате ScoreTable (одной транзакцией).
+        Возвращает число добавленных записей.
+        """
+        with self.conn:
+            return self._insert_csv(csv_filename, batch_size, mark)
+
+    def _insert_csv(self, csv_filename, batch_size=50000, mark=None):
+        """
+        Вставить записи CSV в текущую транзакцию; mark — отметка импорта в meta.
+        """
+        added = 0
+        with open(csv_filename, mode='r', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # пропустить заголовок
+            batch = []
+            for row in reader:
+                if len(row) == 2:
+                    try:
+                        batch.append((row[0], int(row[1])))
+                    except ValueError:
+                        continue
+                    if len(batch) >= batch_size:
+                        self.conn.executemany("INSERT INTO scores (name, score) VALUES (?, ?)", batch)
+                        added += len(batch)
+                        batch = []
+            self.conn.executemany("INSERT INTO scores (name, score) VALUES (?, ?)", batch)
+            added += len(batch)
+            if mark is not None:
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (mark, str(added)))
+        return added
+
+    def export_csv(self, csv_filename):
+        """
+        Выгрузить все записи в CSV в порядке добавления.
+        """
+        with open(csv_filename, mode='w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Имя", "Очки"])
+            writer.writerows(self.conn.execute("SELECT name, score FROM scores ORDER BY id"))
+
+    def close(self):
+        self.conn.close()
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ЛЁГКИЕ СПРАЙТЫ --------------------------------------------
+# -----------------------------------------------------------------------------------
+# Монстров, пуль и построек в бесконечной игре бывают сотни тысяч, поэтому их спрайты
+# хранят поля в слотах, не заводят по множеству групп на объект и не держат ссылку
+# на общую для класса картинку.
+class LeanSprite(pygame.sprite.Sprite):
+    """
+    Спрайт pygame без __dict__ и собственного множества групп: в слоте _groups
+    лежит None, единственная группа или (редко) множество групп.
+    Для групп pygame ведёт себя как обычный Sprite.
+    """
+    __slots__ = ("_groups",)
+
+    def __init__(self, *groups):
+        # Sprite.__init__ не вызывается: он завёл бы __dict__ с множеством групп
+        self._groups = None
+        if groups:
+            self.add(*groups)
+
+    def _has(self, group):
+        groups = self._groups
+        return groups is group or (type(groups) is set and group in groups)
+
+    def add(self, *groups):
+        for group in groups:
+            if hasattr(group, "_spritegroup"):
+                if not self._has(group):
+                    group.add_internal(self)
+                    self.add_internal(group)
+            else:
+                self.add(*group)
+
+    def remove(self, *groups):
+        for group in groups:
+            if hasattr(group, "_spritegroup"):
+                if self._has(group):
+                    group.remove_internal(self)
+                    self.remove_internal(group)
+            else:
+                self.remove(*group)
+
+    def add_internal(self, group):
+        groups = self._groups
+        if groups is None:
+            self._groups = group
+        elif type(groups) is set:
+            groups.add(group)
+        else:
+            self._groups = {groups, group}
+
+    def remove_internal(self, group):
+        groups = self._groups
+        if groups is group:
+            self._groups = None
+        else:
+            groups.remove(group)
+            if len(groups) == 1:
+                self._groups = groups.pop()
+
+    def kill(self):
+        groups = self._groups
+        if groups is None:
+            return
+        for group in (list(groups) if type(groups) is set else (groups,)):
+            group.remove_internal(self)
+        self._groups = None
+
+    def groups(self):
+        groups = self._groups
+        if groups is None:
+            return []
+        return list(groups) if type(groups) is set else [groups]
+
+    def alive(self):
+        return self._groups is not None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} Sprite(in {len(self.groups())} groups)>"
+
+
+class SharedImage:
+    """
+    Картинка, общая для всех спрайтов класса: берётся из кэша изображений
+    при обращении, а не хранится ссылкой в каждом экземпляре.
+    """
+    __slots__ = ("key",)
+
+    def __init__(self, name, colorkey=None):
+        self.key = (name, colorkey)
+
+    def __get__(self, sprite, owner=None):
+        # Быстрый путь мимо load_image(): он считает попадания, а картинку берут на каждом кадре
+        return _image_cache.get(self.key) or load_image(*self.key)
+
+
 # -----------------------------------------------------------------------------------
 # ------------------------ КЛАСС БАШНИ -----------------------------------------------
 # -----------------------------------------------------------------------------------
@@ -146,306 +644,3388 @@ class Tower(pygame.sprite.Sprite):
 
 
 # -----------------------------------------------------------------------------------
-# ------------------------ КЛАСС БАЗОВЫЙ ДЛЯ МОНСТРОВ --------------------------------
+# ------------------------ КАМЕРА, ОТСЕЧЕНИЕ И ФОН ПО ЧАНКАМ -------------------------
 # -----------------------------------------------------------------------------------
-class Monster(pygame.sprite.Sprite):
+# Мир может быть больше окна. Камера задаёт видимую область (view) в координатах мира,
+# группы рисуют только то, что в неё попало, со сдвигом на её левый верхний угол,
+# а землю с башней рисует BackgroundChunks из заранее собранных кусков.
+# Неподвижные баррикады и оружие (CellGroup) ищутся по ячейкам сетки под view,
+# и линейная проверка всех спрайтов остаётся только для монстров и пуль.
+def visible_sprites(sprites, view):
     """
-    Базовый класс для всех монстров.
-    Определяет базовое поведение движения, атаки и анимации.
+    Спрайты, пересекающие view, в прежнем порядке (проверка идёт в C, в collidelistall).
+    Подходит для движущихся спрайтов: стоимость растёт с их общим числом.
     """
+    return [sprites[i] for i in view.collidelistall([sprite.rect for sprite in sprites])]
 
-    def __init__(self, images_list, x, y, speed=2, damage=10, health=100):
-        super().__init__()
-        # images_list должен содержать список загруженных кадров анимации
-        self.images = images_list
-        self.current_frame = 0
-        self.animation_speed = 0.15  # скорость переключения кадров
-        self.image = self.images[int(self.current_frame)]
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
 
-        self.speed = speed
-        self.damage = damage
-        self.health = health
-        self.attack_delay = 60  # сколько тиков ждать между ударами
-        self.attack_timer = 0
+class ViewGroup(pygame.sprite.Group):
+    """
+    Группа, которая рисует только спрайты в видимой области камеры.
+    draw(surface, view): view — область в координатах мира (None — весь мир
+    без сдвига). Возвращает прямоугольники нарисованного на surface.
+    """
 
-        # Состояние монстра: "move", "attack", "dead"
-        self.state = "move"
-        self.target = None
+    def draw(self, surface, view=None):
+        sprites = self.sprites()
+        if view is None:
+            sequence = [(sprite.image, sprite.rect) for sprite in sprites]
+        else:
+            sprites = visible_sprites(sprites, view)
+            dx, dy = -view.x, -view.y
+            sequence = [(sprite.image, sprite.rect.move(dx, dy)) for sprite in sprites]
+        rects = surface.blits(sequence)
+        self.spritedict.update(zip(sprites, rects))
+        self.lostsprites = []
+        return rects
 
-    def update(self, tower, barriers_group):
+
+class CellGroup(ViewGroup):
+    """
+    Группа неподвижных спрайтов с картой занятости по ячейкам сетки CELL_SIZE.
+    Карта обновляется при добавлении и удалении спрайта (в т.ч. через kill()),
+    поэтому отрисовка с view перебирает только ячейки видимой области,
+    а поиск столкновения (collide_rect) — только ячейки под прямоугольником.
+    """
+
+    def __init__(self, *sprites, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> {спрайт: порядковый номер добавления}
+        self._next_order = 0
+        super().__init__(*sprites)
+
+    def _cell_keys(self, rect):
+        cs = self.cell_size
+        for cx in range(rect.left // cs, (rect.right - 1) // cs + 1):
+            for cy in range(rect.top // cs, (rect.bottom - 1) // cs + 1):
+                yield cx, cy
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        order = self._next_order
+        self._next_order += 1
+        for key in self._cell_keys(sprite.rect):
+            self.cells.setdefault(key, {})[sprite] = order
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        for key in self._cell_keys(sprite.rect):
+            bucket = self.cells.get(key)
+            if bucket is not None:
+                bucket.pop(sprite, None)
+                if not bucket:
+                    del self.cells[key]
+
+    def collide_rect(self, rect):
         """
-        Обновляет позицию монстра и состояние анимации.
+        Спрайт, пересекающийся с rect (из нескольких — добавленный раньше всех,
+        как при обходе группы по порядку), или None.
         """
-        if self.state == "move":
-            self.move_logic(tower, barriers_group)
-        elif self.state == "attack":
-            self.attack_logic()
-        self.animate()
+        found = None
+        found_order = None
+        for key in self._cell_keys(rect):
+            bucket = self.cells.get(key)
+            if bucket is None:
+                continue
+            for sprite, order in bucket.items():
+                if (found_order is None or order < found_order) and rect.colliderect(sprite.rect):
+                    found = sprite
+                    found_order = order
+        return found
 
-    def move_logic(self, tower, barriers_group):
+    def visible(self, view):
         """
-        Логика движения: монстр двигается к башне,
-        если на пути нет барьера. Если встречает барьер – атакует барьер.
+        Спрайты, пересекающие view, в порядке группы. Если спрайтов меньше,
+        чем ячеек в view, дешевле проверить их все (visible_sprites).
         """
-        # Проверим, не сталкиваемся ли мы с барьером
-        for barrier in barriers_group:
-            if self.rect.colliderect(barrier.rect):
-                self.state = "attack"
-                self.target = barrier
-                return
+        cs = self.cell_size
+        columns = range(view.left // cs, (view.right - 1) // cs + 1)
+        rows = range(view.top // cs, (view.bottom - 1) // cs + 1)
+        if len(self.spritedict) <= len(columns) * len(rows):
+            return visible_sprites(self.sprites(), view)
+        cells = self.cells
+        found = {}
+        for cx in columns:
+            for cy in rows:
+                bucket = cells.get((cx, cy))
+                if bucket is not None:
+                    found.update(bucket)
+        # Спрайт на границе ячеек мог попасть в view только краем ячейки, но не собой
+        return [sprite for sprite in sorted(found, key=found.get) if view.colliderect(sprite.rect)]
 
-        # Двигаемся к башне
-        if self.rect.x < tower.rect.x:
-            self.rect.x += self.speed
-        elif self.rect.x > tower.rect.x:
-            self.rect.x -= self.speed
+    def draw(self, surface, view=None):
+        if view is None:
+            return super().draw(surface)
+        sprites = self.visible(view)
+        dx, dy = -view.x, -view.y
+        rects = surface.blits([(sprite.image, sprite.rect.move(dx, dy)) for sprite in sprites])
+        self.spritedict.update(zip(sprites, rects))
+        self.lostsprites = []
+        return rects
 
-        if self.rect.y < tower.rect.y:
-            self.rect.y += self.speed
-        elif self.rect.y > tower.rect.y:
-            self.rect.y -= self.speed
 
-        # Если мы близко к башне, переходим к атаке
-        if self.rect.colliderect(tower.rect):
-            self.state = "attack"
-            self.target = tower
+class Camera:
+    """
+    Видимая область мира размером с окно. Не выходит за края мира
+    (если мир меньше окна — стоит в его левом верхнем углу).
+    """
 
-    def attack_logic(self):
+    def __init__(self, view_size, world_size):
+        self.rect = pygame.Rect((0, 0), view_size)
+        self.world = pygame.Rect((0, 0), world_size)
+        # Точное положение: за короткий кадр камера может сдвинуться меньше чем на пиксель
+        self.x = 0.0
+        self.y = 0.0
+
+    def _move_to(self, x, y):
+        self.x = max(0.0, min(x, self.world.width - self.rect.width))
+        self.y = max(0.0, min(y, self.world.height - self.rect.height))
+        self.rect.topleft = (round(self.x), round(self.y))
+
+    def center_on(self, pos):
+        self._move_to(pos[0] - self.rect.width / 2, pos[1] - self.rect.height / 2)
+
+    def scroll(self, dx, dy):
+        self._move_to(self.x + dx, self.y + dy)
+
+    def to_world(self, pos):
         """
-        Логика атаки цели, будь то барьер или башня.
+        Точка окна -> точка мира.
         """
-        if self.target is not None:
-            if hasattr(self.target, "health") and self.target.health <= 0:
-                # Цель уничтожена, переходим обратно к движению
-                self.state = "move"
-                self.target = None
-                return
+        return pos[0] + self.rect.x, pos[1] + self.rect.y
 
-            # Если мы ещё не готовы ударить (таймер не обнулён), то ждём
-            if self.attack_timer > 0:
-                self.attack_timer -= 1
-            else:
-                # Наносим урон
-                self.target.take_damage(self.damage)
-                self.attack_timer = self.attack_delay
-        else:
-            # Если цели нет, переходим к движению
-            self.state = "move"
 
-    def animate(self):
+class BackgroundChunks:
+    """
+    Фон мира (замощённая земля и неподвижные спрайты, например башня), собранный
+    по квадратным кускам CHUNK_SIZE. Кусок собирается, когда впервые попадает
+    в кадр, и хранится в кэше; при переполнении выбрасываются куски, дольше всех
+    не попадавшие на экран. Стоимость кадра зависит от размера окна, а не карты.
+    """
+
+    def __init__(self, tile, world_size, sprites=(), chunk_size=CHUNK_SIZE, max_chunks=None):
+        self.tile = tile
+        self.world = pygame.Rect((0, 0), world_size)
+        self.sprites = list(sprites)
+        self.chunk_size = chunk_size
+        if max_chunks is None:
+            # Два экрана кусков: прокрутка туда-обратно не пересобирает фон
+            max_chunks = 2 * (WIDTH // chunk_size + 2) * (HEIGHT // chunk_size + 2)
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()  # (cx, cy) -> поверхность, от давно видимых к недавним
+        self.built = 0
+        self.evicted = 0
+
+    def _build(self, key):
+        size = self.chunk_size
+        area = pygame.Rect(key[0] * size, key[1] * size, size, size).clip(self.world)
+        chunk = pygame.Surface(area.size)
+        if pygame.display.get_surface() is not None:
+            chunk = chunk.convert()
+        # Плитки лежат по общей сетке мира, поэтому швов между кусками нет
+        tw, th = self.tile.get_size()
+        for x in range(area.left - area.left % tw, area.right, tw):
+            for y in range(area.top - area.top % th, area.bottom, th):
+                chunk.blit(self.tile, (x - area.x, y - area.y))
+        for sprite in self.sprites:
+            if sprite.rect.colliderect(area):
+                chunk.blit(sprite.image, sprite.rect.move(-area.x, -area.y))
+        self.built += 1
+        return chunk
+
+    def draw(self, surface, view):
         """
-        Простая анимация, переключающая кадры
+        Нарисовать на surface фон области view (в координатах мира).
         """
-        self.current_frame += self.animation_speed
-        if self.current_frame >= len(self.images):
-            self.current_frame = 0
-        self.image = self.images[int(self.current_frame)]
+        size = self.chunk_size
+        area = view.clip(self.world)
+        chunks = self.chunks
+        if area != view:
+            # Окно больше мира: за краем карты — пустота
+            surface.fill(BLACK, ((0, 0), view.size))
+        sequence = []
+        for cy in range(area.top // size, (area.bottom - 1) // size + 1):
+            for cx in range(area.left // size, (area.right - 1) // size + 1):
+                key = (cx, cy)
+                chunk = chunks.pop(key, None)
+                if chunk is None:
+                    chunk = self._build(key)
+                chunks[key] = chunk
+                sequence.append((chunk, (cx * size - view.x, cy * size - view.y)))
+        while len(chunks) > self.max_chunks:
+            chunks.popitem(last=False)
+            self.evicted += 1
+        surface.blits(sequence, doreturn=False)
 
-    def take_damage(self, amount):
+    def view_surface(self, view):
         """
-        Получить урон
+        Отдельная поверхность с фоном области view (для статичного слоя).
         """
-        self.health -= amount
-        if self.health <= 0:
-            self.state = "dead"
-            self.kill()
+        surface = pygame.Surface(view.size)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        self.draw(surface, view)
+        return surface
 
 
 # -----------------------------------------------------------------------------------
-# ------------------------ КЛАСС ДЛЯ Гоблина (Наследует Monster) ---------------------
+# ------------------------ АТЛАС АНИМАЦИЙ МОНСТРОВ -----------------------------------
 # -----------------------------------------------------------------------------------
-class Goblin(Monster):
+# На сколько кадра анимация продвигается за тик
+ANIMATION_SPEED = 0.15
+
+# Класс монстра -> его атлас (строится один раз на тип, см. monster_atlas)
+_atlas_cache = {}
+
+
+def build_frame_table(frame_count, speed=ANIMATION_SPEED):
     """
-    Гоблин — быстрый монстр с относительно небольшим уроном и здоровьем.
+    Таблица кадров на один период анимации: номер кадра для возраста
+    0, 1, 2, ... тиков. Считается тем же накоплением дробного счётчика,
+    каким раньше анимировался каждый монстр, поэтому кадры совпадают.
     """
-
-    def __init__(self, x, y):
-        images_list = [
-            load_image("monster_goblin_1.png"),
-            load_image("monster_goblin_2.png"),
-            load_image("monster_goblin_3.png"),
-        ]
-        super().__init__(images_list, x, y, speed=3, damage=5, health=50)
+    table = bytearray([0])
+    current = 0.0
+    while True:
+        current += speed
+        if current >= frame_count:
+            return bytes(table)
+        table.append(int(current))
 
 
-# ------------------------ КЛАСС ДЛЯ Орка ------------------------
-class Orc(Monster):
+class AnimationAtlas:
     """
-    Орк — медлительный, но с большим уроном и здоровьем.
+    Все кадры анимации одного типа монстров на одном листе.
+    Атлас общий для всех экземпляров типа: монстр хранит только фазу
+    (тик появления), а кадр берётся из таблицы по возрасту — за тик
+    анимация ничего не считает и не записывает.
     """
 
-    def __init__(self, x, y):
-        images_list = [
-            load_image("monster_orc_1.png"),
-            load_image("monster_orc_2.png"),
-            load_image("monster_orc_3.png"),
-        ]
-        super().__init__(images_list, x, y, speed=1, damage=20, health=150)
+    def __init__(self, images, speed=ANIMATION_SPEED):
+        cell_w = max(image.get_width() for image in images)
+        cell_h = max(image.get_height() for image in images)
+        # Лист в формате первого кадра; BLEND_RGBA_ADD на пустой лист копирует
+        # пиксели вместе с альфой без смешивания
+        self.sheet = pygame.Surface((cell_w * len(images), cell_h), pygame.SRCALPHA, images[0])
+        areas = []
+        for i, image in enumerate(images):
+            area = image.get_rect(topleft=(i * cell_w, 0))
+            self.sheet.blit(image, area, special_flags=pygame.BLEND_RGBA_ADD)
+            areas.append(area)
+        self.areas = tuple(areas)
+        # Кадры как подповерхности листа (пиксели общие с листом)
+        self.frames = tuple(self.sheet.subsurface(area) for area in areas)
+        self.size = self.frames[0].get_size()
+        self.table = build_frame_table(len(images), speed)
+        self.period = len(self.table)
+        # Область листа для каждого шага таблицы: кадр возраста age — steps[age % period]
+        self.steps = tuple(self.areas[frame] for frame in self.table)
+
+    def frame(self, age):
+        """
+        Кадр (поверхность) для монстра возрастом age тиков.
+        """
+        return self.frames[self.table[age % self.period]]
 
 
-class Golem(Monster):
+def monster_atlas(monster_class):
     """
-    Голем — очень медленный, но с большим уроном и высоким здоровьем.
+    Атлас типа монстров (по его frame_names); строится при первом запросе.
     """
-    def __init__(self, x, y):
-        images_list = [
-            load_image("monster_golem_1.png"),
-            load_image("monster_golem_2.png"),
-            load_image("monster_golem_3.png"),
-        ]
-        # speed=1 (самый медленный), damage=30, health=200 (усиленные характеристики)
-        super().__init__(images_list, x, y, speed=1, damage=30, health=200)
+    atlas = _atlas_cache.get(monster_class)
+    if atlas is None:
+        atlas = AnimationAtlas([load_image(name) for name in monster_class.frame_names])
+        _atlas_cache[monster_class] = atlas
+    return atlas
 
 
 # -----------------------------------------------------------------------------------
-# ------------------------ КЛАСС ПРЕПЯТСТВИЯ (баррикады) -----------------------------
+# ------------------------ КЛАСС БАЗОВЫЙ ДЛЯ МОНСТРОВ --------------------------------
 # -----------------------------------------------------------------------------------
-class Barrier(pygame.sprite.Sprite):
+# Состояния монстра (те же коды у EntityStore и в снимках)
+MONSTER_MOVE = 0
+MONSTER_ATTACK = 1
+MONSTER_DEAD = 2
+
+# Вид монстра по классу (см. monster_kind) и все виды по значениям полей
+_kind_cache = {}
+_monster_kinds = {}
+
+
+class MonsterKind:
     """
-    Препятствие, которое монстры должны сломать.
+    Неизменяемые данные, общие для всех монстров одного типа: атлас кадров
+    и характеристики. Монстр хранит только ссылку на свой вид.
     """
+    __slots__ = ("atlas", "speed", "damage", "max_health", "attack_delay")
 
-    def __init__(self, x, y, health=100):
-        super().__init__()
-        self.image = load_image("barrier.png")
-        self.rect = self.image.get_rect()
-        self.rect.topleft = (x, y)
-        self.health = health
+    def __init__(self, atlas, speed, damage, max_health, attack_delay):
+        self.atlas = atlas
+        self.speed = speed
+        self.damage = damage
+        self.max_health = max_health
+        self.attack_delay = attack_delay
 
-    def take_damage(self, amount):
+    @staticmethod
+    def get(atlas, speed, damage, max_health, attack_delay):
+        """
+        Общий вид с такими значениями (создаётся при первом запросе).
+        """
+        key = (atlas, speed, damage, max_health, attack_delay)
+        kind = _monster_kinds.get(key)
+        if kind is None:
+            kind = _monster_kinds[key] = MonsterKind(*key)
+        return kind
+
+    def replace(self, **changes):
+        """
+        Вид, отличающийся от этого значениями changes (тоже общий).
+        """
+        return MonsterKind.get(*(changes.get(name, getattr(self, name)) for name in MonsterKind.__slots__))
+
+
+def monster_kind(monster_class):
+    """
+    Вид типа монстров: его атлас и характеристики stats.
+    """
+    kind = _kind_cache.get(monster_class)
+    if kind is None:
+        stats = monster_class.stats
+        kind = MonsterKind.get(monster_atlas(monster_class), stats["speed"], stats["damage"], stats["health"],
+                               stats.get("attack_delay", 60))
+        _kind_cache[monster_class] = kind
+    return kind
+
+
+class KindField:
+    """
+    Поле монстра, которое хранится в его виде (MonsterKind). Присваивание
+    не меняет общий вид, а переводит монстра на вид с новым значением.
+    """
+    __slots__ = ("name",)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, monster, owner=None):
+        if monster is None:
+            return self
+        return getattr(monster.kind, self.name)
+
+    def __set__(self, monster, value):
+        monster.kind = monster.kind.replace(**{self.name: value})
+
+
+class Monster(LeanSprite):
+    """
+    Базовый класс для всех монстров.
+    Определяет базовое поведение движения, атаки и анимации.
+    """
+    # В слотах только изменяемое состояние; атлас и характеристики — в общем виде (kind)
+    __slots__ = ("kind", "phase", "rect", "health", "attack_timer", "state", "target", "generation",
+                 "order", "hit_tick", "wake_token")
+    atlas = KindField()
+    speed = KindField()
+    damage = KindField()
+    max_health = KindField()
+    attack_delay = KindField()  # сколько тиков ждать между ударами
+
+    def __init__(self, kind, x, y):
+        super().__init__()
+        # kind — общий для типа вид (MonsterKind)
+        self.kind = kind
+        # Тик часов группы, в который монстр появился (ставит MonsterGroup)
+        self.phase = 0
+        self.rect = kind.atlas.frames[0].get_rect()
+        self.rect.x = x
+        self.rect.y = y
+
+        self.health = kind.max_health
+        self.attack_timer = 0
+
+        # Состояние монстра: MONSTER_MOVE, MONSTER_ATTACK, MONSTER_DEAD
+        self.state = MONSTER_MOVE
+        self.target = None
+        # Растёт при каждом возврате из пула: по нему пули отличают новую жизнь монстра
+        self.generation = 0
+        # Для MonsterGroup: номер добавления в группу, тик следующего удара
+        # и метка актуальной записи в планировщике
+        self.order = 0
+        self.hit_tick = 0
+        self.wake_token = 0
+
+    @property
+    def image(self):
+        # Первый кадр — для обычных групп pygame; текущий кадр выбирает MonsterGroup.draw()
+        return self.kind.atlas.frames[0]
+
+    def reset(self, x, y):
+        """
+        Вернуть монстра из пула в начальное состояние на новом месте.
+        """
+        self.rect.topleft = (x, y)
+        self.health = self.kind.max_health
+        self.attack_timer = 0
+        self.state = MONSTER_MOVE
+        self.target = None
+        self.generation += 1
+
+    def update(self, tower, barriers_group):
+        """
+        Обновляет позицию и состояние монстра (кадр анимации зависит только от возраста).
+        """
+        if self.state == MONSTER_MOVE:
+            self.move_logic(tower, barriers_group)
+        elif self.state == MONSTER_ATTACK:
+            self.attack_logic()
+
+    def move_logic(self, tower, barriers_group):
+        """
+        Логика движения: монстр двигается к башне,
+        если на пути нет барьера. Если встречает барьер – атакует барьер.
+        """
+        # Проверим, не сталкиваемся ли мы с барьером
+        if hasattr(barriers_group, "collide_rect"):
+            # Группа с картой занятости: смотрим только ячейки под монстром
+            barrier = barriers_group.collide_rect(self.rect)
+            if barrier is not None:
+                self.state = MONSTER_ATTACK
+                self.target = barrier
+                return
+        else:
+            for barrier in barriers_group:
+                if self.rect.colliderect(barrier.rect):
+                    self.state = MONSTER_ATTACK
+                    self.target = barrier
+                    return
+
+        dx, dy = self.next_step(tower, barriers_group)
+        self.rect.x += dx
+        self.rect.y += dy
+
+        # Если мы близко к башне, переходим к атаке
+        if self.rect.colliderect(tower.rect):
+            self.state = MONSTER_ATTACK
+            self.target = tower
+
+    def next_step(self, tower, barriers_group):
+        """
+        Смещение (dx, dy), на которое идущий монстр сдвинется за тик
+        (без учёта столкновений). Им же пользуются снаряды для упреждения.
+        """
+        if self.state != MONSTER_MOVE:
+            return 0, 0
+        speed = self.kind.speed
+        flow_field = getattr(barriers_group, "flow_field", None)
+        # У монстров каждого размера своё поле: в узкий проход пролезает не всякий
+        field = flow_field.for_size(*self.rect.size) if flow_field is not None else None
+        step = field.next_center(*self.rect.center) if field is not None else None
+        if step is not None:
+            # Идём к опорной точке следующей клетки пути по полю направлений
+            cx, cy = self.rect.center
+            return self.slide(max(-speed, min(speed, step[0] - cx)),
+                              max(-speed, min(speed, step[1] - cy)), barriers_group)
+        # Двигаемся к башне
+        dx = dy = 0
+        if self.rect.x < tower.rect.x:
+            dx = speed
+        elif self.rect.x > tower.rect.x:
+            dx = -speed
+        if self.rect.y < tower.rect.y:
+            dy = speed
+        elif self.rect.y > tower.rect.y:
+            dy = -speed
+        return dx, dy
+
+    def slide(self, dx, dy, barriers_group):
+        """
+        Шаг (dx, dy), который упёрся бы в баррикаду, заменяется шагом по одной
+        оси (сначала по x): монстр огибает угол, а не врезается в него. Если
+        упираются оба, шаг остаётся прежним — путь ведёт сквозь стену.
+        """
+        rect = self.rect
+        if barriers_group.collide_rect(rect.move(dx, dy)) is None:
+            return dx, dy
+        if dx and barriers_group.collide_rect(rect.move(dx, 0)) is None:
+            return dx, 0
+        if dy and barriers_group.collide_rect(rect.move(0, dy)) is None:
+            return 0, dy
+        return dx, dy
+
+    def course(self, tower, barriers_group):
+        """
+        Предстоящий путь монстра отрезками [(тиков, dx, dy), ...]: смещение за тик
+        и сколько тиков подряд; последний отрезок (тиков None) длится до смены
+        состояния. Путь напрямую к башне известен целиком: выход на её линию
+        по каждой оси и остановка у башни. Баррикады и поле направлений не
+        предсказываются — на пути к ним отрезок один.
+        """
+        if self.state != MONSTER_MOVE or getattr(barriers_group, "flow_field", None) is not None:
+            return [(None, *self.next_step(tower, barriers_group))]
+        speed = self.kind.speed
+        x, y, width, height = self.rect
+        left, top, tower_width, tower_height = tower.rect
+        course = []
+        while x != left or y != top:
+            dx = speed if x < left else -speed if x > left else 0
+            dy = speed if y < top else -speed if y > top else 0
+            # Через сколько тиков первая из осей дойдёт до координаты башни
+            ticks_x = -(-abs(left - x) // speed) if dx else None
+            ticks_y = -(-abs(top - y) // speed) if dy else None
+            ticks = ticks_x if ticks_y is None or (ticks_x is not None and ticks_x < ticks_y) else ticks_y
+            overlap_x = overlap_ticks(x, dx, width, left, left + tower_width)
+            overlap_y = overlap_x and overlap_ticks(y, dy, height, top, top + tower_height)
+            if overlap_y:
+                first = max(overlap_x[0], overlap_y[0])
+                if first <= min(overlap_x[1], overlap_y[1], ticks):
+                    # Дошёл до башни и встал атаковать
+                    course.append((first, dx, dy))
+                    break
+            course.append((ticks, dx, dy))
+            # Дошедшая ось дальше дрожит около координаты башни — считаем, что стоит на ней
+            x = left if ticks == ticks_x else x + dx * ticks
+            y = top if ticks == ticks_y else y + dy * ticks
+        course.append((None, 0, 0))
+        return course
+
+    def attack_logic(self):
+        """
+        Логика атаки цели, будь то барьер или башня.
+        """
+        if self.target is not None:
+            if hasattr(self.target, "health") and self.target.health <= 0:
+                # Цель уничтожена, переходим обратно к движению
+                self.state = MONSTER_MOVE
+                self.target = None
+                return
+
+            # Если мы ещё не готовы ударить (таймер не обнулён), то ждём
+            if self.attack_timer > 0:
+                self.attack_timer -= 1
+            else:
+                # Наносим урон
+                self.target.take_damage(self.damage)
+                self.attack_timer = self.attack_delay
+        else:
+            # Если цели нет, переходим к движению
+            self.state = MONSTER_MOVE
+
+    def take_damage(self, amount):
+        """
+        Получить урон
+        """
+        self.health -= amount
+        if self.health <= 0:
+            self.state = MONSTER_DEAD
+            self.kill()
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ КЛАСС ДЛЯ Гоблина (Наследует Monster) ---------------------
+# -----------------------------------------------------------------------------------
+class Goblin(Monster):
+    """
+    Гоблин — быстрый монстр с относительно небольшим уроном и здоровьем.
+    """
+    __slots__ = ()
+    frame_names = ("monster_goblin_1.png", "monster_goblin_2.png", "monster_goblin_3.png")
+    stats = {"speed": 3, "damage": 5, "health": 50}
+
+    def __init__(self, x, y):
+        super().__init__(monster_kind(type(self)), x, y)
+
+
+# ------------------------ КЛАСС ДЛЯ Орка ------------------------
+class Orc(Monster):
+    """
+    Орк — медлительный, но с большим уроном и здоровьем.
+    """
+    __slots__ = ()
+    frame_names = ("monster_orc_1.png", "monster_orc_2.png", "monster_orc_3.png")
+    stats = {"speed": 1, "damage": 20, "health": 150}
+
+    def __init__(self, x, y):
+        super().__init__(monster_kind(type(self)), x, y)
+
+
+class Golem(Monster):
+    """
+    Голем — очень медленный, но с большим уроном и высоким здоровьем.
+    """
+    __slots__ = ()
+    frame_names = ("monster_golem_1.png", "monster_golem_2.png", "monster_golem_3.png")
+    # speed=1 (самый медленный), damage=30, health=200 (усиленные характеристики)
+    stats = {"speed": 1, "damage": 30, "health": 200}
+
+    def __init__(self, x, y):
+        super().__init__(monster_kind(type(self)), x, y)
+
+
+# Типы монстров по имени (для файлов настроек и пакетных прогонов)
+MONSTER_TYPES = {"Goblin": Goblin, "Orc": Orc, "Golem": Golem}
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ КЛАСС ПРЕПЯТСТВИЯ (баррикады) -----------------------------
+# -----------------------------------------------------------------------------------
+class Barrier(LeanSprite):
+    """
+    Препятствие, которое монстры должны сломать.
+    """
+    __slots__ = ("rect", "health")
+    image = SharedImage("barrier.png")
+
+    def __init__(self, x, y, health=100):
+        super().__init__()
+        self.rect = self.image.get_rect()
+        self.rect.topleft = (x, y)
+        self.health = health
+
+    def take_damage(self, amount):
         self.health -= amount
         if self.health <= 0:
             self.kill()
 
 
+class BarrierGroup(CellGroup):
+    """
+    Группа баррикад. Карта занятости CellGroup позволяет поиску столкновения
+    смотреть только 1–4 ячейки под монстром, а не все баррикады на поле.
+    """
+
+    def __init__(self, *sprites, cell_size=CELL_SIZE):
+        self.version = 0  # растёт при каждом изменении состава группы
+        self.flow_field = None  # FlowFields, которые нужно уведомлять об изменениях
+        super().__init__(*sprites, cell_size=cell_size)
+
+    def attach_flow_field(self, flow_field):
+        """
+        Подключить поле направлений: уже стоящие баррикады сразу отмечаются в нём,
+        а дальше поле узнаёт о каждой поставленной и разрушенной баррикаде.
+        """
+        self.flow_field = flow_field
+        for barrier in self.sprites():
+            flow_field.set_blocked(barrier.rect, 1)
+        flow_field.repair()
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.version += 1
+        if self.flow_field is not None:
+            self.flow_field.set_blocked(sprite.rect, 1)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.version += 1
+        if self.flow_field is not None:
+            self.flow_field.set_blocked(sprite.rect, -1)
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ПОЛЕ НАПРАВЛЕНИЙ К БАШНЕ (FLOW FIELD) ----------------------
+# -----------------------------------------------------------------------------------
+class FlowField:
+    """
+    Общая для монстров одного размера size карта расстояний до башни по сетке
+    CELL_SIZE (Дейкстра от клеток башни). Для каждой клетки хранится следующая
+    клетка пути, поэтому монстр узнаёт, куда идти, за O(1) независимо от их числа.
+
+    Монстр идёт центром от клетки к клетке, к её опорной точке: ближайшей
+    к центру клетки точке, стоя центром в которой монстр размера size не задевает
+    ни одну баррикаду (баррикада «раздувается» на половину монстра). Так он
+    проходит и в проход, куда центр клетки не помещается. Клетка, где такой
+    точки нет, занята. Занятые клетки не запрещены, а дороги: если обхода нет,
+    путь проходит сквозь стену, и монстр её ломает. При постановке и разрушении
+    баррикад клетки помечаются изменёнными, а repair() пересчитывает только
+    поддерево путей, проходивших через них.
+    """
+
+    STRAIGHT = 10
+    DIAGONAL = 14
+    BARRIER_PENALTY = 100  # «цена» клетки с баррикадой — как обход в 10 клеток
+    NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+    INF = float("inf")
+
+    def __init__(self, goal_rect, width=WIDTH, height=HEIGHT, cell_size=CELL_SIZE, size=None, barriers=()):
+        self.cell_size = cell_size
+        # Размер монстра; по умолчанию — клетка, то есть заняты клетки под самой баррикадой
+        self.size = size or (cell_size, cell_size)
+        self.cols = width // cell_size
+        self.rows = height // cell_size
+        n = self.cols * self.rows
+        self.blocked = [False] * n  # в клетке нет места для монстра
+        self.obstacles = [None] * n  # клетка -> {границы раздутой баррикады: сколько их}
+        self.dist = [self.INF] * n
+        self.parent = [-1] * n  # следующая клетка пути (-1 — клетка башни)
+        self.centers = [((i % self.cols) * cell_size + cell_size // 2,
+                         (i // self.cols) * cell_size + cell_size // 2) for i in range(n)]
+        self.waypoints = list(self.centers)  # опорные точки клеток
+        self.goal = set()
+        for i, (x, y) in enumerate(self.centers):
+            cell = pygame.Rect(x - cell_size // 2, y - cell_size // 2, cell_size, cell_size)
+            if cell.colliderect(goal_rect):
+                self.goal.add(i)
+        self._dirty = set()
+        self._moved = set()  # клетки, чьи опорные точки надо пересчитать
+        self._arrays = None
+        self.version = 0  # растёт после каждого пересчёта
+        for rect in barriers:
+            self.set_blocked(rect, 1)
+        self.recompute()
+
+    def cell_index(self, x, y):
+        cx, cy = x // self.cell_size, y // self.cell_size
+        if 0 <= cx < self.cols and 0 <= cy < self.rows:
+            return cy * self.cols + cx
+        return -1
+
+    def _neighbours(self, i):
+        cols, rows = self.cols, self.rows
+        cx, cy = i % cols, i // cols
+        for dx, dy in self.NEIGHBOURS:
+            nx, ny = cx + dx, cy + dy
+            if 0 <= nx < cols and 0 <= ny < rows:
+                yield ny * cols + nx, dx, dy
+
+    def _step_cost(self, i, dx, dy):
+        """
+        Цена шага из клетки i на (dx, dy) или None, если шаг по диагонали
+        срезает угол баррикады.
+        """
+        cols = self.cols
+        j = i + dy * cols + dx
+        if dx and dy:
+            if self.blocked[i + dx] or self.blocked[i + dy * cols]:
+                return None
+            cost = self.DIAGONAL
+        else:
+            cost = self.STRAIGHT
+        if self.blocked[j]:
+            cost += self.BARRIER_PENALTY
+        return cost
+
+    def _run(self, heap):
+        dist, parent = self.dist, self.parent
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for m, dx, dy in self._neighbours(u):
+                # Шаг из соседа m в клетку u
+                cost = self._step_cost(m, -dx, -dy)
+                if cost is None:
+                    continue
+                if d + cost < dist[m]:
+                    dist[m] = d + cost
+                    parent[m] = u
+                    heapq.heappush(heap, (d + cost, m))
+                elif d + cost == dist[m] and u < parent[m]:
+                    # При равной длине — клетка с меньшим номером: карта не зависит
+                    # от истории починок, и пересчёт с нуля даст те же пути
+                    parent[m] = u
+        self.version += 1
+
+    def recompute(self):
+        """
+        Полный пересчёт карты (нужен только при создании).
+        """
+        self.dist = [self.INF] * len(self.dist)
+        self.parent = [-1] * len(self.parent)
+        self._place_moved()
+        heap = []
+        for i in self.goal:
+            self.dist[i] = 0
+            heap.append((0, i))
+        heapq.heapify(heap)
+        self._dirty.clear()
+        self._run(heap)
+
+    def inflate(self, rect):
+        """
+        Границы (x0, x1, y0, y1) центров монстра размера size, при которых
+        он пересекается с rect (включительно).
+        """
+        width, height = self.size
+        return (rect.left - width + width // 2 + 1, rect.right + width // 2 - 1,
+                rect.top - height + height // 2 + 1, rect.bottom + height // 2 - 1)
+
+    def set_blocked(self, rect, delta):
+        """
+        Баррикада rect поставлена (delta=1) или убрана (delta=-1). Опорные точки
+        клеток, которые она задевает, пересчитает repair(): до него все монстры
+        тика видят поле одинаковым, в каком бы порядке ломались баррикады.
+        """
+        cs = self.cell_size
+        box = self.inflate(rect)
+        x0, x1, y0, y1 = box
+        for row in range(max(0, y0 // cs), min(self.rows - 1, y1 // cs) + 1):
+            for col in range(max(0, x0 // cs), min(self.cols - 1, x1 // cs) + 1):
+                i = row * self.cols + col
+                obstacles = self.obstacles[i]
+                if obstacles is None:
+                    obstacles = self.obstacles[i] = {}
+                count = obstacles.get(box, 0) + delta
+                if count:
+                    obstacles[box] = count
+                else:
+                    del obstacles[box]
+                self._moved.add(i)
+
+    def _place_moved(self):
+        for i in self._moved:
+            self._place(i)
+        if self._moved:
+            self._arrays = None
+        self._moved.clear()
+
+    def _place(self, i):
+        """
+        Опорная точка клетки i: ближайшая к центру свободная точка клетки.
+        Кандидаты — центр и точки сразу за границами раздутых баррикад.
+        """
+        obstacles = self.obstacles[i] or ()
+        cx, cy = self.centers[i]
+        if not any(x0 <= cx <= x1 and y0 <= cy <= y1 for x0, x1, y0, y1 in obstacles):
+            point = (cx, cy)
+        else:
+            cs, half = self.cell_size, self.cell_size // 2
+            left, top = cx - half, cy - half
+            xs, ys = {cx}, {cy}
+            for x0, x1, y0, y1 in obstacles:
+                xs.update(x for x in (x0 - 1, x1 + 1) if left <= x < left + cs)
+                ys.update(y for y in (y0 - 1, y1 + 1) if top <= y < top + cs)
+            point = None
+            best = None
+            for y in ys:
+                for x in xs:
+                    key = ((x - cx) ** 2 + (y - cy) ** 2, y, x)
+                    if (best is None or key < best) and not any(
+                            x0 <= x <= x1 and y0 <= y <= y1 for x0, x1, y0, y1 in obstacles):
+                        best = key
+                        point = (x, y)
+        blocked = point is None
+        self.waypoints[i] = point or (cx, cy)
+        if blocked != self.blocked[i]:
+            self.blocked[i] = blocked
+            self._dirty.add(i)
+
+    def repair(self):
+        """
+        Починить карту после изменения баррикад. Сбрасываются клетки, чей путь
+        шёл через изменённые клетки или их соседей (у соседей могли поменяться
+        диагональные шаги), и заново досчитываются от нетронутой части карты.
+        """
+        self._place_moved()
+        if not self._dirty:
+            return False
+        changed = set()
+        for i in self._dirty:
+            changed.add(i)
+            changed.update(m for m, _, _ in self._neighbours(i))
+        self._dirty.clear()
+
+        dist, parent = self.dist, self.parent
+        stack = [i for i in changed if i not in self.goal]
+        affected = set(stack)
+        while stack:
+            u = stack.pop()
+            for m, _, _ in self._neighbours(u):
+                if parent[m] == u and m not in affected:
+                    affected.add(m)
+                    stack.append(m)
+        for i in affected:
+            dist[i] = self.INF
+            parent[i] = -1
+
+        heap = []
+        for i in affected:
+            for m, dx, dy in self._neighbours(i):
+                if m in affected or dist[m] == self.INF:
+                    continue
+                cost = self._step_cost(i, dx, dy)
+                if cost is None:
+                    continue
+                if dist[m] + cost < dist[i] or (dist[m] + cost == dist[i] and m < parent[i]):
+                    dist[i] = dist[m] + cost
+                    parent[i] = m
+            if dist[i] < self.INF:
+                heap.append((dist[i], i))
+        # Нетронутые изменённые клетки тоже раздают соседям (возможно, подешевевшие) пути
+        heap.extend((dist[i], i) for i in changed if i not in affected and dist[i] < self.INF)
+        heapq.heapify(heap)
+        self._run(heap)
+        return True
+
+    def next_center(self, x, y):
+        """
+        Опорная точка следующей клетки пути из точки (x, y) или None, если точка
+        уже у башни или за пределами поля.
+        """
+        i = self.cell_index(x, y)
+        if i < 0 or self.parent[i] < 0:
+            return None
+        return self.waypoints[self.parent[i]]
+
+    def target_arrays(self):
+        """
+        Для EntityStore: массивы координат опорной точки следующей клетки
+        (-1 там, где пути нет), пересобираются только после изменения карты.
+        """
+        if self._arrays is None or self._arrays[0] != self.version:
+            tx = np.full(len(self.parent), -1, dtype=np.int64)
+            ty = np.full(len(self.parent), -1, dtype=np.int64)
+            for i, p in enumerate(self.parent):
+                if p >= 0:
+                    tx[i], ty[i] = self.waypoints[p]
+            self._arrays = (self.version, tx, ty)
+        return self._arrays[1], self._arrays[2]
+
+
+class FlowFields:
+    """
+    Поля направлений по размерам монстров: FlowField для размера заводится,
+    когда такой монстр впервые спрашивает дорогу, и дальше чинится вместе
+    с остальными. Баррикады, изменившиеся после последнего repair(), новое
+    поле получает так же, как старые, — изменёнными клетками без пересчёта,
+    поэтому оно совпадает с полем, заведённым раньше.
+    """
+
+    def __init__(self, goal_rect, width=WIDTH, height=HEIGHT, cell_size=CELL_SIZE):
+        self.goal_rect = pygame.Rect(goal_rect)
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.fields = {}  # (ширина, высота) монстра -> FlowField
+        self.barriers = {}  # (x, y, w, h) баррикады -> сколько их там (на момент repair)
+        self.pending = []  # (прямоугольник, delta) после последнего repair()
+
+    def for_size(self, width, height):
+        field = self.fields.get((width, height))
+        if field is None:
+            rects = [pygame.Rect(rect) for rect, count in self.barriers.items() for _ in range(count)]
+            field = FlowField(self.goal_rect, self.width, self.height, self.cell_size, (width, height), rects)
+            for rect, delta in self.pending:
+                field.set_blocked(rect, delta)
+            self.fields[(width, height)] = field
+        return field
+
+    def set_blocked(self, rect, delta):
+        """
+        Баррикада rect поставлена (delta=1) или убрана (delta=-1).
+        """
+        rect = pygame.Rect(rect)
+        self.pending.append((rect, delta))
+        for field in self.fields.values():
+            field.set_blocked(rect, delta)
+
+    def repair(self):
+        """
+        Починить все поля; True, если хоть одно пересчитывалось.
+        """
+        for rect, delta in self.pending:
+            key = tuple(rect)
+            count = self.barriers.get(key, 0) + delta
+            if count:
+                self.barriers[key] = count
+            else:
+                del self.barriers[key]
+        self.pending.clear()
+        repaired = False
+        for field in self.fields.values():
+            repaired = field.repair() or repaired
+        return repaired
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ПРОСТРАНСТВЕННЫЙ ИНДЕКС МОНСТРОВ --------------------------
+# -----------------------------------------------------------------------------------
+class SpatialHash:
+    """
+    Равномерная сетка (хэш по ячейкам CELL_SIZE) по центрам монстров.
+    Перестраивается раз в тик и отвечает на запросы «ближайший монстр»
+    и «все монстры в радиусе», просматривая только соседние ячейки.
+    """
+
+    BRUTE_FORCE_LIMIT = 32
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        # (cx, cy) -> список (порядковый номер, x, y, спрайт)
+        self.cells = {}
+        self.entries = []  # все записи в порядке группы
+        self.bounds = None  # (min_cx, min_cy, max_cx, max_cy) занятых ячеек
+
+    def rebuild(self, sprites):
+        """
+        Заново разложить спрайты по ячейкам. Порядковый номер сохраняет порядок
+        группы, чтобы при равных расстояниях цель выбиралась как при полном переборе.
+        """
+        cs = self.cell_size
+        cells = {}
+        entries = []
+        for order, sprite in enumerate(sprites):
+            x, y = sprite.rect.center
+            entry = (order, x, y, sprite)
+            entries.append(entry)
+            key = (x // cs, y // cs)
+            bucket = cells.get(key)
+            if bucket is None:
+                cells[key] = [entry]
+            else:
+                bucket.append(entry)
+        self.cells = cells
+        self.entries = entries
+        if cells:
+            xs = [key[0] for key in cells]
+            ys = [key[1] for key in cells]
+            self.bounds = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            self.bounds = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _ring(self, cx, cy, r):
+        """
+        Ключи ячеек на «кольце» радиуса r (по Чебышёву) вокруг ячейки (cx, cy).
+        """
+        if r == 0:
+            yield cx, cy
+            return
+        for x in range(cx - r, cx + r + 1):
+            yield x, cy - r
+            yield x, cy + r
+        for y in range(cy - r + 1, cy + r):
+            yield cx - r, y
+            yield cx + r, y
+
+    def nearest(self, x, y, max_dist2=None):
+        """
+        Ближайший к точке (x, y) спрайт с квадратом расстояния строго меньше max_dist2
+        (None — без ограничения). Если такого нет, возвращает None.
+        """
+        if self.bounds is None:
+            return None
+        cs = self.cell_size
+        cx, cy = x // cs, y // cs
+        min_cx, min_cy, max_cx, max_cy = self.bounds
+        # Дальше этого кольца занятых ячеек нет
+        max_r = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy)
+        if max_dist2 is not None:
+            max_r = min(max_r, int(max_dist2 ** 0.5) // cs + 1)
+        best = None
+        best_key = None
+        # Когда монстров мало, обход колец дороже простого перебора
+        if len(self.entries) <= self.BRUTE_FORCE_LIMIT:
+            for order, sx, sy, sprite in self.entries:
+                d2 = (sx - x) ** 2 + (sy - y) ** 2
+                if max_dist2 is not None and d2 >= max_dist2:
+                    continue
+                if best_key is None or d2 < best_key[0]:
+                    best_key = (d2, order)
+                    best = sprite
+            return best
+
+        cells = self.cells
+        for r in range(max_r + 1):
+            # Все ячейки кольца r не ближе (r - 1) * cs к точке
+            ring_dist = (r - 1) * cs
+            if r > 0 and max_dist2 is not None and ring_dist * ring_dist >= max_dist2:
+                break
+            if best_key is not None and ring_dist * ring_dist > best_key[0]:
+                break
+            for key in self._ring(cx, cy, r):
+                bucket = cells.get(key)
+                if bucket is None:
+                    continue
+                for order, sx, sy, sprite in bucket:
+                    d2 = (sx - x) ** 2 + (sy - y) ** 2
+                    if max_dist2 is not None and d2 >= max_dist2:
+                        continue
+                    if best_key is None or (d2, order) < best_key:
+                        best_key = (d2, order)
+                        best = sprite
+        return best
+
+    def within_radius(self, x, y, radius):
+        """
+        Все спрайты, центр которых лежит не дальше radius от точки (x, y).
+        """
+        cs = self.cell_size
+        r2 = radius * radius
+        found = []
+        for cx in range((x - radius) // cs, (x + radius) // cs + 1):
+            for cy in range((y - radius) // cs, (y + radius) // cs + 1):
+                for _, sx, sy, sprite in self.cells.get((cx, cy), ()):
+                    if (sx - x) ** 2 + (sy - y) ** 2 <= r2:
+                        found.append(sprite)
+        return found
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ КЛАСС ОРУЖИЯ (устанавливаемого) ---------------------------
+# -----------------------------------------------------------------------------------
+class Weapon(LeanSprite):
+    """
+    Оружие, которое можно установить на поле. Оно стреляет в ближайшего монстра.
+    """
+    __slots__ = ("rect", "fire_delay", "fire_timer", "fire_range", "order", "ready_tick", "wake_token")
+    image = SharedImage("weapon.png")
+
+    def __init__(self, x, y, fire_range=None):
+        super().__init__()
+        self.rect = self.image.get_rect()
+        self.rect.topleft = (x, y)
+        self.fire_delay = 60  # задержка между выстрелами
+        self.fire_timer = 0
+        # Дальность стрельбы в пикселях (None — стреляет через всё поле)
+        self.fire_range = fire_range
+        # Для WeaponGroup: номер добавления в группу, тик готовности
+        # и метка актуальной записи в планировщике
+        self.order = 0
+        self.ready_tick = 0
+        self.wake_token = 0
+
+    def update(self, monsters_group, bullets_group, monster_index=None):
+        # Уменьшаем таймер
+        if self.fire_timer > 0:
+            self.fire_timer -= 1
+        elif self.fire(monsters_group, bullets_group, monster_index):
+            self.fire_timer = self.fire_delay
+
+    def fire(self, monsters_group, bullets_group, monster_index=None):
+        """
+        Выстрелить в ближайшего монстра в зоне поражения.
+        Возвращает True, если выстрел был.
+        """
+        # Найдём ближайшего монстра, чтобы выстрелить
+        x, y = self.rect.center
+        if self.fire_range is None:
+            max_dist2 = 999999
+        else:
+            max_dist2 = self.fire_range ** 2 + 1
+        if monster_index is not None:
+            target = monster_index.nearest(x, y, max_dist2)
+        else:
+            target = None
+            min_dist = max_dist2
+            for monster in monsters_group:
+                dist = (monster.rect.centerx - x) ** 2 + (monster.rect.centery - y) ** 2
+                if dist < min_dist:
+                    min_dist = dist
+                    target = monster
+        # Если нашли монстра в зоне поражения
+        if not target:
+            return False
+        # Стреляем
+        if hasattr(bullets_group, "spawn"):
+            bullets_group.spawn(Bullet, x, y, target)
+        else:
+            bullets_group.add(Bullet(x, y, target))
+        return True
+
+
+class WeaponGroup(CellGroup):
+    """
+    Группа оружия с планировщиком: оружие на перезарядке не обновляется
+    каждый тик, а спит в TickScheduler до тика готовности. За тик стреляют
+    (или ищут цель) только готовые — в порядке группы, как при обходе update().
+    """
+
+    def __init__(self, *sprites):
+        self.tick = 0
+        self.wakeups = TickScheduler()
+        self.ready = {}  # готовое оружие в порядке группы
+        self._ready_sorted = True
+        self._order = itertools.count()
+        super().__init__(*sprites)
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        sprite.order = next(self._order)
+        self._arm(sprite, self.tick + sprite.fire_timer)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        sprite.wake_token += 1
+        self.ready.pop(sprite, None)
+
+    def _arm(self, weapon, ready_tick):
+        weapon.ready_tick = ready_tick
+        weapon.wake_token += 1
+        if ready_tick <= self.tick:
+            self.ready[weapon] = None
+            self._ready_sorted = False
+        else:
+            self.wakeups.schedule(ready_tick, weapon.order, weapon.wake_token, weapon)
+
+    def update(self, monsters_group, bullets_group, monster_index=None):
+        tick = self.tick
+        for weapon, token in self.wakeups.pop_due(tick):
+            if weapon.wake_token == token:
+                self.ready[weapon] = None
+                self._ready_sorted = False
+        if not self._ready_sorted:
+            self.ready = dict.fromkeys(sorted(self.ready, key=lambda w: w.order))
+            self._ready_sorted = True
+        for weapon in list(self.ready):
+            if weapon.fire(monsters_group, bullets_group, monster_index):
+                # Таймер fire_delay тиков, стрелять снова — на следующий тик после него
+                del self.ready[weapon]
+                self._arm(weapon, tick + weapon.fire_delay + 1)
+        self.tick += 1
+
+    def has_ready(self):
+        """
+        Будет ли в этот тик хоть одно оружие искать цель.
+        """
+        if self.ready:
+            return True
+        next_tick = self.wakeups.next_tick()
+        return next_tick is not None and next_tick <= self.tick
+
+    def fire_timer(self, weapon):
+        """
+        Таймер стрельбы оружия, как его видел бы Weapon.update() в начале тика.
+        """
+        return max(0, weapon.ready_tick - self.tick)
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ КЛАСС ПУЛИ -----------------------------------------------
+# -----------------------------------------------------------------------------------
+class Bullet(LeanSprite):
+    """
+    Пуля, летит к выбранному монстру, нанося ему урон при попадании.
+    """
+    __slots__ = ("rect", "target", "target_generation", "speed", "damage",
+                 "origin", "aim", "fire_tick", "hit_tick", "order", "wake_token", "resolved")
+    image = SharedImage("bullet.png")
+
+    def __init__(self, x, y, target, speed=5, damage=10):
+        super().__init__()
+        self.rect = self.image.get_rect(center=(x, y))
+        self.target = target
+        self.target_generation = getattr(target, "generation", 0)
+        self.speed = speed
+        self.damage = damage
+        # Для ProjectileGroup: откуда и куда летит пуля, тики вылета и попадания,
+        # порядок, метка записи в планировщике и было ли упреждение пересчитано
+        self.origin = self.aim = (x, y)
+        self.fire_tick = self.hit_tick = 0
+        self.order = 0
+        self.wake_token = 0
+        self.resolved = False
+
+    def reset(self, x, y, target):
+        """
+        Вернуть пулю из пула: новая точка вылета и новая цель.
+        """
+        self.rect.center = (x, y)
+        self.target = target
+        self.target_generation = getattr(target, "generation", 0)
+
+    def update(self):
+        if (not self.target.alive() or self.target.state == MONSTER_DEAD
+                or getattr(self.target, "generation", 0) != self.target_generation):
+            # Если цель уже мертва (или её объект переиспользован пулом), удаляем пулю
+            self.kill()
+            return
+
+        # Движемся к цели
+        dx = self.target.rect.centerx - self.rect.centerx
+        dy = self.target.rect.centery - self.rect.centery
+        dist = (dx ** 2 + dy ** 2) ** 0.5
+
+        if dist < self.speed:
+            # Считаем, что попали
+            self.target.take_damage(self.damage)
+            self.kill()
+        else:
+            # Двигаемся по направлению к цели
+            self.rect.x += self.speed * dx / dist
+            self.rect.y += self.speed * dy / dist
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ПЛАНИРОВЩИК ТИКОВ -----------------------------------------
+# -----------------------------------------------------------------------------------
+class TickScheduler:
+    """
+    Очередь пробуждений по тикам (двоичная куча). Оружие на перезарядке и
+    монстры между ударами не обновляются каждый тик, а записываются сюда
+    со своим тиком пробуждения, и за тик просыпаются только те, чей срок настал.
+
+    Запись — (тик, порядок, метка, объект): среди одновременно проснувшихся
+    объекты идут по порядку (номеру добавления в группу). Отменять записи не нужно:
+    объект увеличивает свою метку, и старая запись при извлечении пропускается.
+    """
+
+    def __init__(self):
+        self._heap = []
+
+    def schedule(self, tick, order, token, item):
+        heapq.heappush(self._heap, (tick, order, token, item))
+
+    def pop_due(self, tick):
+        """
+        Извлечь все записи со сроком не позже tick: список (объект, метка)
+        в порядке (срок, порядок).
+        """
+        heap = self._heap
+        due = []
+        while heap and heap[0][0] <= tick:
+            _, _, token, item = heapq.heappop(heap)
+            due.append((item, token))
+        return due
+
+    def next_tick(self):
+        """
+        Ближайший тик пробуждения (None, если очередь пуста). Может указывать
+        на отменённую запись — тогда это лишь ранняя оценка.
+        """
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._heap)
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ГРУППА С ПУЛОМ ОБЪЕКТОВ -----------------------------------
+# -----------------------------------------------------------------------------------
+class PooledGroup(ViewGroup):
+    """
+    Группа, которая переиспользует свои спрайты вместо создания новых.
+    spawn() берёт свободный объект нужного класса из пула (или создаёт новый),
+    а при удалении из группы (kill(), remove(), empty()) спрайт с методом reset()
+    возвращается в пул. Так пули и монстры не создаются и не собираются
+    сборщиком мусора на каждом выстреле и спавне. Спрайт, которого вернули
+    в группу обычным add(), из пула убирается: иначе spawn() выдал бы его второй раз.
+    """
+
+    def __init__(self, *sprites, max_free=10000):
+        self.free = {}  # класс -> свободные объекты (dict как упорядоченное множество)
+        self.max_free = max_free
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+        super().__init__(*sprites)
+
+    def spawn(self, cls, *args):
+        """
+        Получить объект класса cls с аргументами args и добавить его в группу.
+        """
+        free = self.free.get(cls)
+        if free:
+            sprite = free.popitem()[0]
+            sprite.reset(*args)
+            self.reused += 1
+        else:
+            sprite = cls(*args)
+            self.created += 1
+        self.add(sprite)
+        return sprite
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        free = self.free.get(type(sprite))
+        if free:
+            free.pop(sprite, None)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        if hasattr(sprite, "reset"):
+            free = self.free.setdefault(type(sprite), {})
+            if len(free) < self.max_free:
+                free[sprite] = None
+                self.released += 1
+
+    def pool_stats(self):
+        """
+        Статистика пула: сколько объектов создано, переиспользовано,
+        возвращено и сколько сейчас свободно.
+        """
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "released": self.released,
+            "free": sum(len(free) for free in self.free.values()),
+            "in_use": len(self),
+        }
+
+
+class MonsterGroup(PooledGroup):
+    """
+    Группа монстров со своими часами: tick растёт на единицу за update().
+
+    Анимация: добавленный монстр получает фазу — текущее значение часов, а draw()
+    берёт его кадр из таблицы атласа по возрасту и рисует всех одним вызовом blits
+    прямо с листов атласов.
+
+    Атаки: за тик обновляются только идущие монстры и те атакующие, чей удар
+    пришёлся на этот тик (их будит TickScheduler). Атакующий между ударами спит;
+    если его цель разрушена, группа сама переводит его обратно в движение — в тот
+    же тик, что и обход всех монстров по порядку, как в Monster.update().
+
+    on_state_change(monster) вызывается, когда монстр остановился для атаки
+    или снова пошёл (по нему ProjectileGroup пересчитывает пули в полёте).
+    """
+
+    def __init__(self, *sprites, **kwargs):
+        self.tick = 0
+        self.on_state_change = None
+        self.wakeups = TickScheduler()
+        self.movers = {}  # идущие монстры в порядке группы
+        self._movers_sorted = True
+        self.attackers = {}  # цель -> множество атакующих её монстров
+        self._order = itertools.count()
+        super().__init__(*sprites, **kwargs)
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        if not hasattr(sprite, "atlas"):
+            return
+        sprite.phase = self.tick
+        sprite.order = next(self._order)
+        sprite.wake_token += 1
+        if sprite.state == MONSTER_ATTACK:
+            # Монстр из снимка, уже атакующий цель
+            sprite.hit_tick = self.tick + sprite.attack_timer
+            self.attackers.setdefault(sprite.target, set()).add(sprite)
+            alive = sprite.target is not None and getattr(sprite.target, "health", 1) > 0
+            self._wake(sprite, sprite.hit_tick if alive else self.tick)
+        else:
+            self.movers[sprite] = None
+
+    def remove_internal(self, sprite):
+        if hasattr(sprite, "atlas"):
+            sprite.wake_token += 1
+            self.movers.pop(sprite, None)
+            attackers = self.attackers.get(sprite.target)
+            if attackers is not None:
+                attackers.discard(sprite)
+        super().remove_internal(sprite)
+
+    def _wake(self, monster, tick):
+        monster.wake_token += 1
+        self.wakeups.schedule(tick, monster.order, monster.wake_token, monster)
+
+    def _resume(self, monster, tick):
+        """
+        Цель разрушена: монстр бросает её (таймер удара сохраняет остаток)
+        и со следующего тика снова идёт.
+        """
+        monster.attack_timer = monster.hit_tick - tick
+        monster.state = MONSTER_MOVE
+        monster.target = None
+        monster.wake_token += 1
+        self.movers[monster] = None
+        self._movers_sorted = False
+        if self.on_state_change is not None:
+            self.on_state_change(monster)
+
+    def _target_lost(self, target, killer, tick):
+        """
+        Цель разрушил удар монстра killer. Кто обходится после него, замечает это
+        в этот же тик, остальные (и сам killer) — в следующий.
+        """
+        for monster in self.attackers.pop(target, ()):
+            if monster.order <= killer.order:
+                self._wake(monster, tick + 1)
+            else:
+                self._resume(monster, tick)
+
+    def update(self, tower, barriers_group):
+        tick = self.tick
+        if not self._movers_sorted:
+            self.movers = dict.fromkeys(sorted(self.movers, key=lambda m: m.order))
+            self._movers_sorted = True
+        # Идущие монстры (без метки) и проснувшиеся атакующие (с меткой записи)
+        active = [(monster, None) for monster in self.movers]
+        due = [(monster, token) for monster, token in self.wakeups.pop_due(tick) if monster.wake_token == token]
+        if due:
+            # Два упорядоченных списка: sort сольёт их за линейное время
+            active.extend(due)
+            active.sort(key=lambda entry: entry[0].order)
+        for monster, token in active:
+            if token is None:
+                monster.move_logic(tower, barriers_group)
+                if monster.state == MONSTER_ATTACK:
+                    # Первый удар — после того, как дотикает оставшийся таймер
+                    del self.movers[monster]
+                    monster.hit_tick = tick + 1 + monster.attack_timer
+                    self.attackers.setdefault(monster.target, set()).add(monster)
+                    self._wake(monster, monster.hit_tick)
+                    if self.on_state_change is not None:
+                        self.on_state_change(monster)
+            elif monster.wake_token == token:
+                # Запись не отменена: цель не разрушили раньше в этом же тике
+                target = monster.target
+                if target is None or getattr(target, "health", 1) <= 0:
+                    attackers = self.attackers.get(target)
+                    if attackers is not None:
+                        attackers.discard(monster)
+                    self._resume(monster, tick)
+                    continue
+                target.take_damage(monster.damage)
+                monster.hit_tick = tick + monster.attack_delay + 1
+                self._wake(monster, monster.hit_tick)
+                if getattr(target, "health", 1) <= 0:
+                    self._target_lost(target, monster, tick)
+        self.tick += 1
+
+    def attack_timer(self, monster):
+        """
+        Таймер удара монстра, как его видел бы Monster.attack_logic() в начале тика.
+        """
+        return monster.hit_tick - self.tick if monster.state == MONSTER_ATTACK else monster.attack_timer
+
+    def age(self, monster):
+        """
+        Возраст монстра по часам группы (в тиках, по модулю периода атласа).
+        """
+        return (self.tick - monster.phase) % monster.atlas.period
+
+    def draw(self, surface, view=None):
+        tick = self.tick
+        sprites = self.sprites()
+        if view is not None:
+            sprites = visible_sprites(sprites, view)
+        sequence = []
+        for m in sprites:
+            atlas = m.kind.atlas
+            sequence.append((atlas.sheet, m.rect, atlas.steps[(tick - m.phase) % atlas.period]))
+        if view is not None:
+            sequence = [(sheet, rect.move(-view.x, -view.y), area) for sheet, rect, area in sequence]
+        rects = surface.blits(sequence)
+        self.spritedict.update(zip(sprites, rects))
+        self.lostsprites = []
+        return rects
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ АНАЛИТИЧЕСКИЕ СНАРЯДЫ -------------------------------------
+# -----------------------------------------------------------------------------------
+def intercept_time(dx, dy, vx, vy, speed, reach=0.0):
+    """
+    Через сколько тиков снаряд со скоростью speed подойдёт на расстояние reach
+    к цели, которая сейчас смещена от него на (dx, dy) и идёт со скоростью
+    (vx, vy) за тик. Если цель не догнать, — время полёта до её текущего места.
+    """
+    # |d + v*t| = speed*t + reach  =>  (v·v - speed²)t² + 2(d·v - speed*reach)t + d·d - reach² = 0
+    a = vx * vx + vy * vy - speed * speed
+    b = 2 * (dx * vx + dy * vy - speed * reach)
+    c = dx * dx + dy * dy - reach * reach
+    if c <= 0:
+        return 0.0
+    if a < 0:
+        # Цель медленнее снаряда: ровно один положительный корень
+        return (-b - (b * b - 4 * a * c) ** 0.5) / (2 * a)
+    return max(0.0, (dx * dx + dy * dy) ** 0.5 - reach) / speed
+
+
+def overlap_ticks(pos, step, size, lo, hi):
+    """
+    Тики k >= 1, на которых отрезок [pos + k*step, pos + k*step + size)
+    пересекается с [lo, hi): (первый, последний) или None.
+    """
+    low, high = lo - size - pos, hi - pos  # нужно low < k*step < high
+    if step == 0:
+        return (1, math.inf) if low < 0 < high else None
+    if step < 0:
+        low, high, step = -high, -low, -step
+    first = max(1, low // step + 1)
+    last = -(-high // step) - 1
+    return (first, last) if first <= last else None
+
+
+def course_intercept(dx, dy, course, speed, reach=0.0):
+    """
+    intercept_time() для цели, которая идёт по отрезкам course
+    ([(тиков, vx, vy), ...], см. Monster.course) и сейчас смещена на (dx, dy).
+    Возвращает время встречи и смещение цели от снаряда в этот момент.
+    """
+    elapsed = 0
+    for ticks, vx, vy in course:
+        t = intercept_time(dx, dy, vx, vy, speed, reach + speed * elapsed)
+        if ticks is None or t <= ticks:
+            return elapsed + t, dx + vx * t, dy + vy * t
+        dx += vx * ticks
+        dy += vy * ticks
+        elapsed += ticks
+
+
+def course_point(x, y, course, t):
+    """
+    Где будет через t тиков цель, которая сейчас в (x, y) и идёт по отрезкам course.
+    """
+    for ticks, vx, vy in course:
+        step = t if ticks is None else min(t, ticks)
+        x += vx * step
+        y += vy * step
+        t -= step
+        if t <= 0:
+            break
+    return x, y
+
+
+def homing_speed(speed, dx, dy):
+    """
+    Скорость, с которой Bullet.update на самом деле идёт в направлении (dx, dy).
+    Rect округляет шаг до целых, поэтому по главной оси пуля проходит
+    round(speed * доля оси) пикселей за тик, а вторая ось её догоняет.
+    """
+    major = max(abs(dx), abs(dy))
+    if major == 0:
+        return speed
+    share = major / (dx * dx + dy * dy) ** 0.5
+    step = round(speed * share)
+    return step / share if step else speed
+
+
+class ProjectileGroup(PooledGroup):
+    """
+    Пули без покадрового полёта. При выстреле считается точка встречи с целью
+    по её известному пути (Monster.course) и тик попадания, который
+    ставится в TickScheduler. За тик обрабатываются только пули, чей тик настал:
+    если цель там, где её ждали, — попадание; если она свернула, упреждение один
+    раз пересчитывается с текущего места пули, а второе попадание засчитывается
+    без проверки. Пуля к мёртвой цели просто исчезает.
+
+    Когда цель останавливается для атаки или снова идёт, MonsterGroup сообщает
+    об этом через target_changed(), и пули к ней сразу пересчитывают упреждение
+    с того места, где они сейчас, а не ждут старого тика попадания.
+
+    Координаты пуль между вылетом и попаданием нужны только для картинки:
+    draw() расставляет их линейной интерполяцией на текущий тик.
+
+    Это приближение к Bullet.update: самонаводящаяся пуля округляет положение
+    до пикселя на каждом шаге, поэтому часть попаданий приходится на соседний
+    тик, и игра с тем же вводом может идти немного иначе.
+    """
+
+    def __init__(self, tower, barriers_group, *sprites, **kwargs):
+        self.tower = tower
+        self.barriers_group = barriers_group
+        self.tick = 0
+        self.wakeups = TickScheduler()
+        self.in_flight = {}  # цель -> пули к ней в порядке выстрелов
+        self.courses = {}  # цель -> её путь (Monster.course) в этом тике
+        self._order = itertools.count()
+        super().__init__(*sprites, **kwargs)
+
+    def spawn(self, cls, x, y, target):
+        bullet = super().spawn(cls, x, y, target)
+        bullet.order = next(self._order)
+        bullet.resolved = False
+        # Пуля выпущена во время тика self.tick и, как и обычная, в нём же делает первый шаг:
+        # считаем, что точку (x, y) она прошла в конце предыдущего тика
+        self._aim(bullet, (x, y), self.tick - 1)
+        return bullet
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.in_flight.setdefault(sprite.target, {})[sprite] = None
+
+    def remove_internal(self, sprite):
+        sprite.wake_token += 1
+        bullets = self.in_flight.get(sprite.target)
+        if bullets is not None:
+            bullets.pop(sprite, None)
+            if not bullets:
+                del self.in_flight[sprite.target]
+        super().remove_internal(sprite)
+
+    def target_changed(self, monster):
+        """
+        Монстр остановился или снова пошёл: его ход в этом тике уже сделан,
+        поэтому пули к нему целятся заново из точки, где будут в конце тика.
+        """
+        tick = self.tick
+        self.courses.pop(monster, None)
+        for bullet in list(self.in_flight.get(monster, ())):
+            if bullet.target_generation == monster.generation and bullet.hit_tick > tick:
+                self._aim(bullet, self.position(bullet, tick), tick)
+
+    def restore(self, bullet, origin, aim, elapsed, remaining, resolved):
+        """
+        Продолжить полёт пули из снимка: вылетела elapsed тиков назад,
+        попадёт через remaining тиков.
+        """
+        bullet.order = next(self._order)
+        bullet.origin = tuple(origin)
+        bullet.aim = tuple(aim)
+        bullet.fire_tick = self.tick - elapsed
+        bullet.hit_tick = self.tick + remaining
+        bullet.resolved = resolved
+        bullet.wake_token += 1
+        self.wakeups.schedule(bullet.hit_tick, bullet.order, bullet.wake_token, bullet)
+
+    def _aim(self, bullet, origin, tick):
+        """
+        Направить пулю из точки origin (где она в конце тика tick) в точку встречи с целью.
+        Цель уже сделала ход тика self.tick, а пуля ещё нет.
+        """
+        target = bullet.target
+        course = self.courses.get(target)
+        if course is None:
+            # В одну цель за тик стреляют многие оружия, а путь до конца тика не меняется
+            course = self.courses[target] = target.course(self.tower, self.barriers_group)
+        # Ход тика self.tick цель уже сделала: путь отсчитывается от конца тика tick
+        lag = self.tick - tick
+        ticks, vx, vy = course[0]
+        if lag:
+            course = [(None if ticks is None else ticks + lag, vx, vy), *course[1:]]
+        cx, cy = target.rect.center
+        x, y = cx - vx * lag, cy - vy * lag
+        dx, dy = x - origin[0], y - origin[1]
+        # Как у Bullet.update: шаг округляется до целых, а попадание засчитывается,
+        # когда до цели меньше speed, — на тик-шаг раньше встречи вплотную
+        _, meet_x, meet_y = course_intercept(dx, dy, course, bullet.speed)
+        speed = homing_speed(bullet.speed, meet_x, meet_y)
+        flight = math.floor(course_intercept(dx, dy, course, speed, bullet.speed - speed)[0]) + 1
+        bullet.origin = origin
+        bullet.aim = course_point(x, y, course, flight)
+        bullet.fire_tick = tick
+        bullet.hit_tick = tick + flight
+        bullet.wake_token += 1
+        self.wakeups.schedule(bullet.hit_tick, bullet.order, bullet.wake_token, bullet)
+
+    def position(self, bullet, tick):
+        """
+        Центр пули в конце тика tick (линейно между точкой вылета и точкой встречи).
+        """
+        ox, oy = bullet.origin
+        ax, ay = bullet.aim
+        k = min(1.0, (tick - bullet.fire_tick) / (bullet.hit_tick - bullet.fire_tick))
+        return round(ox + (ax - ox) * k), round(oy + (ay - oy) * k)
+
+    @staticmethod
+    def target_alive(bullet):
+        target = bullet.target
+        return (target.alive() and target.state != MONSTER_DEAD
+                and getattr(target, "generation", 0) == bullet.target_generation)
+
+    def update(self):
+        tick = self.tick
+        for bullet, token in self.wakeups.pop_due(tick):
+            if bullet.wake_token != token:
+                continue
+            if not self.target_alive(bullet):
+                bullet.kill()
+                continue
+            target = bullet.target
+            if not bullet.resolved and not target.rect.inflate(2 * bullet.speed, 2 * bullet.speed).collidepoint(bullet.aim):
+                # Цель ушла с рассчитанного пути: один раз пересчитываем упреждение
+                bullet.resolved = True
+                self._aim(bullet, self.position(bullet, tick), tick)
+                continue
+            target.take_damage(bullet.damage)
+            bullet.kill()
+        self.courses.clear()
+        self.tick += 1
+
+    def draw(self, surface, view=None):
+        # Отрисовка идёт после update(), то есть в конце тика self.tick - 1
+        tick = self.tick - 1
+        sprites = []
+        for bullet in self.sprites():
+            target = bullet.target
+            if target.generation != bullet.target_generation or target.state == MONSTER_DEAD or not target.alive():
+                continue
+            # То же, что position(), без вызова на каждую пулю
+            ox, oy = bullet.origin
+            ax, ay = bullet.aim
+            k = min(1.0, (tick - bullet.fire_tick) / (bullet.hit_tick - bullet.fire_tick))
+            bullet.rect.center = (round(ox + (ax - ox) * k), round(oy + (ay - oy) * k))
+            sprites.append(bullet)
+        if view is None:
+            rects = surface.blits([(b.image, b.rect) for b in sprites])
+        else:
+            sprites = visible_sprites(sprites, view)
+            rects = surface.blits([(b.image, b.rect.move(-view.x, -view.y)) for b in sprites])
+        self.spritedict.update(zip(sprites, rects))
+        self.lostsprites = []
+        return rects
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ КЛАСС УРОВНЯ (WAVES) --------------------------------------
+# -----------------------------------------------------------------------------------
+def compile_waves(waves):
+    """
+    Развернуть волны уровня в плоское расписание спавна.
+    waves: список кортежей (monster_class, количество, задержка_между_монстрами).
+    Возвращает (тики, номера типов, типы): монстр типа types[kinds[i]]
+    появляется на тике ticks[i] от начала уровня. Внутри волны монстры идут
+    каждые (задержка + 1) тиков, следующая волна начинается тиком позже.
+    """
+    types = []
+    ticks = array("I")
+    kinds = array("B")
+    tick = 0
+    for monster_class, count, delay in waves:
+        if count < 1 or delay < 0:
+            raise ValueError(f"Некорректная волна: {monster_class.__name__}, {count}, {delay}")
+        if monster_class not in types:
+            types.append(monster_class)
+        kind = types.index(monster_class)
+        for i in range(count):
+            ticks.append(tick)
+            kinds.append(kind)
+            tick += delay + 1 if i < count - 1 else 1
+    return ticks, kinds, tuple(types)
+
+
+class GameLevel:
+    """
+    Класс описывает один уровень (его волны монстров и др.).
+    Волны заранее компилируются в расписание спавна, и за тик уровень
+    только сравнивает счётчик тиков с очередной записью.
+    """
+
+    def __init__(self, waves, spawn_pos=(50, 50), spawn_points=None):
+        """
+        waves: список кортежей (monster_class, количество, задержка_между_монстрами)
+        Например:
+        [(Goblin, 5, 60), (Orc, 2, 120)]
+        spawn_points: несколько мест спавна (монстры выходят из них по очереди),
+        по умолчанию одно — spawn_pos.
+        """
+        self.waves = waves
+        self.spawn_ticks, self.spawn_kinds, self.monster_types = compile_waves(waves)
+        self.spawn_points = [tuple(point) for point in spawn_points] if spawn_points else [spawn_pos]
+        self.spawn_pos = self.spawn_points[0]  # место спавна
+        self.spawn_index = 0  # следующая запись расписания
+        self.tick = 0  # тиков с начала уровня
+        self.done = not self.spawn_ticks  # флаг завершения уровня
+
+    def update(self, monsters_group):
+        """
+        Выпустить монстров, чьё время по расписанию наступило.
+        """
+        if self.done:
+            return
+
+        ticks = self.spawn_ticks
+        while self.spawn_index < len(ticks) and ticks[self.spawn_index] <= self.tick:
+            monster_class = self.monster_types[self.spawn_kinds[self.spawn_index]]
+            x_spawn, y_spawn = self.spawn_points[self.spawn_index % len(self.spawn_points)]
+            if hasattr(monsters_group, "spawn"):
+                # Группа с пулом: берём готовый объект вместо создания нового
+                monsters_group.spawn(monster_class, x_spawn, y_spawn)
+            else:
+                monster = monster_class(x_spawn, y_spawn)
+                monsters_group.add(monster)
+            self.spawn_index += 1
+        self.tick += 1
+        # Все волны закончились
+        self.done = self.spawn_index >= len(ticks)
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ЗАГРУЗКА УРОВНЕЙ И БЕСКОНЕЧНЫЙ РЕЖИМ ----------------------
+# -----------------------------------------------------------------------------------
+LEVELS_FILE = os.path.join("data", "levels.json")
+
+
+class GameMap:
+    """
+    Карта мира: размер, место башни и точки спавна монстров.
+    По умолчанию мир совпадает с окном, а спавн один — в (50, 50).
+    В файле уровней карта задаётся необязательным ключом "map":
+        {"map": {"size": [2400, 1800], "tower": [1140, 840], "spawns": [[50, 50], [2300, 1700]]}, ...}
+    """
+
+    def __init__(self, size=(WIDTH, HEIGHT), tower_pos=TOWER_POS, spawn_points=((50, 50),)):
+        self.size = tuple(size)
+        self.tower_pos = tuple(tower_pos)
+        self.spawn_points = [tuple(point) for point in spawn_points]
+        world = pygame.Rect((0, 0), self.size)
+        if not self.spawn_points:
+            raise ValueError("На карте нужна хотя бы одна точка спавна")
+        for point in [self.tower_pos] + self.spawn_points:
+            if not world.collidepoint(point):
+                raise ValueError(f"Точка {point} вне карты {self.size[0]}x{self.size[1]}")
+
+    @property
+    def rect(self):
+        return pygame.Rect((0, 0), self.size)
+
+    def to_settings(self):
+        return {"size": list(self.size), "tower": list(self.tower_pos),
+                "spawns": [list(point) for point in self.spawn_points]}
+
+    @classmethod
+    def from_settings(cls, data):
+        if not data:
+            return cls()
+        return cls(data["size"], data["tower"], data["spawns"])
+
+
+def load_map(filename=LEVELS_FILE):
+    """
+    Карта из файла уровней (без ключа "map" — стандартная карта размером с окно).
+    """
+    with open(filename, encoding="utf-8") as f:
+        data = json.load(f)
+    return GameMap.from_settings(data.get("map"))
+
+
+def load_waves(filename=LEVELS_FILE, types=None):
+    """
+    Прочитать описание уровней из JSON-файла:
+        {"levels": [[["Goblin", 5, 60], ["Orc", 2, 120]], ...]}
+    Каждый уровень — список волн [тип, количество, задержка].
+    types: словарь имя -> класс монстра (по умолчанию MONSTER_TYPES).
+    Возвращает список уровней, каждый — список кортежей (класс, количество, задержка).
+    """
+    types = MONSTER_TYPES if types is None else types
+    with open(filename, encoding="utf-8") as f:
+        data = json.load(f)
+    levels = []
+    for waves in data["levels"]:
+        level = []
+        for name, count, delay in waves:
+            if name not in types:
+                raise ValueError(f"{filename}: неизвестный тип монстра {name!r}")
+            level.append((types[name], int(count), int(delay)))
+        levels.append(level)
+    return levels
+
+
+def endless_levels(seed=0, types=None, first_level=0, spawn_points=None):
+    """
+    Бесконечная последовательность уровней. Уровни создаются лениво, по одному,
+    когда симуляция переходит к следующему, поэтому сколь угодно долгая игра
+    не держит в памяти список всех уровней. С номером уровня растёт число
+    монстров и сокращаются паузы между ними.
+    """
+    rng = random.Random(seed)
+    types = list((MONSTER_TYPES if types is None else types).values())
+    for number in itertools.count(first_level):
+        waves = []
+        for _ in range(2 + number // 3):
+            monster_class = rng.choice(types[:1 + min(len(types) - 1, number // 2)])
+            count = 3 + number + rng.randrange(3)
+            delay = max(10, 90 - 5 * number + rng.randrange(20))
+            waves.append((monster_class, count, delay))
+        yield GameLevel(waves, spawn_points=spawn_points)
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ МАССИВНОЕ ХРАНИЛИЩЕ МОНСТРОВ И ПУЛЬ (NumPy) ---------------
+# -----------------------------------------------------------------------------------
+# Цель монстра в хранилище: индекс баррикады (>= 0) или один из кодов ниже
+TARGET_NONE = -1
+TARGET_TOWER = -2
+
+
+class EntityStore:
+    """
+    Необязательное хранилище монстров и пуль в виде непрерывных массивов NumPy
+    (структура массивов вместо отдельного спрайта на каждый объект).
+    Движение, атаки, стрельба оружия и полёт пуль считаются векторно сразу
+    для всех объектов; спрайты не создаются, рисование идёт прямо из массивов.
+
+    Правила те же, что у Monster/Weapon/Bullet. Для GameLevel хранилище ведёт
+    себя как группа монстров: add() принимает созданного монстра и копирует
+    его характеристики в массивы.
+    """
+
+    def __init__(self, capacity=256, bullet_speed=5, bullet_damage=10):
+        if np is None:
+            raise ImportError("Для EntityStore нужен пакет numpy")
+        self.bullet_speed = bullet_speed
+        self.bullet_damage = bullet_damage
+        self.bullet_image = load_image("bullet.png")
+        self.bullet_half = (self.bullet_image.get_width() // 2, self.bullet_image.get_height() // 2)
+
+        # Типы монстров: класс -> номер, номер -> атлас кадров
+        self.type_ids = {}
+        self.type_atlases = []
+        # Часы, как у MonsterGroup: кадр монстра зависит от tick - m_phase
+        self.tick = 0
+
+        self.m_capacity = 0
+        self.m_count = 0  # граница занятых слотов (живые монстры лежат в [0, m_count))
+        self.m_free = []
+        self.m_spawned = 0
+        self._grow_monsters(capacity)
+
+        self.b_capacity = 0
+        self.b_count = 0
+        self.b_free = []
+        self._grow_bullets(capacity)
+
+        # Снимок баррикад: списки спрайтов и массивы их прямоугольников
+        self._barrier_version = None
+        self._barriers = []
+        self._barrier_killer = np.zeros(0, dtype=np.int64)
+        self._barrier_rects = np.zeros((0, 4), dtype=np.int32)
+        self._barrier_cells = None
+
+        # Снимок оружия: спрайты и их таймеры стрельбы
+        self._weapons = []
+        self._weapon_pos = np.zeros((0, 2), dtype=np.int64)
+        self._weapon_timer = np.zeros(0, dtype=np.int32)
+        self._weapon_delay = np.zeros(0, dtype=np.int32)
+        self._weapon_range2 = np.zeros(0, dtype=np.int64)
+
+    # ------------------------ память под объекты ------------------------
+    @staticmethod
+    def _grown(array, capacity):
+        grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def _grow_monsters(self, capacity):
+        if self.m_capacity == 0:
+            self.m_x = np.zeros(0, dtype=np.int32)
+            self.m_y = np.zeros(0, dtype=np.int32)
+            self.m_w = np.zeros(0, dtype=np.int32)
+            self.m_h = np.zeros(0, dtype=np.int32)
+            self.m_speed = np.zeros(0, dtype=np.int32)
+            self.m_damage = np.zeros(0, dtype=np.int32)
+            self.m_health = np.zeros(0, dtype=np.int32)
+            self.m_state = np.zeros(0, dtype=np.int8)
+            self.m_attack_timer = np.zeros(0, dtype=np.int32)
+            self.m_attack_delay = np.zeros(0, dtype=np.int32)
+            self.m_target = np.zeros(0, dtype=np.int32)
+            self.m_type = np.zeros(0, dtype=np.int16)
+            self.m_phase = np.zeros(0, dtype=np.int64)
+            self.m_alive = np.zeros(0, dtype=bool)
+            # Поколение слота: пуля попадает, только если слот не переиспользован
+            self.m_gen = np.zeros(0, dtype=np.int32)
+            # Порядковый номер появления: при равных расстояниях оружие выбирает
+            # более раннего монстра, как при обходе группы
+            self.m_seq = np.zeros(0, dtype=np.int64)
+        for name in ("m_x", "m_y", "m_w", "m_h", "m_speed", "m_damage", "m_health",
+                     "m_state", "m_attack_timer", "m_attack_delay", "m_target", "m_type",
+                     "m_phase", "m_alive", "m_gen", "m_seq"):
+            setattr(self, name, self._grown(getattr(self, name), capacity))
+        self.m_capacity = capacity
+
+    def _grow_bullets(self, capacity):
+        if self.b_capacity == 0:
+            # Левый верхний угол пули в целых пикселях, как у pygame.Rect
+            self.b_pos = np.zeros((0, 2), dtype=np.int64)
+            self.b_target = np.zeros(0, dtype=np.int32)
+            self.b_gen = np.zeros(0, dtype=np.int32)
+            self.b_alive = np.zeros(0, dtype=bool)
+        for name in ("b_pos", "b_target", "b_gen", "b_alive"):
+            setattr(self, name, self._grown(getattr(self, name), capacity))
+        self.b_capacity = capacity
+
+    # ------------------------ интерфейс группы монстров ------------------------
+    def add(self, *monsters):
+        """
+        Забрать в хранилище только что созданных монстров (спрайты дальше не нужны).
+        Возвращает список занятых слотов.
+        """
+        slots = []
+        for monster in monsters:
+            type_id = self.type_ids.get(type(monster))
+            if type_id is None:
+                type_id = len(self.type_atlases)
+                self.type_ids[type(monster)] = type_id
+                self.type_atlases.append(monster.atlas)
+
+            if self.m_free:
+                i = self.m_free.pop()
+            else:
+                if self.m_count == self.m_capacity:
+                    self._grow_monsters(self.m_capacity * 2)
+                i = self.m_count
+                self.m_count += 1
+            self.m_x[i], self.m_y[i] = monster.rect.topleft
+            self.m_w[i], self.m_h[i] = monster.rect.size
+            self.m_speed[i] = monster.speed
+            self.m_damage[i] = monster.damage
+            self.m_health[i] = monster.health
+            self.m_state[i] = MONSTER_ATTACK if monster.state == MONSTER_ATTACK else MONSTER_MOVE
+            self.m_attack_timer[i] = monster.attack_timer
+            self.m_attack_delay[i] = monster.attack_delay
+            self.m_target[i] = self._target_code(monster.target)
+            self.m_type[i] = type_id
+            self.m_phase[i] = self.tick
+            self.m_alive[i] = True
+            self.m_gen[i] += 1
+            self.m_seq[i] = self.m_spawned
+            self.m_spawned += 1
+            slots.append(i)
+        return slots
+
+    def _target_code(self, target):
+        if target is None:
+            return TARGET_NONE
+        if target in self._barriers:
+            return self._barriers.index(target)
+        return TARGET_TOWER
+
+    def add_bullets(self, positions, targets):
+        """
+        Добавить летящие пули: левые верхние углы и слоты монстров-целей.
+        """
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        self._spawn_bullets(positions + self.bullet_half, np.asarray(targets, dtype=np.int64))
+
+    def snapshot_rows(self, barrier_ids):
+        """
+        Монстры, пули и таймеры оружия в виде строк снимка состояния (см. take_snapshot).
+        barrier_ids: баррикада -> её номер в снимке.
+        """
+        classes = list(self.type_ids)
+        n = self.m_count
+        alive = np.flatnonzero(self.m_alive[:n])
+        alive = alive[np.argsort(self.m_seq[alive], kind="stable")]
+        monster_ids = {}
+        monsters = []
+        for i in alive.tolist():
+            target = int(self.m_target[i])
+            if target >= 0:
+                target = barrier_ids.get(self._barriers[target], TARGET_NONE)
+            monster_ids[i] = len(monsters)
+            monsters.append([classes[self.m_type[i]].__name__, int(self.m_x[i]), int(self.m_y[i]),
+                             self.age(i), int(self.m_speed[i]), int(self.m_damage[i]),
+                             int(self.m_health[i]), int(self.m_attack_delay[i]), int(self.m_attack_timer[i]),
+                             int(self.m_state[i]), target])
+        bullets = []
+        for i in np.flatnonzero(self.b_alive[:self.b_count]).tolist():
+            t = int(self.b_target[i])
+            # Пуля к уже мёртвому монстру исчезла бы на следующем тике
+            if self.m_alive[t] and self.m_gen[t] == self.b_gen[i]:
+                x, y = self.b_pos[i].tolist()
+                bullets.append([x, y, monster_ids[t], self.bullet_speed, self.bullet_damage])
+        timers = {weapon: int(timer) for weapon, timer in zip(self._weapons, self._weapon_timer.tolist())}
+        return monsters, bullets, timers
+
+    def age(self, i):
+        """
+        Возраст монстра в слоте i по часам анимации (по модулю периода атласа).
+        """
+        return (self.tick - int(self.m_phase[i])) % self.type_atlases[self.m_type[i]].period
+
+    def __len__(self):
+        return int(np.count_nonzero(self.m_alive[:self.m_count]))
+
+    def __bool__(self):
+        return len(self) > 0
+
+    @property
+    def bullet_count(self):
+        return int(np.count_nonzero(self.b_alive[:self.b_count]))
+
+    def _free_monsters(self, mask):
+        idx = np.flatnonzero(mask)
+        if len(idx):
+            self.m_alive[idx] = False
+            self.m_free.extend(idx.tolist())
+
+    def _free_bullets(self, idx):
+        if len(idx):
+            self.b_alive[idx] = False
+            self.b_free.extend(idx.tolist())
+
+    # ------------------------ синхронизация со спрайтами ------------------------
+    def _sync_barriers(self, barriers_group):
+        """
+        Пересобрать массивы баррикад, если группа изменилась, и перенумеровать
+        цели атакующих монстров.
+        """
+        version = getattr(barriers_group, "version", None)
+        if version is not None and version == self._barrier_version:
+            return
+        self._barrier_version = version
+        old = self._barriers
+        new = list(barriers_group)
+        new_index = {barrier: i for i, barrier in enumerate(new)}
+        # Старый индекс -> новый (-1, если баррикада разрушена)
+        remap = np.array([new_index.get(barrier, TARGET_NONE) for barrier in old] + [0],
+                         dtype=np.int32)
+        n = self.m_count
+        targets = self.m_target[:n]
+        on_barrier = targets >= 0
+        targets[on_barrier] = remap[targets[on_barrier]]
+
+        self._barriers = new
+        self._barrier_rects = np.array([tuple(b.rect) for b in new], dtype=np.int32).reshape(-1, 4)
+
+        # Слоистая карта ячеек: до `layers` баррикад на ячейку, в порядке группы
+        cell_lists = {}
+        for i, barrier in enumerate(new):
+            r = barrier.rect
+            for cx in range(r.left // CELL_SIZE, (r.right - 1) // CELL_SIZE + 1):
+                for cy in range(r.top // CELL_SIZE, (r.bottom - 1) // CELL_SIZE + 1):
+                    cell_lists.setdefault((cx, cy), []).append(i)
+        if cell_lists:
+            layers = max(len(v) for v in cell_lists.values())
+            gw = max(WIDTH // CELL_SIZE + 2, max(k[0] for k in cell_lists) + 1)
+            gh = max(HEIGHT // CELL_SIZE + 2, max(k[1] for k in cell_lists) + 1)
+            grid = np.full((gw, gh, layers), -1, dtype=np.int32)
+            for (cx, cy), items in cell_lists.items():
+                if cx >= 0 and cy >= 0:
+                    grid[cx, cy, :len(items)] = items
+            self._barrier_cells = grid
+        else:
+            self._barrier_cells = None
+
+    def _sync_weapons(self, weapons_group):
+        """
+        Добавить в массивы новое оружие (оружие не уничтожается, только добавляется).
+        """
+        weapons = list(weapons_group)
+        if len(weapons) == len(self._weapons) and (not weapons or weapons[-1] is self._weapons[-1]):
+            return
+        known = {weapon: i for i, weapon in enumerate(self._weapons)}
+        timer = np.array([self._weapon_timer[known[w]] if w in known else w.fire_timer
+                          for w in weapons], dtype=np.int32)
+        self._weapons = weapons
+        self._weapon_timer = timer
+        self._weapon_pos = np.array([w.rect.center for w in weapons], dtype=np.int64).reshape(-1, 2)
+        self._weapon_delay = np.array([w.fire_delay for w in weapons], dtype=np.int32)
+        self._weapon_range2 = np.array([999999 if w.fire_range is None else w.fire_range ** 2 + 1
+                                        for w in weapons], dtype=np.int64)
+
+    # ------------------------ один тик ------------------------
+    def update(self, tower, barriers_group, weapons_group):
+        """
+        Продвинуть всех монстров, оружие и пули на один тик.
+        """
+        self._sync_barriers(barriers_group)
+        # Как в Monster.update: монстр, бросивший разрушенную цель, пойдёт только со следующего тика
+        was_moving = self.m_state[:self.m_count] == MONSTER_MOVE
+        # Порядковый номер монстра, разрушившего баррикаду в этом тике: идущие
+        # в группе раньше него ещё видят её (при столкновении и обходе)
+        self._barrier_killer = np.full(len(self._barriers), np.iinfo(np.int64).max, dtype=np.int64)
+        self._attack(tower)
+        self._move(tower, was_moving, getattr(barriers_group, "flow_field", None))
+        self._sync_barriers(barriers_group)
+        self.tick += 1
+        self._sync_weapons(weapons_group)
+        self._fire()
+        self._update_bullets()
+
+    def _attack(self, tower):
+        n = self.m_count
+        attacking = np.flatnonzero(self.m_alive[:n] & (self.m_state[:n] == MONSTER_ATTACK))
+        if not len(attacking):
+            return
+        target = self.m_target[attacking]
+        on_tower = target == TARGET_TOWER
+        # Разрушенная цель (или её отсутствие) — возвращаемся к движению
+        lost = (target == TARGET_NONE) | (on_tower & (tower.health <= 0))
+        if lost.any():
+            self.m_state[attacking[lost]] = MONSTER_MOVE
+            self.m_target[attacking[lost]] = TARGET_NONE
+            attacking, target, on_tower = attacking[~lost], target[~lost], on_tower[~lost]
+
+        timer = self.m_attack_timer[attacking]
+        waiting = timer > 0
+        self.m_attack_timer[attacking[waiting]] -= 1
+        hitting = attacking[~waiting]
+        if not len(hitting):
+            return
+        self.m_attack_timer[hitting] = self.m_attack_delay[hitting]
+        hit_target = target[~waiting]
+        damage = self.m_damage[hitting]
+
+        tower_damage = int(damage[hit_target == TARGET_TOWER].sum())
+        if tower_damage:
+            tower.take_damage(tower_damage)
+        on_barrier = hit_target >= 0
+        if on_barrier.any():
+            per_barrier = np.bincount(hit_target[on_barrier], weights=damage[on_barrier],
+                                      minlength=len(self._barriers))
+            for i in np.flatnonzero(per_barrier):
+                barrier = self._barriers[i]
+                if per_barrier[i] < barrier.health:
+                    barrier.take_damage(int(per_barrier[i]))
+                else:
+                    self._break_barrier(i, attacking[target == i], timer[target == i])
+
+    def _break_barrier(self, i, attackers, old_timer):
+        """
+        Баррикада разрушается в этом тике. В группе спрайтов монстры бьют по
+        очереди, и те, кто идёт после разрушившего, уже видят обломки: не бьют,
+        не трогают таймер и сразу возвращаются к движению. Повторяем этот порядок.
+        """
+        barrier = self._barriers[i]
+        order = np.argsort(self.m_seq[attackers], kind="stable")
+        health = barrier.health
+        for k in order:
+            m = attackers[k]
+            if health <= 0:
+                self.m_state[m] = MONSTER_MOVE
+                self.m_target[m] = TARGET_NONE
+                self.m_attack_timer[m] = old_timer[k]
+            elif old_timer[k] <= 0:
+                health -= int(self.m_damage[m])
+                if health <= 0:
+                    self._barrier_killer[i] = self.m_seq[m]
+        barrier.take_damage(barrier.health - health)
+
+    def _move(self, tower, was_moving, flow_field=None):
+        n = self.m_count
+        moving = np.flatnonzero(self.m_alive[:n] & was_moving)
+        if not len(moving):
+            return
+        x, y = self.m_x[moving], self.m_y[moving]
+        w, h = self.m_w[moving], self.m_h[moving]
+
+        # Столкновения с баррикадами: проверяем только ячейки под монстром
+        if self._barrier_cells is not None:
+            best = self._barrier_hits(x, y, w, h, self.m_seq[moving])
+            blocked = best < len(self._barriers)
+            if blocked.any():
+                stopped = moving[blocked]
+                self.m_state[stopped] = MONSTER_ATTACK
+                self.m_target[stopped] = best[blocked]
+                moving, x, y, w, h = (moving[~blocked], x[~blocked], y[~blocked],
+                                      w[~blocked], h[~blocked])
+
+        # Двигаемся к башне по каждой оси
+        speed = self.m_speed[moving]
+        tx, ty, tw, th = tower.rect
+        step_x = speed * np.sign(tx - x)
+        step_y = speed * np.sign(ty - y)
+        if flow_field is not None:
+            # По полю направлений: к центру следующей клетки пути
+            # (у каждого размера монстров своё поле)
+            cx, cy = x + w // 2, y + h // 2
+            steered = np.zeros(len(moving), dtype=bool)
+            for width, height in sorted(set(zip(w.tolist(), h.tolist()))):
+                field = flow_field.for_size(width, height)
+                col, row = cx // field.cell_size, cy // field.cell_size
+                inside = (w == width) & (h == height) & (col >= 0) & (col < field.cols) \
+                    & (row >= 0) & (row < field.rows)
+                cell = np.where(inside, row * field.cols + col, 0)
+                next_x, next_y = field.target_arrays()
+                nx, ny = next_x[cell], next_y[cell]
+                use = inside & (nx >= 0)
+                step_x = np.where(use, np.clip(nx - cx, -speed, speed), step_x)
+                step_y = np.where(use, np.clip(ny - cy, -speed, speed), step_y)
+                steered |= use
+            step_x, step_y = self._slide(x, y, w, h, self.m_seq[moving], step_x, step_y, steered)
+        x = x + step_x
+        y = y + step_y
+        self.m_x[moving], self.m_y[moving] = x, y
+
+        # Если мы близко к башне, переходим к атаке
+        at_tower = (x < tx + tw) & (x + w > tx) & (y < ty + th) & (y + h > ty)
+        if at_tower.any():
+            self.m_state[moving[at_tower]] = MONSTER_ATTACK
+            self.m_target[moving[at_tower]] = TARGET_TOWER
+
+    def _barrier_hits(self, x, y, w, h, seq):
+        """
+        Для прямоугольников (x, y, w, h) монстров с порядковыми номерами seq: номер
+        первой по порядку группы баррикады, с которой он пересекается, или
+        len(self._barriers). Смотрим только ячейки под ним; баррикада, разрушенная
+        в этом тике, видна только монстрам, которые в группе раньше разрушившего.
+        """
+        grid = self._barrier_cells
+        best = np.full(len(x), len(self._barriers), dtype=np.int64)
+        if grid is None:
+            return best
+        gw, gh, layers = grid.shape
+        rects = self._barrier_rects
+        n = self.m_count
+        span = max(int(self.m_w[:n].max()), int(self.m_h[:n].max())) // CELL_SIZE + 2
+        cx0, cy0 = x // CELL_SIZE, y // CELL_SIZE
+        cx1, cy1 = (x + w - 1) // CELL_SIZE, (y + h - 1) // CELL_SIZE
+        for ox in range(span):
+            for oy in range(span):
+                cx, cy = cx0 + ox, cy0 + oy
+                valid = (cx <= cx1) & (cy <= cy1) & (cx >= 0) & (cy >= 0) & (cx < gw) & (cy < gh)
+                if not valid.any():
+                    continue
+                rows = np.flatnonzero(valid)
+                for layer in range(layers):
+                    cand = grid[cx[rows], cy[rows], layer]
+                    has = cand >= 0
+                    if not has.any():
+                        break
+                    r, c = rows[has], cand[has]
+                    bx, by, bw, bh = rects[c, 0], rects[c, 1], rects[c, 2], rects[c, 3]
+                    hit = ((x[r] < bx + bw) & (x[r] + w[r] > bx) &
+                           (y[r] < by + bh) & (y[r] + h[r] > by) & (seq[r] < self._barrier_killer[c]))
+                    r, c = r[hit], c[hit]
+                    np.minimum.at(best, r, c)
+        return best
+
+    def _slide(self, x, y, w, h, seq, step_x, step_y, steered):
+        """
+        Как Monster.slide: шаг по полю направлений (steered), упирающийся
+        в баррикаду, заменяется шагом по одной оси.
+        """
+        if self._barrier_cells is None:
+            return step_x, step_y
+        none = len(self._barriers)
+        k = np.flatnonzero(steered)
+        if not len(k):
+            return step_x, step_y
+        k = k[self._barrier_hits(x[k] + step_x[k], y[k] + step_y[k], w[k], h[k], seq[k]) < none]
+        if not len(k):
+            return step_x, step_y
+        kx, ky, kw, kh, ks, sx, sy = x[k], y[k], w[k], h[k], seq[k], step_x[k], step_y[k]
+        only_x = (sx != 0) & (self._barrier_hits(kx + sx, ky, kw, kh, ks) == none)
+        only_y = ~only_x & (sy != 0) & (self._barrier_hits(kx, ky + sy, kw, kh, ks) == none)
+        step_x, step_y = step_x.copy(), step_y.copy()
+        step_y[k[only_x]] = 0
+        step_x[k[only_y]] = 0
+        return step_x, step_y
+
+    def _fire(self, chunk=256):
+        timer = self._weapon_timer
+        if not len(timer):
+            return
+        ready = np.flatnonzero(timer == 0)
+        timer[timer > 0] -= 1
+        if not len(ready):
+            return
+        n = self.m_count
+        alive = np.flatnonzero(self.m_alive[:n])
+        if not len(alive):
+            return
+        centers_x = (self.m_x[alive] + self.m_w[alive] // 2).astype(np.int64)
+        centers_y = (self.m_y[alive] + self.m_h[alive] // 2).astype(np.int64)
+        seq = self.m_seq[alive]
+        shooters = []
+        targets = []
+        for start in range(0, len(ready), chunk):
+            part = ready[start:start + chunk]
+            wx = self._weapon_pos[part, 0][:, None]
+            wy = self._weapon_pos[part, 1][:, None]
+            dist2 = (centers_x[None, :] - wx) ** 2 + (centers_y[None, :] - wy) ** 2
+            # Ближайший, а среди равноудалённых — появившийся раньше
+            nearest = ((dist2 << 32) + seq[None, :]).argmin(axis=1)
+            in_range = dist2[np.arange(len(part)), nearest] < self._weapon_range2[part]
+            shooters.append(part[in_range])
+            targets.append(alive[nearest[in_range]])
+        shooters = np.concatenate(shooters)
+        targets = np.concatenate(targets)
+        if not len(shooters):
+            return
+        timer[shooters] = self._weapon_delay[shooters]
+        self._spawn_bullets(self._weapon_pos[shooters], targets)
+
+    def _spawn_bullets(self, positions, targets):
+        count = len(targets)
+        reuse = min(count, len(self.b_free))
+        slots = [self.b_free.pop() for _ in range(reuse)]
+        extra = count - reuse
+        if self.b_count + extra > self.b_capacity:
+            capacity = self.b_capacity
+            while self.b_count + extra > capacity:
+                capacity *= 2
+            self._grow_bullets(capacity)
+        slots.extend(range(self.b_count, self.b_count + extra))
+        self.b_count += extra
+        slots = np.array(slots, dtype=np.int64)
+        self.b_pos[slots] = positions - self.bullet_half
+        self.b_target[slots] = targets
+        self.b_gen[slots] = self.m_gen[targets]
+        self.b_alive[slots] = True
+
+    def _update_bullets(self):
+        n = self.b_count
+        flying = np.flatnonzero(self.b_alive[:n])
+        if not len(flying):
+            return
+        target = self.b_target[flying]
+        # Цель уже мертва (или слот занят другим монстром) — убираем пулю
+        valid = self.m_alive[target] & (self.m_gen[target] == self.b_gen[flying])
+        self._free_bullets(flying[~valid])
+        flying, target = flying[valid], target[valid]
+        if not len(flying):
+            return
+
+        pos = self.b_pos[flying]
+        half_w, half_h = self.bullet_half
+        dx = (self.m_x[target] + self.m_w[target] // 2) - (pos[:, 0] + half_w)
+        dy = (self.m_y[target] + self.m_h[target] // 2) - (pos[:, 1] + half_h)
+        dist = np.hypot(dx, dy)
+        hit = dist < self.bullet_speed
+
+        # Попадания: урон по монстрам, убитые монстры освобождают слоты
+        if hit.any():
+            np.subtract.at(self.m_health, target[hit], self.bullet_damage)
+            self._free_bullets(flying[hit])
+            killed = np.zeros(self.m_count, dtype=bool)
+            killed[target[hit]] = True
+            killed &= self.m_alive[:self.m_count] & (self.m_health[:self.m_count] <= 0)
+            self._free_monsters(killed)
+
+        # Остальные пули летят к цели (с округлением до пикселя, как pygame.Rect)
+        move = ~hit
+        step = self.bullet_speed / dist[move]
+        shift = np.stack([dx[move] * step, dy[move] * step], axis=1)
+        self.b_pos[flying[move]] += np.floor(shift + 0.5).astype(np.int64)
+
+    # ------------------------ отрисовка ------------------------
+    def draw(self, surface, view=None):
+        """
+        Нарисовать монстров и пули прямо из массивов (одним вызовом blits).
+        view — видимая область мира, как у ViewGroup.draw().
+        Возвращает список затронутых прямоугольников.
+        """
+        n = self.m_count
+        visible = self.m_alive[:n]
+        dx = dy = 0
+        if view is not None:
+            # Отсечение по видимой области — одной векторной операцией
+            dx, dy = -view.x, -view.y
+            x, y = self.m_x[:n], self.m_y[:n]
+            visible = visible & (x < view.right) & (x + self.m_w[:n] > view.left) \
+                & (y < view.bottom) & (y + self.m_h[:n] > view.top)
+        alive = np.flatnonzero(visible)
+        # Рисуем в порядке появления, как группа спрайтов
+        alive = alive[np.argsort(self.m_seq[alive], kind="stable")]
+        atlases = self.type_atlases
+        types = self.m_type[alive]
+        # Шаг таблицы кадров каждого монстра — одна векторная операция на всех
+        periods = np.array([atlas.period for atlas in atlases], dtype=np.int64)
+        steps = (self.tick - self.m_phase[alive]) % periods[types]
+        sequence = [(atlases[t].sheet, (x, y), atlases[t].steps[step]) for t, step, x, y in zip(
+            types.tolist(), steps.tolist(), (self.m_x[alive] + dx).tolist(), (self.m_y[alive] + dy).tolist())]
+        image = self.bullet_image
+        pos = self.b_pos[:self.b_count]
+        flying = self.b_alive[:self.b_count]
+        if view is not None:
+            w, h = image.get_size()
+            flying = flying & (pos[:, 0] < view.right) & (pos[:, 0] + w > view.left) \
+                & (pos[:, 1] < view.bottom) & (pos[:, 1] + h > view.top)
+        sequence.extend((image, (x, y)) for x, y in (pos[flying] + (dx, dy)).tolist())
+        return surface.blits(sequence)
+
+    def sprites(self):
+        """
+        Материализовать живых монстров как спрайты (только для отрисовки/отладки).
+        """
+        result = []
+        n = self.m_count
+        for i in np.flatnonzero(self.m_alive[:n]).tolist():
+            sprite = pygame.sprite.Sprite()
+            sprite.image = self.type_atlases[self.m_type[i]].frame(self.tick - int(self.m_phase[i]))
+            sprite.rect = pygame.Rect(int(self.m_x[i]), int(self.m_y[i]),
+                                      int(self.m_w[i]), int(self.m_h[i]))
+            result.append(sprite)
+        return result
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ ПРОФИЛИРОВЩИК КАДРА ---------------------------------------
+# -----------------------------------------------------------------------------------
+# Границы корзин гистограммы времени кадра, мс (последняя корзина — всё, что дольше)
+FRAME_HISTOGRAM_MS = (2, 4, 8, 12, 16, 20, 25, 33, 50, 100)
+
+
+class FrameProfiler:
+    """
+    Встроенный замер времени фаз кадра.
+    Кадр размечается вызовами begin(), lap("фаза") после каждой фазы и end():
+    lap() записывает время, прошедшее с предыдущей отметки, поэтому на фазу
+    уходит один вызов perf_counter(). Последние window кадров хранятся для
+    скользящих перцентилей, а гистограмма времени кадра копится за всю игру.
+    """
+
+    def __init__(self, window=600):
+        self.window = window
+        self.phases = {}  # фаза -> deque последних времён, сек
+        self.totals = {}  # фаза -> суммарное время за всю игру, сек
+        self.frame_times = deque(maxlen=window)
+        self.histogram = [0] * (len(FRAME_HISTOGRAM_MS) + 1)
+        self.frames = 0
+        self.worst_frame = 0.0
+        self._current = {}
+        self._frame_start = 0.0
+        self._mark = 0.0
+        # Оверлей перерисовывается не каждый кадр, а раз в overlay_every кадров
+        self.overlay_every = 15
+        self._overlay = None
+        self._overlay_frame = -1
+
+    def begin(self):
+        self._frame_start = self._mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        current = self._current
+        current[phase] = current.get(phase, 0.0) + now - self._mark
+        self._mark = now
+
+    def end(self):
+        total = time.perf_counter() - self._frame_start
+        current = self._current
+        for phase in current:
+            if phase not in self.phases:
+                self.phases[phase] = deque(maxlen=self.window)
+                self.totals[phase] = 0.0
+        for phase, samples in self.phases.items():
+            spent = current.get(phase, 0.0)
+            samples.append(spent)
+            self.totals[phase] += spent
+        current.clear()
+
+        self.frame_times.append(total)
+        self.frames += 1
+        self.worst_frame = max(self.worst_frame, total)
+        ms = total * 1000
+        for i, edge in enumerate(FRAME_HISTOGRAM_MS):
+            if ms <= edge:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    @staticmethod
+    def percentiles(samples, points=(50, 95, 99)):
+        """
+        Перцентили выборки в миллисекундах (ближайший ранг).
+        """
+        ordered = sorted(samples)
+        if not ordered:
+            return {p: 0.0 for p in points}
+        last = len(ordered) - 1
+        return {p: ordered[min(last, int(p / 100 * len(ordered)))] * 1000 for p in points}
+
+    def summary(self):
+        """
+        Сводка: перцентили кадра и каждой фазы по окну, средние за всю игру.
+        """
+        frames = max(self.frames, 1)
+        phases = {}
+        for phase, samples in self.phases.items():
+            stats = {f"p{p}_ms": v for p, v in self.percentiles(samples).items()}
+            stats["mean_ms"] = self.totals[phase] / frames * 1000
+            phases[phase] = stats
+        frame = {f"p{p}_ms": v for p, v in self.percentiles(self.frame_times).items()}
+        frame["max_ms"] = self.worst_frame * 1000
+        return {"frames": self.frames, "window": self.window, "frame": frame, "phases": phases}
+
+    def histogram_rows(self):
+        """
+        Гистограмма времени кадра: список (верхняя граница в мс или None, число кадров).
+        """
+        edges = list(FRAME_HISTOGRAM_MS) + [None]
+        return list(zip(edges, self.histogram))
+
+    def dump(self, filename):
+        """
+        Сохранить сводку и гистограмму в JSON-файл.
+        """
+        data = self.summary()
+        data["histogram"] = [{"le_ms": edge, "count": count} for edge, count in self.histogram_rows()]
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def overlay_lines(self):
+        summary = self.summary()
+        frame = summary["frame"]
+        lines = [("кадр, мс", f"p50 {frame['p50_ms']:.1f}  p95 {frame['p95_ms']:.1f}  "
+                                f"p99 {frame['p99_ms']:.1f}  max {frame['max_ms']:.1f}")]
+        for phase, stats in summary["phases"].items():
+            lines.append((phase, f"p50 {stats['p50_ms']:.2f}  p95 {stats['p95_ms']:.2f}"))
+        return lines
+
+    def draw_overlay(self, screen, pos=(WIDTH - 330, 10)):
+        """
+        Нарисовать панель со статистикой и вернуть её прямоугольник.
+        Панель пересобирается раз в overlay_every кадров.
+        """
+        if self._overlay is None or self.frames - self._overlay_frame >= self.overlay_every:
+            font = get_font(16)
+            lines = self.overlay_lines()
+            height = len(lines) * font.get_linesize() + 10
+            panel = pygame.Surface((320, height))
+            panel.fill((20, 20, 20))
+            panel.set_alpha(200)
+            y = 5
+            for name, values in lines:
+                # Название фазы и числа — в двух колонках
+                panel.blit(font.render(name, True, WHITE), (5, y))
+                panel.blit(font.render(values, True, WHITE), (85, y))
+                y += font.get_linesize()
+            self._overlay = panel
+            self._overlay_frame = self.frames
+        return screen.blit(self._overlay, pos)
+
+
 # -----------------------------------------------------------------------------------
-# ------------------------ КЛАСС ОРУЖИЯ (устанавливаемого) ---------------------------
+# ------------------------ СИМУЛЯЦИЯ (БЕЗ ОКНА И ЧАСОВ) ------------------------------
 # -----------------------------------------------------------------------------------
-class Weapon(pygame.sprite.Sprite):
+# Команды игрока передаются в симуляцию как данные: (вид, x, y)
+CMD_TOGGLE_BARRIER = "toggle_barrier"  # клавиша B
+CMD_TOGGLE_WEAPON = "toggle_weapon"  # клавиша W
+CMD_CLICK = "click"  # клик мышью в точке (x, y)
+CMD_PLACE_BARRIER = "place_barrier"  # сразу поставить баррикаду в (x, y)
+CMD_PLACE_WEAPON = "place_weapon"  # сразу поставить оружие в (x, y)
+
+
+def default_levels(filename=LEVELS_FILE, types=None, game_map=None):
     """
-    Оружие, которое можно установить на поле. Оно стреляет в ближайшего монстра.
+    Стандартный набор уровней игры из файла (каждый раз новые объекты GameLevel).
+    Монстры выходят из точек спавна game_map (по умолчанию — карты из того же файла).
     """
+    game_map = load_map(filename) if game_map is None else game_map
+    return [GameLevel(waves, spawn_points=game_map.spawn_points) for waves in load_waves(filename, types)]
 
-    def __init__(self, x, y):
-        super().__init__()
-        self.image = load_image("weapon.png")
-        self.rect = self.image.get_rect()
-        self.rect.topleft = (x, y)
-        self.fire_delay = 60  # задержка между выстрелами
-        self.fire_timer = 0
 
-    def update(self, monsters_group, bullets_group):
-        # Уменьшаем таймер
-        if self.fire_timer > 0:
-            self.fire_timer -= 1
+class Simulation:
+    """
+    Игровая логика без отрисовки, событий pygame и ограничения FPS.
+    Владеет башней, уровнями и группами спрайтов и продвигается методом step().
+    """
+
+    def __init__(self, levels=None, tower_health=600, start_money=START_MONEY, use_arrays=False,
+                 barrier_cost=BARRIER_COST, weapon_cost=WEAPON_COST, flow_field=False, analytic_bullets=False,
+                 game_map=None):
+        # Карта задаёт размер мира и место башни; точки спавна хранят сами уровни
+        if game_map is None:
+            game_map = load_map() if levels is None else GameMap()
+        self.map = game_map
+        # Уровни берутся из итератора по одному: подходит и список, и генератор
+        # бесконечного режима (endless_levels)
+        levels = levels if levels is not None else default_levels(game_map=game_map)
+        # Список уровней запоминается для снимков состояния; генератор — нет
+        self.level_list = levels if isinstance(levels, (list, tuple)) else None
+        self.level_source = iter(levels)
+        self.current_level = next(self.level_source, None)
+        # Настройки, по которым симуляцию собрал build_simulation() (или None)
+        self.settings = None
+        self.barrier_cost = barrier_cost
+        self.weapon_cost = weapon_cost
+        self.current_level_index = 0
+        # С use_arrays монстры и пули живут в массивах NumPy (EntityStore),
+        # а группа bullets остаётся пустой
+        self.store = EntityStore() if use_arrays else None
+        self.monsters = self.store if use_arrays else MonsterGroup()
+        self.barriers = BarrierGroup()
+        # В режиме массивов таймеры оружия ведёт EntityStore, планировщик не нужен
+        self.weapons = CellGroup() if use_arrays else WeaponGroup()
+        # Сетка по центрам монстров для поиска целей оружием
+        self.monster_index = SpatialHash()
+
+        # Создаём башню
+        self.tower = Tower(game_map.tower_pos, health=tower_health)
+
+        # Пули и монстры переиспользуются через пул группы. С analytic_bullets пули
+        # не летят по тикам, а попадают в заранее рассчитанный тик (ProjectileGroup)
+        if analytic_bullets and use_arrays:
+            raise ValueError("Аналитические снаряды есть только у спрайтов, без use_arrays")
+        self.analytic_bullets = analytic_bullets
+        self.bullets = ProjectileGroup(self.tower, self.barriers) if analytic_bullets else PooledGroup()
+        if analytic_bullets:
+            self.monsters.on_state_change = self.bullets.target_changed
+
+        # С flow_field монстры обходят баррикады по общему полю направлений к башне
+        self.flow_field = None
+        if flow_field:
+            self.flow_field = FlowFields(self.tower.rect, *game_map.size)
+            self.barriers.attach_flow_field(self.flow_field)
+
+        # Счёт игрока
+        self.score = 0
+        self.money = start_money
+
+        # Режимы размещения (переключаются клавишами B и W)
+        self.placing_barrier = False
+        self.placing_weapon = False
+
+        self.tick_count = 0
+        self.running = True
+        # Команды, которые будут применены в начале следующего тика
+        self.pending_commands = []
+        # FrameProfiler: если задан, tick() отмечает время своих фаз
+        self.profiler = None
+        # InputLog: если задан, в него пишется каждая применённая команда
+        self.recorder = None
+
+    @property
+    def won(self):
+        """
+        Башня жива, и все уровни пройдены.
+        """
+        return self.tower.health > 0 and self.current_level is None
+
+    def submit(self, kind, x=0, y=0):
+        """
+        Поставить команду в очередь на следующий тик.
+        """
+        self.pending_commands.append((kind, x, y))
+
+    def apply_command(self, kind, x=0, y=0):
+        """
+        Выполнить одну команду игрока немедленно.
+        """
+        if kind == CMD_TOGGLE_BARRIER:
+            # Начинаем/отменяем размещение баррикады
+            self.placing_barrier = not self.placing_barrier
+            self.placing_weapon = False
+        elif kind == CMD_TOGGLE_WEAPON:
+            # Начинаем/отменяем размещение оружия
+            self.placing_weapon = not self.placing_weapon
+            self.placing_barrier = False
+        elif kind == CMD_CLICK:
+            # Размещаем баррикаду/оружие, если выбран соответствующий режим (B или W)
+            if self.placing_barrier:
+                self.place_barrier(x, y)
+            elif self.placing_weapon:
+                self.place_weapon(x, y)
+        elif kind == CMD_PLACE_BARRIER:
+            self.place_barrier(x, y)
+        elif kind == CMD_PLACE_WEAPON:
+            self.place_weapon(x, y)
         else:
-            # Найдём ближайшего монстра, чтобы выстрелить
-            target = None
-            min_dist = 999999
-            for monster in monsters_group:
-                dist = (monster.rect.centerx - self.rect.centerx) ** 2 + (monster.rect.centery - self.rect.centery) ** 2
-                if dist < min_dist:
-                    min_dist = dist
-                    target = monster
-            # Если нашли монстра в зоне поражения (условно не ограничиваем радиус)
-            if target:
-                # Стреляем
-                bullet = Bullet(self.rect.centerx, self.rect.centery, target)
-                bullets_group.add(bullet)
-                self.fire_timer = self.fire_delay
+            raise ValueError(f"Неизвестная команда: {kind}")
+
+    def place_barrier(self, x, y):
+        """
+        Поставить баррикаду в ячейку сетки, содержащую точку (x, y).
+        Возвращает True, если хватило денег.
+        """
+        if self.money < self.barrier_cost:
+            return False
+        # Привязка к "сетке"
+        x = (x // CELL_SIZE) * CELL_SIZE
+        y = (y // CELL_SIZE) * CELL_SIZE
+        self.barriers.add(Barrier(x, y))
+        self.money -= self.barrier_cost
+        return True
+
+    def place_weapon(self, x, y):
+        """
+        Поставить оружие в ячейку сетки, содержащую точку (x, y).
+        Возвращает True, если хватило денег.
+        """
+        if self.money < self.weapon_cost:
+            return False
+        x = (x // CELL_SIZE) * CELL_SIZE
+        y = (y // CELL_SIZE) * CELL_SIZE
+        self.weapons.add(Weapon(x, y))
+        self.money -= self.weapon_cost
+        return True
+
+    def tick(self):
+        """
+        Один игровой тик. Возвращает False, когда игра закончилась.
+        """
+        if not self.running:
+            return False
+        if self.current_level is None:
+            # Все уровни пройдены
+            self.running = False
+            return False
+
+        current_level = self.current_level
+        prof = self.profiler
+
+        # Команды игрока
+        commands, self.pending_commands = self.pending_commands, []
+        for kind, x, y in commands:
+            if self.recorder is not None:
+                self.recorder.record(self.tick_count, kind, x, y)
+            self.apply_command(kind, x, y)
+        if prof is not None:
+            prof.lap("commands")
+
+        # Обновляем уровень (спавн монстров)
+        current_level.update(self.monsters)
+        if prof is not None:
+            prof.lap("level")
+
+        # Баррикады, поставленные и разрушенные за прошлый тик, учитываются в поле
+        # направлений один раз: весь тик монстры читают одну и ту же карту
+        if self.flow_field is not None:
+            self.flow_field.repair()
+            if prof is not None:
+                prof.lap("flow")
+
+        # Обновляем спрайты
+        if self.store is not None:
+            self.store.update(self.tower, self.barriers, self.weapons)
+            if prof is not None:
+                prof.lap("entities")
+        else:
+            self.monsters.update(self.tower, self.barriers)
+            if prof is not None:
+                prof.lap("monsters")
+            # Индекс нужен, только если какое-то оружие готово стрелять
+            if self.weapons and self.weapons.has_ready():
+                self.monster_index.rebuild(self.monsters)
+                if prof is not None:
+                    prof.lap("index")
+            self.weapons.update(self.monsters, self.bullets, self.monster_index)
+            if prof is not None:
+                prof.lap("weapons")
+            self.bullets.update()
+            if prof is not None:
+                prof.lap("bullets")
+        self.tick_count += 1
+
+        # Проверяем здоровье башни
+        if self.tower.health <= 0:
+            # Проиграли
+            self.running = False
+            return False
+
+        # Если все волны уровня прошли и в группе монстров никого не осталось,
+        # переходим к следующему уровню
+        self.money += 0.01
+        if current_level.done and len(self.monsters) == 0:
+            self.current_level_index += 1
+            self.current_level = next(self.level_source, None)
+            # Пополним деньги игрока за пройденный уровень
+            self.money += 80
+            # Добавим очков
+            self.score += 1
+        return True
+
+    def step(self, n_ticks=1):
+        """
+        Продвинуть симуляцию на n_ticks тиков (или меньше, если игра закончилась).
+        Возвращает число выполненных тиков.
+        """
+        done = 0
+        while done < n_ticks and self.tick():
+            done += 1
+        return done
+
+    def run(self, max_ticks=None, commands=None):
+        """
+        Прогнать игру до конца (или до max_ticks тиков).
+        commands: словарь {тик: [(вид, x, y), ...]} — заранее записанные действия игрока.
+        """
+        while self.running and (max_ticks is None or self.tick_count < max_ticks):
+            if commands:
+                for command in commands.get(self.tick_count, ()):
+                    self.submit(*command)
+            self.tick()
+        return self
 
 
 # -----------------------------------------------------------------------------------
-# ------------------------ КЛАСС ПУЛИ -----------------------------------------------
+# ------------------------ УЧЁТ ПАМЯТИ -----------------------------------------------
 # -----------------------------------------------------------------------------------
-class Bullet(pygame.sprite.Sprite):
+# Значения полей, которые принадлежат самому спрайту; остальные поля — ссылки
+# на общие объекты (вид монстра, цель пули, группа) или маленькие целые из кэша Python
+OWNED_FIELD_TYPES = (pygame.Rect, tuple, list, set, dict, float)
+
+
+def entity_bytes(sprite):
     """
-    Пуля, летит к выбранному монстру, нанося ему урон при попадании.
+    Сколько байт занимает спрайт: сам объект и собственные значения его
+    слотов (Rect, кортежи, множество групп). Общие данные не считаются.
     """
+    size = sys.getsizeof(sprite)
+    seen = set()
+    for cls in type(sprite).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            value = getattr(sprite, name, None)
+            if isinstance(value, OWNED_FIELD_TYPES) and id(value) not in seen:
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+    return size
 
-    def __init__(self, x, y, target, speed=5, damage=10):
-        super().__init__()
-        self.image = load_image("bullet.png")
-        self.rect = self.image.get_rect(center=(x, y))
-        self.target = target
-        self.speed = speed
-        self.damage = damage
 
-    def update(self):
-        if not self.target.alive() or self.target.state == "dead":
-            # Если цель уже мертва, удаляем пулю
-            self.kill()
-            return
+def memory_report(sim):
+    """
+    Память объектов симуляции по видам: {вид: {"count", "bytes", "per_entity"}}
+    и сумма в "total". Спрайту достаётся entity_bytes() и доля словаря его
+    группы; свободные объекты пулов идут строками «пул: ...», массивы
+    EntityStore — строкой «EntityStore», картинки и атласы — строкой «картинки».
+    """
+    report = {}
 
-        # Движемся к цели
-        dx = self.target.rect.centerx - self.rect.centerx
-        dy = self.target.rect.centery - self.rect.centery
-        dist = (dx ** 2 + dy ** 2) ** 0.5
+    def account(kind, count, size):
+        row = report.setdefault(kind, {"count": 0, "bytes": 0})
+        row["count"] += count
+        row["bytes"] += size
 
-        if dist < self.speed:
-            # Считаем, что попали
-            self.target.take_damage(self.damage)
-            self.kill()
-        else:
-            # Двигаемся по направлению к цели
-            self.rect.x += self.speed * dx / dist
-            self.rect.y += self.speed * dy / dist
+    groups = [sim.barriers, sim.weapons]
+    if sim.store is None:
+        groups += [sim.monsters, sim.bullets]
+    for group in groups:
+        sprites = group.sprites()
+        share = sys.getsizeof(group.spritedict) / len(sprites) if sprites else 0
+        for sprite in sprites:
+            account(type(sprite).__name__, 1, entity_bytes(sprite) + share)
+        for cls, free in getattr(group, "free", {}).items():
+            if free:
+                account(f"пул: {cls.__name__}", len(free),
+                        sys.getsizeof(free) + sum(entity_bytes(sprite) for sprite in free))
+
+    if sim.store is not None:
+        arrays = [value for value in vars(sim.store).values() if isinstance(value, np.ndarray)]
+        account("EntityStore", len(sim.store) + sim.store.bullet_count, sum(a.nbytes for a in arrays))
+
+    # Пиксели кадров монстров общие с листом атласа, поэтому считаются только листы
+    surfaces = list(_image_cache.values()) + [atlas.sheet for atlas in _atlas_cache.values()]
+    account("картинки", len(surfaces), sum(s.get_pitch() * s.get_height() for s in surfaces))
+
+    report["total"] = {"count": sum(row["count"] for row in report.values()),
+                       "bytes": sum(row["bytes"] for row in report.values())}
+    for row in report.values():
+        row["bytes"] = int(row["bytes"])
+        row["per_entity"] = row["bytes"] / row["count"] if row["count"] else 0.0
+    return report
+
+
+def format_memory_report(report):
+    """
+    Отчёт memory_report() в виде строк таблицы.
+    """
+    lines = [f"{'вид':>16} {'штук':>8} {'байт':>12} {'на объект':>10}"]
+    for kind, row in report.items():
+        lines.append(f"{kind:>16} {row['count']:>8} {row['bytes']:>12} {row['per_entity']:>10.1f}")
+    return lines
 
 
 # -----------------------------------------------------------------------------------
-# ------------------------ КЛАСС УРОВНЯ (WAVES) --------------------------------------
+# ------------------------ ЖУРНАЛ ВВОДА И ПОВТОР ИГРЫ --------------------------------
 # -----------------------------------------------------------------------------------
-class GameLevel:
+# Формат журнала: сигнатура, длина и JSON с настройками сессии, затем записи
+# команд «varint(тиков с прошлой команды), код, [varint(столбец), varint(строка)]»
+# и в конце, если игра завершилась штатно, итог: 0xFF, тики, здоровье башни, счёт
+INPUT_LOG_MAGIC = b"TDLOG\x01"
+INPUT_LOG_END = 0xFF
+COMMAND_CODES = {CMD_TOGGLE_BARRIER: 1, CMD_TOGGLE_WEAPON: 2, CMD_CLICK: 3,
+                 CMD_PLACE_BARRIER: 4, CMD_PLACE_WEAPON: 5}
+CODE_COMMANDS = {code: kind for kind, code in COMMAND_CODES.items()}
+POSITIONAL_COMMANDS = (CMD_CLICK, CMD_PLACE_BARRIER, CMD_PLACE_WEAPON)
+
+
+def session_settings(levels_file=LEVELS_FILE, endless_seed=None, use_arrays=False, flow_field=False,
+                     **sim_kwargs):
     """
-    Класс описывает один уровень (его волны монстров и др.).
+    Настройки сессии, по которым build_simulation() соберёт такую же симуляцию.
+    Волны уровней сохраняются целиком, чтобы повтор не зависел от того,
+    как с тех пор поменялся файл уровней.
     """
+    settings = {"use_arrays": use_arrays, "flow_field": flow_field, "sim": sim_kwargs,
+                "map": load_map(levels_file).to_settings()}
+    if endless_seed is not None:
+        settings["endless_seed"] = endless_seed
+    else:
+        settings["waves"] = [[[cls.__name__, count, delay] for cls, count, delay in waves]
+                             for waves in load_waves(levels_file)]
+    return settings
 
-    def __init__(self, waves):
-        """
-        waves: список кортежей (monster_class, количество, задержка_между_монстрами)
-        Например:
-        [(Goblin, 5, 60), (Orc, 2, 120)]
-        """
-        self.waves = waves
-        self.current_wave_index = 0
-        self.monsters_to_spawn = self.waves[self.current_wave_index][1]  # сколько монстров осталось выпустить
-        self.spawn_delay = self.waves[self.current_wave_index][2]
-        self.spawn_timer = 0
-        self.monster_class = self.waves[self.current_wave_index][0]
-        self.done = False  # флаг завершения уровня
 
-    def update(self, monsters_group):
+def build_simulation(settings):
+    if "snapshot" in settings:
+        # Сессия продолжена из снимка состояния
+        return restore_snapshot(base64.b64decode(settings["snapshot"]))
+    game_map = GameMap.from_settings(settings.get("map"))
+    if "endless_seed" in settings:
+        levels = endless_levels(settings["endless_seed"], spawn_points=game_map.spawn_points)
+    else:
+        levels = [GameLevel([(MONSTER_TYPES[name], count, delay) for name, count, delay in waves],
+                            spawn_points=game_map.spawn_points)
+                  for waves in settings["waves"]]
+    sim = Simulation(levels=levels, use_arrays=settings.get("use_arrays", False),
+                     flow_field=settings.get("flow_field", False), game_map=game_map, **settings.get("sim", {}))
+    sim.settings = settings
+    return sim
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class InputLog:
+    """
+    Запись команд игрока с номерами тиков в компактный двоичный журнал.
+    Команды пишутся в файл по мере игры (обычно 2–4 байта на команду),
+    так что журнал переживает и аварийное завершение. Итог дописывается,
+    только если игра доиграна до конца.
+    """
+
+    def __init__(self, filename, settings):
+        self.filename = filename
+        header = json.dumps(settings, ensure_ascii=False).encode("utf-8")
+        out = bytearray(INPUT_LOG_MAGIC)
+        write_varint(out, len(header))
+        out += header
+        self.file = open(filename, "wb")
+        try:
+            self.file.write(out)
+        except BaseException:
+            self.file.close()
+            raise
+        self.last_tick = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, tick, kind, x=0, y=0):
+        out = bytearray()
+        write_varint(out, tick - self.last_tick)
+        out.append(COMMAND_CODES[kind])
+        if kind in POSITIONAL_COMMANDS:
+            # Клик важен только с точностью до ячейки сетки
+            write_varint(out, x // CELL_SIZE)
+            write_varint(out, y // CELL_SIZE)
+        self.file.write(out)
+        self.last_tick = tick
+
+    def close(self, sim=None):
         """
-        Запуск волны монстров с заданной периодичностью.
+        Закрыть журнал; если передана законченная симуляция, дописать итог для проверки повтора.
         """
-        if self.done:
+        if self.file.closed:
             return
+        if sim is not None and not sim.running:
+            out = bytearray([INPUT_LOG_END])
+            for value in (sim.tick_count, max(sim.tower.health, 0), sim.score):
+                write_varint(out, value)
+            self.file.write(out)
+        self.file.close()
 
-        if self.spawn_timer > 0:
-            self.spawn_timer -= 1
-        else:
-            # Спавним монстра
-            x_spawn, y_spawn = 50, 50  # место спавна (можно менять/рандомизировать)
-            monster = self.monster_class(x_spawn, y_spawn)
-            monsters_group.add(monster)
-            self.monsters_to_spawn -= 1
-            self.spawn_timer = self.spawn_delay
-
-            # Если в текущей волне все монстры выпущены
-            if self.monsters_to_spawn <= 0:
-                # Переходим к следующей волне
-                self.current_wave_index += 1
-                if self.current_wave_index >= len(self.waves):
-                    # Все волны закончились
-                    self.done = True
-                else:
-                    self.monsters_to_spawn = self.waves[self.current_wave_index][1]
-                    self.spawn_delay = self.waves[self.current_wave_index][2]
-                    self.spawn_timer = 0
-                    self.monster_class = self.waves[self.current_wave_index][0]
+
+def read_input_log(filename):
+    """
+    Прочитать журнал. Возвращает (настройки, {тик: [(вид, x, y), ...]}, итог),
+    где итог — (тики, здоровье башни, счёт) или None, если игра не дописала его.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if not data.startswith(INPUT_LOG_MAGIC):
+        raise ValueError(f"{filename}: это не журнал ввода")
+    size, pos = read_varint(data, len(INPUT_LOG_MAGIC))
+    settings = json.loads(data[pos:pos + size].decode("utf-8"))
+    pos += size
+    commands = {}
+    tick = 0
+    final = None
+    while pos < len(data):
+        if data[pos] == INPUT_LOG_END:
+            final = []
+            pos += 1
+            for _ in range(3):
+                value, pos = read_varint(data, pos)
+                final.append(value)
+            final = tuple(final)
+            break
+        delta, pos = read_varint(data, pos)
+        tick += delta
+        kind = CODE_COMMANDS[data[pos]]
+        pos += 1
+        x = y = 0
+        if kind in POSITIONAL_COMMANDS:
+            cx, pos = read_varint(data, pos)
+            cy, pos = read_varint(data, pos)
+            x, y = cx * CELL_SIZE, cy * CELL_SIZE
+        commands.setdefault(tick, []).append((kind, x, y))
+    return settings, commands, final
+
+
+def replay_headless(filename):
+    """
+    Повторить записанную сессию без окна с максимальной скоростью.
+    Возвращает (симуляция, итог из журнала или None).
+    """
+    settings, commands, final = read_input_log(filename)
+    sim = build_simulation(settings)
+    sim.run(max_ticks=final[0] if final else None, commands=commands)
+    return sim, final
+
+
+# -----------------------------------------------------------------------------------
+# ------------------------ СНИМКИ СОСТОЯНИЯ ИГРЫ -------------------------------------
+# -----------------------------------------------------------------------------------
+# Снимок — сжатый zlib JSON. Объекты ссылаются друг на друга по номерам в снимке:
+# баррикады, оружие, монстры и пули идут в порядке своих групп (у монстров — в
+# порядке появления), поэтому после восстановления порядок и номера сохраняются.
+# Цель монстра: номер баррикады, TARGET_TOWER или TARGET_NONE; цель пули — номер монстра.
+# Вместо кадра анимации у монстра хранится его возраст по часам анимации группы.
+SNAPSHOT_MAGIC = b"TDSNAP\x02"
+
+
+def take_snapshot(sim):
+    """
+    Сохранить всё состояние симуляции в байты.
+    """
+    if sim.settings is not None:
+        settings = dict(sim.settings)
+    elif sim.level_list is not None:
+        settings = {"waves": [[[cls.__name__, count, delay] for cls, count, delay in level.waves]
+                              for level in sim.level_list]}
+    else:
+        raise ValueError("Уровни заданы произвольным итератором — их нельзя сохранить в снимок")
+    settings["use_arrays"] = sim.store is not None
+    settings["flow_field"] = sim.flow_field is not None
+    settings["map"] = sim.map.to_settings()
+    settings["sim"] = {"barrier_cost": sim.barrier_cost, "weapon_cost": sim.weapon_cost,
+                       "analytic_bullets": sim.analytic_bullets}
+
+    level = sim.current_level
+    barriers = list(sim.barriers)
+    barrier_ids = {barrier: i for i, barrier in enumerate(barriers)}
+    if sim.store is not None:
+        monsters, bullets, timers = sim.store.snapshot_rows(barrier_ids)
+    else:
+        monster_ids = {}
+        monsters = []
+        for monster in sim.monsters:
+            if monster.target is None:
+                target = TARGET_NONE
+            elif monster.target is sim.tower:
+                target = TARGET_TOWER
+            else:
+                target = barrier_ids.get(monster.target, TARGET_NONE)
+            monster_ids[monster] = len(monsters)
+            monsters.append([type(monster).__name__, monster.rect.x, monster.rect.y, sim.monsters.age(monster),
+                             monster.speed, monster.damage, monster.health, monster.attack_delay,
+                             sim.monsters.attack_timer(monster),
+                             MONSTER_ATTACK if monster.state == MONSTER_ATTACK else MONSTER_MOVE, target])
+        bullets = []
+        for bullet in sim.bullets:
+            # Пуля к убитому монстру (или к его переиспользованному пулом объекту) не сохраняется
+            if bullet.target not in monster_ids or bullet.target.generation != bullet.target_generation:
+                continue
+            row = [bullet.rect.x, bullet.rect.y, monster_ids[bullet.target], bullet.speed, bullet.damage]
+            if sim.analytic_bullets:
+                # Аналитическая пуля: точки вылета и встречи, сколько тиков летит и сколько осталось
+                group = sim.bullets
+                row[:2] = bullet.image.get_rect(center=group.position(bullet, group.tick - 1)).topleft
+                row += [*bullet.origin, *bullet.aim, group.tick - bullet.fire_tick,
+                        bullet.hit_tick - group.tick, bullet.resolved]
+            bullets.append(row)
+        timers = {weapon: sim.weapons.fire_timer(weapon) for weapon in sim.weapons}
+
+    state = {
+        "settings": settings,
+        "level_index": sim.current_level_index,
+        "level": None if level is None else [level.spawn_index, level.tick, level.done],
+        "tick_count": sim.tick_count,
+        "running": sim.running,
+        "money": sim.money,
+        "score": sim.score,
+        "tower_health": sim.tower.health,
+        "placing": [sim.placing_barrier, sim.placing_weapon],
+        "pending": sim.pending_commands,
+        "barriers": [[b.rect.x, b.rect.y, b.health] for b in barriers],
+        "weapons": [[w.rect.x, w.rect.y, timers.get(w, w.fire_timer), w.fire_delay, w.fire_range]
+                    for w in sim.weapons],
+        "monsters": monsters,
+        "bullets": bullets,
+    }
+    return SNAPSHOT_MAGIC + zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def restore_snapshot(data, use_arrays=None):
+    """
+    Собрать симуляцию из снимка. use_arrays позволяет продолжить игру
+    в другом режиме хранения (None — как при сохранении).
+    """
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("Это не снимок состояния игры")
+    state = json.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC):]).decode("utf-8"))
+    settings = state["settings"]
+    if use_arrays is not None:
+        settings = dict(settings, use_arrays=use_arrays)
+    sim = build_simulation(settings)
+
+    # Пропускаем пройденные уровни и ставим курсор текущего
+    for _ in range(state["level_index"]):
+        sim.current_level = next(sim.level_source, None)
+    sim.current_level_index = state["level_index"]
+    if sim.current_level is not None:
+        sim.current_level.spawn_index, sim.current_level.tick, sim.current_level.done = state["level"]
+
+    sim.tick_count = state["tick_count"]
+    sim.running = state["running"]
+    sim.money = state["money"]
+    sim.score = state["score"]
+    sim.tower.health = state["tower_health"]
+    sim.placing_barrier, sim.placing_weapon = state["placing"]
+    sim.pending_commands = [tuple(command) for command in state["pending"]]
+
+    barriers = []
+    for x, y, health in state["barriers"]:
+        barriers.append(Barrier(x, y, health))
+    sim.barriers.add(*barriers)
+    for x, y, timer, delay, fire_range in state["weapons"]:
+        weapon = Weapon(x, y, fire_range)
+        weapon.fire_timer = timer
+        weapon.fire_delay = delay
+        sim.weapons.add(weapon)
+    if sim.flow_field is not None:
+        sim.flow_field.repair()
+
+    monsters = []
+    ages = []
+    for name, x, y, age, speed, damage, health, delay, timer, state_code, target in state["monsters"]:
+        monster = MONSTER_TYPES[name](x, y)
+        ages.append(age)
+        monster.speed = speed
+        monster.damage = damage
+        monster.health = health
+        monster.attack_delay = delay
+        monster.attack_timer = timer
+        monster.state = MONSTER_ATTACK if state_code == MONSTER_ATTACK else MONSTER_MOVE
+        if target == TARGET_TOWER:
+            monster.target = sim.tower
+        elif target >= 0:
+            monster.target = barriers[target]
+        monsters.append(monster)
+
+    if sim.store is not None:
+        sim.store._sync_barriers(sim.barriers)
+        slots = sim.store.add(*monsters)
+        # Группа ставит фазу по своим часам; сдвигаем её на сохранённый возраст
+        sim.store.m_phase[slots] -= ages
+        sim.store.add_bullets([(x, y) for x, y, _, _, _ in state["bullets"]],
+                              [slots[target] for _, _, target, _, _ in state["bullets"]])
+    else:
+        sim.monsters.add(*monsters)
+        for monster, age in zip(monsters, ages):
+            monster.phase -= age
+        for x, y, target, speed, damage, *flight in state["bullets"]:
+            bullet = Bullet(0, 0, monsters[target], speed, damage)
+            bullet.rect.topleft = (x, y)
+            sim.bullets.add(bullet)
+            if flight:
+                ox, oy, ax, ay, elapsed, remaining, resolved = flight
+                sim.bullets.restore(bullet, (ox, oy), (ax, ay), elapsed, remaining, resolved)
+    return sim
+
+
+def save_snapshot(sim, filename):
+    """
+    Записать снимок в файл атомарно: при сбое во время записи остаётся прежний файл.
+    """
+    data = take_snapshot(sim)
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+def load_snapshot(filename, use_arrays=None):
+    with open(filename, "rb") as f:
+        return restore_snapshot(f.read(), use_arrays)
 
 
 # -----------------------------------------------------------------------------------
@@ -459,203 +4039,427 @@ class TowerDefenceGame:
     - финального экрана
     """
 
-    def __init__(self, screen):
+    def __init__(self, screen, use_arrays=False, dirty_rendering=False, profile_path=None, flow_field=False,
+                 levels=None, sim=None, input_log=None, replay=None, replay_ticks=None,
+                 checkpoint_path=None, checkpoint_every=500, render_fps=FPS, max_catchup=5, max_frame_skip=4,
+                 assets=None):
         self.screen = screen
         self.clock = pygame.time.Clock()
-        self.running = True
+        # AssetLoader: изображения догружаются в фоне, пока открыт стартовый экран
+        self.assets = assets
 
         # Загружаем «тайл» земли (424x119).
         self.ground_tile = load_image("grounds.png")
 
-        # Инициализируем таблицу рекордов
-        self.score_table = ScoreTable()
+        # Таблица рекордов открывается при первом обращении (см. score_table):
+        # схема и импорт старого results.csv не задерживают первый кадр
+        self._score_table = None
 
-        # Игровые переменные
-        self.levels = [
-            GameLevel([(Goblin, 5, 60), (Orc, 2, 120)]),
-            GameLevel([(Goblin, 10, 30), (Orc, 3, 90)]),
-            GameLevel([(Goblin, 5, 100), (Golem, 1, 50)])
-        ]
-        self.current_level_index = 0
-        self.monsters = pygame.sprite.Group()
-        self.barriers = pygame.sprite.Group()
-        self.weapons = pygame.sprite.Group()
-        self.bullets = pygame.sprite.Group()
+        # Вся игровая логика живёт в симуляции, игра только рисует и передаёт ввод
+        if sim is None:
+            sim = Simulation(levels=levels, use_arrays=use_arrays, flow_field=flow_field)
+        self.sim = sim
 
-        # Создаём башню (со здоровьем 320)
-        self.tower = Tower(TOWER_POS, health=600)
+        # Журнал ввода (InputLog) для записи сессии или команды для её повтора:
+        # при повторе команды берутся из журнала, а клики и клавиши B/W игнорируются
+        self.input_log = input_log
+        self.sim.recorder = input_log
+        self.replay = replay
+        self.replay_ticks = replay_ticks
 
-        # Счёт игрока
-        self.score = 0
-        self.money = START_MONEY
+        # Периодический снимок состояния на случай сбоя (см. save_snapshot)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
 
-        # Шрифты
-        self.font_small = pygame.font.SysFont("arial", 20)
-        self.font_big = pygame.font.SysFont("arial", 50)
+        # Логика идёт фиксированными тиками по 1/FPS секунды независимо от отрисовки:
+        # render_fps ограничивает частоту кадров (0 — без ограничения), max_catchup —
+        # сколько тиков можно догнать за один кадр, max_frame_skip — сколько кадров
+        # подряд можно не рисовать, пока логика отстаёт
+        self.render_fps = render_fps
+        self.max_catchup = max_catchup
+        self.max_frame_skip = max_frame_skip
+        self.time_source = time.perf_counter
+        self.dropped_ticks = 0  # тики, от которых пришлось отказаться при перегрузке
+
+        # Камера над картой и фон с землёй и башней, собираемый по кускам
+        self.camera = None
+        self.background = None
+        self.reset_view()
+
+        # Режим отрисовки «грязными прямоугольниками»
+        self.dirty_rendering = dirty_rendering
+        self.static_layer = None  # фон + баррикады + оружие
+        self._static_key = None
+        self._dynamic_rects = []  # где были монстры и пули в прошлом кадре
+        self._hud_state = {}  # номер строки -> (текст, прямоугольник)
+        self.dirty_fallbacks = 0  # сколько кадров ушло на экран целиком из-за толпы
+
+        # Шрифты (общие для всей игры)
+        self.font_small = get_font(20)
+        self.font_big = get_font(50)
+        # Кэш строк интерфейса: текст перерисовывается только при изменении значения
+        self.hud_labels = [TextLabel(self.font_small, WHITE) for _ in self.hud_lines()]
 
         # Имя игрока (для записи в CSV)
         self.player_name = "Player"
 
-        # Флаги
-        self.placing_barrier = False
-        self.placing_weapon = False
+        # Замер фаз кадра: оверлей переключается клавишей F3,
+        # а при заданном profile_path сводка пишется в файл по выходу из игры
+        self.profiler = FrameProfiler()
+        self.sim.profiler = self.profiler
+        self.profile_path = profile_path
+        self.show_profiler = False
+        self._overlay_rect = None
+        # StartupReport: если задан, после первого кадра печатается время этапов запуска
+        self.startup = None
 
     def start_screen(self):
         """
         Функция отображения стартового экрана и ожидания нажатия "Старт".
+        Экран перерисовывается только после событий, а между ними цикл
+        спит в pygame.event.wait() и не тратит процессор.
         """
         start_button = Button((WIDTH // 2 - 100, HEIGHT // 2 - 25, 200, 50), "Начать игру")
         name_input_active = False
         input_box = pygame.Rect(WIDTH // 2 - 100, HEIGHT // 2 - 100, 200, 30)
+        name_label = TextLabel(self.font_small, BLACK)
+        info_label = TextLabel(self.font_small, BLACK, "Введите имя:")
+        assets = self.assets
+        progress_box = pygame.Rect(WIDTH // 2 - 100, HEIGHT // 2 + 45, 200, 10)
+        progress_label = TextLabel(self.font_small, BLACK)
 
+        need_redraw = True
         while True:
-            self.clock.tick(FPS)
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    if start_button.is_clicked(event.pos):
-                        return  # Выходим, чтобы начать игру
-                    if input_box.collidepoint(event.pos):
-                        name_input_active = True
-                    else:
-                        name_input_active = False
-                elif event.type == pygame.KEYDOWN:
-                    if name_input_active:
-                        if event.key == pygame.K_BACKSPACE:
-                            self.player_name = self.player_name[:-1]
-                        else:
-                            # Ограничим длину имени
-                            if len(self.player_name) < 10:
-                                self.player_name += event.unicode
-
-            # Рисуем на экране
-            self.screen.fill(GRAY)
-            # Текст с именем
-            pygame.draw.rect(self.screen, WHITE, input_box)
-            name_surface = self.font_small.render(self.player_name, True, BLACK)
-            self.screen.blit(name_surface, (input_box.x + 5, input_box.y + 5))
-
-            # Кнопка
-            start_button.draw(self.screen)
-
-            text_info = self.font_small.render("Введите имя:", True, BLACK)
-            self.screen.blit(text_info, (input_box.x, input_box.y - 25))
+            if need_redraw:
+                # Рисуем на экране
+                self.screen.fill(GRAY)
+                # Текст с именем
+                pygame.draw.rect(self.screen, WHITE, input_box)
+                name_label.draw(self.screen, self.player_name, (input_box.x + 5, input_box.y + 5))
 
-            pygame.display.flip()
+                # Кнопка
+                start_button.draw(self.screen)
+
+                self.screen.blit(info_label.surface, (input_box.x, input_box.y - 25))
+
+                # Полоса загрузки ресурсов (исчезает, когда всё загружено)
+                if assets is not None and not assets.done:
+                    filled = progress_box.copy()
+                    filled.width = int(progress_box.width * assets.progress)
+                    pygame.draw.rect(self.screen, GREEN, filled)
+                    pygame.draw.rect(self.screen, WHITE, progress_box, 1)
+                    progress_label.draw(self.screen, f"Загрузка ресурсов: {assets.loaded}/{assets.total}",
+                                        (progress_box.x, progress_box.bottom + 5))
+
+                pygame.display.flip()
+                if self.startup is not None:
+                    self.startup.mark("первый кадр")
+                    print("запуск:")
+                    print("\n".join(self.startup.lines()))
+                    self.startup = None
+                need_redraw = False
+
+            if assets is not None and not assets.done:
+                # Пока идёт загрузка, событие ждём недолго и между ожиданиями
+                # готовим уже декодированные картинки
+                event = pygame.event.wait(20)
+                if assets.pump():
+                    need_redraw = True
+                if event.type == pygame.NOEVENT:
+                    continue
+            else:
+                event = pygame.event.wait()
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if start_button.is_clicked(event.pos):
+                    return  # Выходим, чтобы начать игру
+                if input_box.collidepoint(event.pos):
+                    name_input_active = True
+                else:
+                    name_input_active = False
+            elif event.type == pygame.KEYDOWN:
+                if name_input_active:
+                    if event.key == pygame.K_BACKSPACE:
+                        self.player_name = self.player_name[:-1]
+                    else:
+                        # Ограничим длину имени
+                        if len(self.player_name) < 10:
+                            self.player_name += event.unicode
+                    need_redraw = True
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE, pygame.VIDEORESIZE):
+                need_redraw = True
 
     def game_loop(self):
         """
         Основной игровой цикл: здесь происходит отыгрывание уровней,
         спавн монстров, размещение баррикад и оружия и т.д.
         """
-        while self.running:
-            self.clock.tick(FPS)
-            if self.current_level_index >= len(self.levels):
-                # Все уровни пройдены
-                self.running = False
-                break
+        sim = self.sim
+        prof = self.profiler
+        replaying = self.replay is not None
+        tick_seconds = 1 / FPS
+        accumulator = 0.0
+        skipped = 0
+        self.prepare_assets()
+        # Всё нужное уже в памяти: до конца игры изображения с диска не читаются
+        freeze_image_cache()
+        previous = self.time_source()
+        try:
+            while sim.running:
+                self.clock.tick(self.render_fps)
+                now = self.time_source()
+                frame_time = now - previous
+                accumulator += frame_time
+                previous = now
+                prof.begin()
 
-            current_level = self.levels[self.current_level_index]
+                # Обработка событий
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        pygame.quit()
+                        sys.exit()
+                    elif event.type == pygame.KEYDOWN:
+                        if event.key == pygame.K_F3:
+                            self.show_profiler = not self.show_profiler
+                        elif replaying:
+                            continue
+                        elif event.key == pygame.K_b:
+                            sim.submit(CMD_TOGGLE_BARRIER)
+                        elif event.key == pygame.K_w:
+                            sim.submit(CMD_TOGGLE_WEAPON)
+                    elif event.type == pygame.MOUSEBUTTONDOWN and not replaying:
+                        # Клик в окне -> точка на карте
+                        sim.submit(CMD_CLICK, *self.camera.to_world(event.pos))
+                self.scroll_camera(frame_time)
+                prof.lap("events")
 
-            # Обработка событий
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_b:
-                        # Начинаем/отменяем размещение баррикады
-                        self.placing_barrier = not self.placing_barrier
-                        self.placing_weapon = False
-                    elif event.key == pygame.K_w:
-                        # Начинаем/отменяем размещение оружия
-                        self.placing_weapon = not self.placing_weapon
-                        self.placing_barrier = False
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    # Размещаем баррикаду/оружие, если нажата соответствующая «кнопка» (B или W)
-                    if self.placing_barrier and self.money >= BARRIER_COST:
-                        x, y = event.pos
-                        # Привязка к "сетке" (можно убрать, если не нужно)
-                        x = (x // CELL_SIZE) * CELL_SIZE
-                        y = (y // CELL_SIZE) * CELL_SIZE
-                        barrier = Barrier(x, y)
-                        self.barriers.add(barrier)
-                        self.money -= BARRIER_COST
-                    elif self.placing_weapon and self.money >= WEAPON_COST:
-                        x, y = event.pos
-                        x = (x // CELL_SIZE) * CELL_SIZE
-                        y = (y // CELL_SIZE) * CELL_SIZE
-                        weapon = Weapon(x, y)
-                        self.weapons.add(weapon)
-                        self.money -= WEAPON_COST
-
-            # Обновляем уровень (спавн монстров)
-            current_level.update(self.monsters)
-
-            # Обновляем спрайты
-            self.monsters.update(self.tower, self.barriers)
-            self.weapons.update(self.monsters, self.bullets)
-            self.bullets.update()
+                # Столько тиков логики, сколько прошло реального времени (но не больше max_catchup)
+                ticks = 0
+                while accumulator >= tick_seconds and ticks < self.max_catchup:
+                    if replaying:
+                        if self.replay_ticks is not None and sim.tick_count >= self.replay_ticks:
+                            return
+                        for command in self.replay.get(sim.tick_count, ()):
+                            sim.submit(*command)
+                    if not sim.tick():
+                        return
+                    accumulator -= tick_seconds
+                    ticks += 1
+                    if self.checkpoint_path and sim.tick_count % self.checkpoint_every == 0:
+                        save_snapshot(sim, self.checkpoint_path)
+                        prof.lap("checkpoint")
 
-            # Проверяем здоровье башни
-            if self.tower.health <= 0:
-                # Проиграли
-                self.running = False
-                break
+                # Отрисовка — не чаще раза за кадр. Пока логика отстаёт, кадры пропускаются
+                # (до max_frame_skip подряд), чтобы всё время ушло на тики
+                behind = accumulator >= tick_seconds
+                if behind and skipped < self.max_frame_skip:
+                    skipped += 1
+                    prof.end()
+                    continue
+                if behind:
+                    # Не успеваем даже без отрисовки: отбрасываем отставание — игра
+                    # замедляется, но не уходит в бесконечную догонялку
+                    self.dropped_ticks += int(accumulator / tick_seconds)
+                    accumulator %= tick_seconds
+                skipped = 0
+                self.draw()
+                prof.lap("draw")
+                prof.end()
+        finally:
+            freeze_image_cache(False)
+            if self.profile_path:
+                self.profiler.dump(self.profile_path)
+            if self.input_log is not None:
+                # Итог пишется, только если игра закончилась (а не прервана выходом из окна)
+                self.input_log.close(sim)
+
+    def scroll_camera(self, seconds):
+        """
+        Прокрутка камеры стрелками (камера не часть симуляции и в журнал не пишется).
+        """
+        keys = pygame.key.get_pressed()
+        dx = keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]
+        dy = keys[pygame.K_DOWN] - keys[pygame.K_UP]
+        if dx or dy:
+            self.camera.scroll(dx * CAMERA_SPEED * seconds, dy * CAMERA_SPEED * seconds)
+
+    def prepare_assets(self):
+        """
+        Догрузить всё, что может понадобиться во время игры: изображения,
+        атласы всех типов монстров и шрифт панели профилировщика (F3),
+        чтобы первый спавн или первое нажатие не вызывали заминку.
+        """
+        if self.assets is not None:
+            self.assets.finish()
+        else:
+            preload_images()
+        for monster_class in MONSTER_TYPES.values():
+            monster_atlas(monster_class)
+        get_font(16)
+
+    def build_background(self):
+        """
+        Статичный фон мира — замощённая земля и башня, — собираемый по кускам
+        по мере того, как они попадают в кадр.
+        """
+        return BackgroundChunks(self.ground_tile, self.sim.map.size, [self.sim.tower])
 
-            # Отрисовка
-            self.draw()
+    def reset_view(self):
+        """
+        Камера (над башней) и фон для текущей карты, например после подмены self.sim.
+        """
+        self.camera = Camera((WIDTH, HEIGHT), self.sim.map.size)
+        self.camera.center_on(self.sim.tower.rect.center)
+        self.background = self.build_background()
+        self._static_key = None
 
-            # Если все волны уровня прошли и в группе монстров никого не осталось,
-            # переходим к следующему уровню
-            self.money += 0.01
-            if current_level.done and len(self.monsters) == 0:
-                self.current_level_index += 1
-                # Пополним деньги игрока за пройденный уровень
-                self.money += 80
-                # Добавим очков
-                self.score += 1
+    def hud_lines(self):
+        """
+        Строки интерфейса и их позиции на экране.
+        """
+        return [
+            # Текстовое поле: здоровье башни
+            (f"Башня HP: {self.sim.tower.health}", (10, 10)),
+            # Деньги
+            (f"Деньги: {int(self.sim.money)}", (10, 30)),
+            # Счёт
+            (f"Счёт: {self.sim.score}", (10, 50)),
+            # Подсказка (если карта больше окна — и про прокрутку)
+            ("B - поставить барьер, W - поставить оружие"
+             + ("" if self.camera.world.size == self.camera.rect.size else ", стрелки - камера"), (10, HEIGHT - 30)),
+        ]
 
     def draw(self):
         """
         Отрисовка игрового поля и всех объектов.
         """
-        # «Замостим» фон плиткой (424x119), чтобы покрыть всё окно 800x600
-        for x in range(0, WIDTH, self.ground_tile.get_width()):
-            for y in range(0, HEIGHT, self.ground_tile.get_height()):
-                self.screen.blit(self.ground_tile, (x, y))
+        if self.dirty_rendering:
+            self.draw_dirty()
+            return
 
-        # Рисуем башню
-        self.screen.blit(self.tower.image, self.tower.rect.topleft)
+        # Всё рисуется только в пределах видимой области камеры
+        view = self.camera.rect
+        self.background.draw(self.screen, view)
 
         # Рисуем баррикады
-        self.barriers.draw(self.screen)
+        self.sim.barriers.draw(self.screen, view)
         # Рисуем оружие
-        self.weapons.draw(self.screen)
+        self.sim.weapons.draw(self.screen, view)
         # Рисуем монстров
-        self.monsters.draw(self.screen)
+        self.sim.monsters.draw(self.screen, view)
         # Рисуем пули
-        self.bullets.draw(self.screen)
+        self.sim.bullets.draw(self.screen, view)
 
-        # Текстовое поле: здоровье башни
-        tower_health_text = self.font_small.render(f"Башня HP: {self.tower.health}", True, WHITE)
-        self.screen.blit(tower_health_text, (10, 10))
+        for label, (text, pos) in zip(self.hud_labels, self.hud_lines()):
+            label.draw(self.screen, text, pos)
 
-        # Деньги
-        money_text = self.font_small.render(f"Деньги: {int(self.money)}", True, WHITE)
-        self.screen.blit(money_text, (10, 30))
+        if self.show_profiler:
+            self.profiler.draw_overlay(self.screen)
 
-        # Счёт
-        score_text = self.font_small.render(f"Счёт: {self.score}", True, WHITE)
-        self.screen.blit(score_text, (10, 50))
+        pygame.display.flip()
+
+    def draw_dirty(self):
+        """
+        Отрисовка «грязными прямоугольниками»: стираются и обновляются на экране
+        только области, где были или стали движущиеся объекты и изменённый текст.
+        Баррикады и оружие неподвижны, поэтому они запекаются в статичный слой
+        вместе с фоном и перерисовываются только при изменении их состава.
+        В толпе (см. crowded) сотни мелких blit и прямоугольников для
+        display.update обходятся дороже одного целого кадра, поэтому тогда
+        статичный слой кладётся на экран целиком и кадр отдаётся через flip.
+        """
+        sim = self.sim
+        view = self.camera.rect
+        # Слой зависит только от баррикад и оружия в кадре: разрушение за краем
+        # экрана большой карты не должно пересобирать его
+        barriers = sim.barriers.visible(view)
+        weapons = sim.weapons.visible(view)
+        static_key = (tuple(barriers), tuple(weapons), view.topleft)
+        full_redraw = static_key != self._static_key
+        hud = self.hud_lines()
+        if full_redraw:
+            # Баррикада поставлена/разрушена, появилось оружие или сдвинулась камера — пересобираем слой
+            self._static_key = static_key
+            if self.static_layer is not None and self.static_layer.get_size() == view.size:
+                # Поверхность прошлого слоя переиспользуется, а не создаётся заново
+                self.background.draw(self.static_layer, view)
+            else:
+                self.static_layer = self.background.view_surface(view)
+            dx, dy = -view.x, -view.y
+            self.static_layer.blits([(sprite.image, sprite.rect.move(dx, dy)) for sprite in barriers + weapons])
+            self.screen.blit(self.static_layer, (0, 0))
+        elif self.crowded(self._dynamic_rects):
+            # Толпа на экране: стираем всё одним blit и отдаём кадр целиком
+            full_redraw = True
+            self.dirty_fallbacks += 1
+            self.screen.blit(self.static_layer, (0, 0))
+        else:
+            # Стираем движущиеся объекты прошлого кадра и старый текст
+            for rect in self._dynamic_rects:
+                self.screen.blit(self.static_layer, rect, rect)
+            for _, rect in self._hud_state.values():
+                self.screen.blit(self.static_layer, rect, rect)
+            if self._overlay_rect is not None:
+                self.screen.blit(self.static_layer, self._overlay_rect, self._overlay_rect)
 
-        # Подсказка
-        hint_text = self.font_small.render("B - поставить барьер, W - поставить оружие", True, WHITE)
-        self.screen.blit(hint_text, (10, HEIGHT - 30))
+        dirty = self._dynamic_rects
+        # Рисуем монстров и пули
+        self._dynamic_rects = self.draw_layer(sim.monsters, view) + self.draw_layer(sim.bullets, view)
+        dirty.extend(self._dynamic_rects)
 
-        pygame.display.flip()
+        # Текст рисуем поверх каждый кадр (под ним мог пройти монстр),
+        # а на экран дополнительно отдаём только изменившиеся строки
+        for i, (text, pos) in enumerate(hud):
+            old_text, old_rect = self._hud_state.get(i, (None, None))
+            rect = self.hud_labels[i].draw(self.screen, text, pos)
+            self._hud_state[i] = (text, rect)
+            if text != old_text:
+                dirty.append(rect if old_rect is None else rect.union(old_rect))
+
+        # Панель профилировщика стирается и обновляется каждый кадр, как движущиеся объекты
+        if self._overlay_rect is not None:
+            dirty.append(self._overlay_rect)
+        self._overlay_rect = self.profiler.draw_overlay(self.screen) if self.show_profiler else None
+        if self._overlay_rect is not None:
+            dirty.append(self._overlay_rect)
+
+        if full_redraw:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
+
+    def crowded(self, rects):
+        """
+        Прямоугольников движущихся объектов так много (или они так велики),
+        что кадр выгоднее перерисовать целиком. Решение принимается по прошлому
+        кадру: толпа за один тик почти не меняется.
+        """
+        if len(rects) > DIRTY_MAX_RECTS:
+            return True
+        # Пересечения считаются дважды — для оценки доли экрана это не важно
+        area = sum(rect.width * rect.height for rect in rects)
+        return area > DIRTY_MAX_SHARE * WIDTH * HEIGHT
+
+    def draw_layer(self, group, view=None):
+        """
+        Нарисовать группу (или EntityStore) и вернуть прямоугольники, куда попали спрайты.
+        """
+        return list(group.draw(self.screen, view))
+
+    @property
+    def score_table(self):
+        """
+        Таблица рекордов; файл открывается (а старый results.csv импортируется) при первом обращении.
+        """
+        if self._score_table is None:
+            self._score_table = SqliteScoreTable()
+        return self._score_table
+
+    @score_table.setter
+    def score_table(self, table):
+        self._score_table = table
 
     def final_screen(self):
         """
@@ -663,10 +4467,11 @@ class TowerDefenceGame:
         иначе - о победе. Выводим таблицу рекордов.
         """
         # Если башня жива, значит мы прошли все уровни
-        success = self.tower.health > 0
+        success = self.sim.tower.health > 0
 
-        # Сохраняем результат
-        self.score_table.add_record(self.player_name, self.score)
+        # Сохраняем результат (повтор записанной игры в таблицу не попадает)
+        if self.replay is None:
+            self.score_table.add_record(self.player_name, self.sim.score)
 
         # Получим лучшие результаты
         best_scores = self.score_table.get_best_scores(5)
@@ -674,60 +4479,176 @@ class TowerDefenceGame:
         # Кнопка "Выход"
         exit_button = Button((WIDTH // 2 - 100, HEIGHT // 2 + 150, 200, 50), "Выход", color=(200, 50, 50))
 
+        need_redraw = True
         while True:
-            self.clock.tick(FPS)
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
+            if need_redraw:
+                self.draw_final(success, best_scores, exit_button)
+                need_redraw = False
+
+            # Экран статичен: ждём событие, не опрашивая очередь в цикле
+            event = pygame.event.wait()
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if exit_button.is_clicked(event.pos):
                     pygame.quit()
                     sys.exit()
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    if exit_button.is_clicked(event.pos):
-                        pygame.quit()
-                        sys.exit()
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE, pygame.VIDEORESIZE):
+                need_redraw = True
 
-            self.screen.fill(GRAY)
+    def draw_final(self, success, best_scores, exit_button):
+        """
+        Отрисовка финального экрана (вызывается только когда нужно перерисовать).
+        """
+        self.screen.fill(GRAY)
 
-            if success:
-                text = self.font_big.render("ПОБЕДА!", True, GREEN)
-            else:
-                text = self.font_big.render("ПОРАЖЕНИЕ!", True, RED)
+        if success:
+            text = self.font_big.render("ПОБЕДА!", True, GREEN)
+        else:
+            text = self.font_big.render("ПОРАЖЕНИЕ!", True, RED)
 
-            text_rect = text.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 100))
-            self.screen.blit(text, text_rect)
+        text_rect = text.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 100))
+        self.screen.blit(text, text_rect)
 
-            # Выводим наши очки
-            score_text = self.font_small.render(f"Ваш счёт: {self.score}", True, BLACK)
-            self.screen.blit(score_text, (WIDTH // 2 - 50, HEIGHT // 2 - 50))
+        # Выводим наши очки
+        score_text = self.font_small.render(f"Ваш счёт: {self.sim.score}", True, BLACK)
+        self.screen.blit(score_text, (WIDTH // 2 - 50, HEIGHT // 2 - 50))
 
-            # Лучшая таблица
-            y_offset = HEIGHT // 2
-            self.screen.blit(self.font_small.render("Топ-результаты:", True, BLACK), (WIDTH // 2 - 50, y_offset))
+        # Лучшая таблица
+        y_offset = HEIGHT // 2
+        self.screen.blit(self.font_small.render("Топ-результаты:", True, BLACK), (WIDTH // 2 - 50, y_offset))
+        y_offset += 20
+        for i, (name, sc) in enumerate(best_scores):
+            record_str = f"{i + 1}. {name} - {sc}"
+            self.screen.blit(self.font_small.render(record_str, True, BLACK), (WIDTH // 2 - 50, y_offset))
             y_offset += 20
-            for i, (name, sc) in enumerate(best_scores):
-                record_str = f"{i + 1}. {name} - {sc}"
-                self.screen.blit(self.font_small.render(record_str, True, BLACK), (WIDTH // 2 - 50, y_offset))
-                y_offset += 20
 
-            exit_button.draw(self.screen)
+        exit_button.draw(self.screen)
 
-            pygame.display.flip()
+        pygame.display.flip()
 
 
 # -----------------------------------------------------------------------------------
 # ------------------------ ГЛАВНАЯ ФУНКЦИЯ -------------------------------------------
 # -----------------------------------------------------------------------------------
-def main():
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    game = TowerDefenceGame(screen)
+def run_headless(max_ticks=None, commands=None, use_arrays=False, flow_field=False, levels=None):
+    """
+    Прогнать игру без окна с максимальной скоростью (для CI и серверов,
+    например с SDL_VIDEODRIVER=dummy). Возвращает завершённую симуляцию.
+    """
+    sim = Simulation(levels=levels, use_arrays=use_arrays, flow_field=flow_field)
+    return sim.run(max_ticks=max_ticks, commands=commands)
+
+
+def main(argv=None):
+    startup = StartupReport()
+    parser = argparse.ArgumentParser(description="Tower Defence")
+    parser.add_argument("--headless", action="store_true",
+                        help="прогнать игру без окна и вывести результат")
+    parser.add_argument("--max-ticks", type=int, default=None,
+                        help="ограничение на число тиков в режиме --headless")
+    parser.add_argument("--arrays", action="store_true",
+                        help="хранить монстров и пули в массивах NumPy (EntityStore)")
+    parser.add_argument("--levels", default=LEVELS_FILE, metavar="FILE",
+                        help=f"файл с описанием уровней (по умолчанию {LEVELS_FILE})")
+    parser.add_argument("--endless", action="store_true",
+                        help="бесконечный режим: уровни генерируются по ходу игры")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="зерно генератора уровней бесконечного режима")
+    parser.add_argument("--flow-field", action="store_true",
+                        help="монстры обходят баррикады по общему полю направлений к башне")
+    parser.add_argument("--analytic-bullets", action="store_true",
+                        help="пули не летят по кадрам: попадание рассчитывается при выстреле, приближённо (без --arrays)")
+    parser.add_argument("--dirty-render", action="store_true",
+                        help="перерисовывать только изменившиеся области экрана")
+    parser.add_argument("--profile", nargs="?", const="profile.json", default=None, metavar="FILE",
+                        help="по выходу из игры сохранить замеры фаз кадра в JSON (по умолчанию profile.json)")
+    parser.add_argument("--record", nargs="?", const="last_session.tdlog", default=None, metavar="FILE",
+                        help="записать журнал ввода сессии в FILE (по умолчанию last_session.tdlog)")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="повторить записанную сессию (с --headless — без окна на полной скорости)")
+    parser.add_argument("--resume", metavar="FILE",
+                        help="продолжить игру из снимка состояния")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="периодически сохранять снимок состояния в FILE")
+    parser.add_argument("--checkpoint-every", type=int, default=500, metavar="TICKS",
+                        help="как часто сохранять снимок, в тиках (по умолчанию 500)")
+    parser.add_argument("--render-fps", type=int, default=FPS, metavar="FPS",
+                        help=f"ограничение частоты кадров, 0 — без ограничения (логика всегда {FPS} тиков/с)")
+    parser.add_argument("--max-catchup", type=int, default=5, metavar="TICKS",
+                        help="сколько тиков логики можно догнать за один кадр (по умолчанию 5)")
+    parser.add_argument("--memory-report", action="store_true",
+                        help="после прогона --headless вывести память объектов симуляции по видам")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="вывести время этапов запуска до первого кадра")
+    args = parser.parse_args(argv)
+
+    if args.replay and args.headless:
+        sim, final = replay_headless(args.replay)
+        print(f"ticks={sim.tick_count} tower_hp={sim.tower.health} "
+              f"score={sim.score} money={int(sim.money)} won={sim.won}")
+        if final is not None:
+            same = final == (sim.tick_count, max(sim.tower.health, 0), sim.score)
+            print(f"записано: ticks={final[0]} tower_hp={final[1]} score={final[2]} — "
+                  f"{'совпадает' if same else 'РАСХОЖДЕНИЕ'}")
+            if not same:
+                sys.exit(1)
+        return
+
+    if args.replay:
+        settings, commands, final = read_input_log(args.replay)
+    elif args.resume:
+        # Снимок целиком попадает в настройки, поэтому журнал такой сессии тоже повторяем
+        with open(args.resume, "rb") as f:
+            settings = {"snapshot": base64.b64encode(f.read()).decode("ascii")}
+    else:
+        settings = session_settings(args.levels, args.seed if args.endless else None,
+                                    use_arrays=args.arrays, flow_field=args.flow_field,
+                                    analytic_bullets=args.analytic_bullets)
+
+    if args.headless:
+        sim = build_simulation(settings).run(max_ticks=args.max_ticks)
+        print(f"ticks={sim.tick_count} tower_hp={sim.tower.health} "
+              f"score={sim.score} money={int(sim.money)} won={sim.won}")
+        if args.memory_report:
+            print("\n".join(format_memory_report(memory_report(sim))))
+        return
+
+    startup.mark("настройки")
+    screen = init_display((WIDTH, HEIGHT))
+    startup.mark("окно")
+    # Спрайты загружаются в фоне, пока открыт стартовый экран
+    assets = AssetLoader().start()
+    startup.mark("загрузчик")
+    input_log = InputLog(args.record, settings) if args.record and not args.replay else None
+    try:
+        if args.replay:
+            game = TowerDefenceGame(screen, dirty_rendering=args.dirty_render, profile_path=args.profile,
+                                    render_fps=args.render_fps, max_catchup=args.max_catchup,
+                                    sim=build_simulation(settings), replay=commands, assets=assets,
+                                    replay_ticks=final[0] if final else None)
+        else:
+            game = TowerDefenceGame(screen, dirty_rendering=args.dirty_render, profile_path=args.profile,
+                                    render_fps=args.render_fps, max_catchup=args.max_catchup,
+                                    sim=build_simulation(settings), input_log=input_log, assets=assets,
+                                    checkpoint_path=args.checkpoint, checkpoint_every=args.checkpoint_every)
+        startup.mark("игра")
+        if args.startup_report:
+            game.startup = startup
 
-    # Стартовое меню
-    game.start_screen()
+        # Стартовое меню
+        game.start_screen()
 
-    # Игровой процесс
-    game.game_loop()
+        # Игровой процесс
+        game.game_loop()
 
-    # Финальный экран
-    game.final_screen()
+        # Финальный экран
+        game.final_screen()
+    finally:
+        # Журнал закрывается и при выходе из окна до конца игры (тогда без итога)
+        if input_log is not None:
+            input_log.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+"""
+Пакетный прогон batch.py: подклассы монстров не копятся от игры к игре,
+а сценарии расстановки берут размер и точки спавна из карты игры.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+import batch  # noqa: E402
+
+BIG_LEVELS = os.path.join("data", "levels_big.json")
+
+
+def task(params, strategy="ring", seed=0, max_ticks=300):
+    return (0, params, strategy, seed, max_ticks, 100)
+
+
+def test_override_types_are_reused():
+    params = {"Goblin.health": 80, "Orc.speed": 2}
+    first = batch.build_monster_types(params)
+    assert batch.build_monster_types(dict(params)) == first
+    assert first["Goblin"].stats["health"] == 80
+    assert first["Golem"] is main.MONSTER_TYPES["Golem"]
+    batch.run_game(task(params))
+    kinds, classes = len(main._monster_kinds), len(main._kind_cache)
+    for seed in range(10):
+        batch.run_game(task(params, seed=seed))
+    assert (len(main._monster_kinds), len(main._kind_cache)) == (kinds, classes)
+
+
+def test_strategies_follow_levels_file_map():
+    game_map = main.load_map(BIG_LEVELS)
+    sim = main.Simulation(levels=batch.build_levels({"levels_file": BIG_LEVELS}, main.MONSTER_TYPES, game_map),
+                          game_map=game_map)
+    wall = batch.WallStrategy(None)
+    wall(sim)
+    tx, ty = sim.tower.rect.center
+    for sx, sy in game_map.spawn_points:
+        # Первая баррикада каждого отрезка — на пятой части пути от спавна к башне
+        assert (sx + (tx - sx) // 5, sy + (ty - sy) // 5) in wall.wall + [command[1:] for command in sim.pending_commands]
+    cells = batch.cells_by_distance(sim.tower.rect.center, game_map.size)
+    assert len(cells) == (2400 // main.CELL_SIZE) * (1800 // main.CELL_SIZE)
+
+
+def test_wall_holds_on_levels_file_map():
+    # Баррикады на путях от всех четырёх спавнов большой карты задерживают монстров
+    idle = batch.run_game(task({"levels_file": BIG_LEVELS}, strategy="idle", max_ticks=5000))
+    wall = batch.run_game(task({"levels_file": BIG_LEVELS}, strategy="wall", max_ticks=5000))
+    assert wall["ticks"] > idle["ticks"]
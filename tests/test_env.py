@@ -0,0 +1,61 @@
+"""
+Среда env.py: сетка действий и наблюдения покрывает карту из файла уровней,
+а монстры выходят из её точек спавна.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+import env  # noqa: E402
+
+pytestmark = pytest.mark.skipif(main.np is None, reason="env.py требует numpy")
+
+BIG_LEVELS = os.path.join("data", "levels_big.json")
+
+
+def test_default_map_keeps_module_grid():
+    default = env.TowerDefenceEnv()
+    assert (default.grid_cols, default.grid_rows) == (env.GRID_COLS, env.GRID_ROWS)
+    assert (default.action_count, default.obs_size) == (env.ACTION_COUNT, env.OBS_SIZE)
+
+
+@pytest.mark.parametrize("endless", [False, True])
+def test_grid_and_spawns_follow_levels_file_map(endless):
+    big = env.TowerDefenceEnv(levels_file=BIG_LEVELS, endless=endless)
+    game_map = main.load_map(BIG_LEVELS)
+    assert (big.grid_cols, big.grid_rows) == (2400 // main.CELL_SIZE, 1800 // main.CELL_SIZE)
+    obs, _ = big.reset(seed=0)
+    assert obs.shape == (big.obs_size,)
+    assert big.sim.map.size == game_map.size
+    assert big.sim.tower.rect.topleft == game_map.tower_pos
+
+    # Оружие в дальнем углу карты — в последней ячейке сетки
+    col, row = big.grid_cols - 1, big.grid_rows - 1
+    obs, _, _, _, info = big.step(big.weapon_action(col, row))
+    assert info["placed"]
+    assert env.observation_grid(obs, big.grid_cols, big.grid_rows)[3, row, col] == 1
+
+    # Монстры появляются у точек спавна большой карты, в том числе за пределами окна
+    spawns = {(x // main.CELL_SIZE, y // main.CELL_SIZE) for x, y in game_map.spawn_points}
+    seen = set()
+    for _ in range(60):
+        obs, _, _, _, _ = big.step(env.ACTION_NOOP)
+        counts = env.observation_grid(obs, big.grid_cols, big.grid_rows)[1]
+        seen.update(zip(*counts.nonzero()[::-1]))
+    assert any(cell in spawns for cell in seen)
+    assert any(x * main.CELL_SIZE >= main.WIDTH or y * main.CELL_SIZE >= main.HEIGHT for x, y in seen)
+
+
+def test_vector_env_sized_from_map():
+    with env.VectorEnv(2, workers=0, levels_file=BIG_LEVELS) as envs:
+        obs, _ = envs.reset(seed=0)
+        assert obs.shape == (2, envs.obs_size)
+        _, _, _, _, infos = envs.step([envs.action_count - 1, env.ACTION_NOOP])
+        assert infos[0]["placed"]
@@ -0,0 +1,114 @@
+"""
+Поле направлений (FlowField): монстры проходят в проход в стене, не задевая
+её, а починка поля после изменения баррикад совпадает с пересчётом с нуля.
+"""
+import os
+import random
+import sys
+
+import pygame
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+
+MODES = [False] + ([True] if main.np is not None else [])
+
+
+class HoldLevel:
+    """
+    Уровень без спавна: монстры и баррикады ставятся в тесте.
+    """
+    done = False
+
+    def update(self, monsters_group):
+        pass
+
+
+def monster_at(sim, i):
+    """
+    Положение, состояние и цель i-го монстра в обоих режимах хранения.
+    """
+    if sim.store is None:
+        monster = list(sim.monsters)[i]
+        target = "tower" if monster.target is sim.tower else monster.target
+        return monster.rect.topleft, monster.state, target
+    store = sim.store
+    k = sorted(range(store.m_count), key=lambda j: store.m_seq[j])[i]
+    target = "tower" if store.m_target[k] == main.TARGET_TOWER else int(store.m_target[k])
+    return (int(store.m_x[k]), int(store.m_y[k])), int(store.m_state[k]), target
+
+
+@pytest.mark.parametrize("use_arrays", MODES)
+@pytest.mark.parametrize("kind", [main.Goblin, main.Orc, main.Golem])
+def test_monsters_pass_gap_in_wall(kind, use_arrays):
+    # Стена x=200 с проходом в две клетки (y=280..360) между баррикадами (200, 240) и (200, 360)
+    sim = main.Simulation(levels=[HoldLevel()], tower_health=10 ** 9, flow_field=True, use_arrays=use_arrays)
+    wall = [main.Barrier(200, y) for y in range(0, 600, 40) if y not in (280, 320)]
+    sim.barriers.add(*wall)
+    for i in range(4):
+        monster = kind(20 + i % 2 * 40, 40 + i * 140)
+        monster.health = monster.max_health = 10 ** 6
+        sim.monsters.add(monster)
+    for _ in range(1000):
+        sim.tick()
+    assert [barrier.health for barrier in wall] == [100] * len(wall)
+    assert all(monster_at(sim, i)[2] == "tower" for i in range(4))
+
+
+def test_sprites_and_arrays_agree_around_barriers():
+    if main.np is None:
+        pytest.skip("нужен numpy")
+    rng = random.Random(1)
+    cells = set()
+    while len(cells) < 60:
+        cell = (rng.randrange(20) * 40, rng.randrange(15) * 40)
+        if abs(cell[0] - 380) > 100 or abs(cell[1] - 280) > 100:
+            cells.add(cell)
+    sims = []
+    for use_arrays in (False, True):
+        sim = main.Simulation(levels=[HoldLevel()], tower_health=10 ** 9, flow_field=True, use_arrays=use_arrays)
+        sim.barriers.add(*[main.Barrier(*cell) for cell in sorted(cells)])
+        spawn = random.Random(1)
+        for i, kind in enumerate([main.Goblin, main.Orc, main.Golem] * 5):
+            monster = kind(spawn.choice([0, 760]), spawn.randrange(560))
+            monster.health = monster.max_health = 10 ** 6
+            sim.monsters.add(monster)
+        sims.append(sim)
+    for _ in range(600):
+        for sim in sims:
+            sim.tick()
+        sprites, arrays = ([monster_at(sim, i)[:2] for i in range(15)] for sim in sims)
+        assert sprites == arrays
+    assert [b.health for b in sims[0].barriers] == [b.health for b in sims[1].barriers]
+
+
+def field_state(field):
+    return field.dist, field.parent, field.blocked, field.waypoints
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_repair_matches_recompute(seed):
+    rng = random.Random(seed)
+    tower = pygame.Rect(0, 0, 93, 121)
+    tower.center = main.TOWER_POS
+    size = rng.choice([(36, 41), (30, 46), (62, 65), (main.CELL_SIZE, main.CELL_SIZE)])
+    field = main.FlowField(tower, size=size)
+    placed = []
+    for _ in range(30):
+        # Несколько баррикад ставятся и ломаются за один «тик», потом поле чинится
+        for _ in range(rng.randint(1, 4)):
+            if placed and rng.random() < 0.4:
+                rect = placed.pop(rng.randrange(len(placed)))
+                field.set_blocked(rect, -1)
+            else:
+                rect = pygame.Rect(rng.randrange(-20, main.WIDTH), rng.randrange(-20, main.HEIGHT), 41, 41)
+                placed.append(rect)
+                field.set_blocked(rect, 1)
+        field.repair()
+        fresh = main.FlowField(tower, size=size, barriers=placed)
+        assert field_state(field) == field_state(fresh)
@@ -0,0 +1,60 @@
+"""
+Журнал ввода InputLog: запись сессии и её повтор по журналу дают то же конечное
+состояние, а итог дописывается только в журнал законченной игры.
+"""
+import os
+import sys
+import random
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+
+COMMANDS = (main.CMD_TOGGLE_BARRIER, main.CMD_TOGGLE_WEAPON, main.CMD_CLICK,
+            main.CMD_PLACE_BARRIER, main.CMD_PLACE_WEAPON)
+
+
+def play(filename, seed, max_ticks=None, **settings_kwargs):
+    """
+    Сыграть сессию со случайными командами, записывая её в журнал.
+    """
+    rng = random.Random(seed)
+    settings = main.session_settings(**settings_kwargs)
+    sim = main.build_simulation(settings)
+    with main.InputLog(filename, settings) as log:
+        sim.recorder = log
+        while sim.running and (max_ticks is None or sim.tick_count < max_ticks):
+            if rng.random() < 0.03:
+                sim.submit(rng.choice(COMMANDS), rng.randrange(main.WIDTH), rng.randrange(main.HEIGHT))
+            sim.tick()
+        log.close(sim)
+    return sim
+
+
+def state(sim):
+    return (sim.tick_count, sim.tower.health, sim.score, sim.money, sim.won,
+            sorted(barrier.rect.topleft for barrier in sim.barriers),
+            sorted(weapon.rect.topleft for weapon in sim.weapons))
+
+
+@pytest.mark.parametrize("seed,flow_field", [(1, False), (2, False), (3, True)])
+def test_replay_reaches_recorded_state(tmp_path, seed, flow_field):
+    filename = str(tmp_path / "session.tdlog")
+    sim = play(filename, seed, flow_field=flow_field)
+    assert not sim.running
+    replayed, final = main.replay_headless(filename)
+    assert final == (sim.tick_count, max(sim.tower.health, 0), sim.score)
+    assert state(replayed) == state(sim)
+
+
+def test_unfinished_session_has_no_summary(tmp_path):
+    filename = str(tmp_path / "session.tdlog")
+    sim = play(filename, 4, max_ticks=300)
+    assert sim.running
+    settings, commands, final = main.read_input_log(filename)
+    assert final is None and commands
@@ -0,0 +1,98 @@
+"""
+Расписание спавна compile_waves: GameLevel выпускает тех же монстров на тех же
+тиках и завершается на том же тике, что и исходный уровень со счётчиком задержки.
+"""
+import os
+import sys
+import random
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+
+
+class TimerLevel:
+    """
+    Исходный уровень: таймер задержки уменьшается каждый тик, на нуле выходит
+    следующий монстр волны, а следующая волна начинается со сброшенным таймером.
+    """
+
+    def __init__(self, waves):
+        self.waves = waves
+        self.wave_index = 0
+        self.monster_class, self.to_spawn, self.delay = waves[0]
+        self.timer = 0
+        self.done = False
+
+    def update(self, spawned):
+        if self.done:
+            return
+        if self.timer > 0:
+            self.timer -= 1
+            return
+        spawned.append(self.monster_class)
+        self.to_spawn -= 1
+        self.timer = self.delay
+        if self.to_spawn <= 0:
+            self.wave_index += 1
+            if self.wave_index >= len(self.waves):
+                self.done = True
+            else:
+                self.monster_class, self.to_spawn, self.delay = self.waves[self.wave_index]
+                self.timer = 0
+
+
+class Spawned(list):
+    """
+    Группа, которая только запоминает классы выпущенных монстров.
+    """
+
+    def add(self, monster):
+        self.append(type(monster))
+
+
+def timeline(level, group):
+    """
+    Список (тик, выпущенные за тик классы, done) до завершения уровня.
+    """
+    ticks = []
+    while not level.done:
+        before = len(group)
+        level.update(group)
+        ticks.append((len(ticks), list(group[before:]), level.done))
+    return ticks
+
+
+def random_waves(rng):
+    types = list(main.MONSTER_TYPES.values())
+    return [(rng.choice(types), rng.randint(1, 6), rng.choice([0, 1, rng.randint(2, 90)]))
+            for _ in range(rng.randint(1, 5))]
+
+
+@pytest.mark.parametrize("waves", main.load_waves(main.LEVELS_FILE), ids=lambda waves: f"{len(waves)} waves")
+def test_levels_file_matches_timer(waves):
+    assert timeline(main.GameLevel(waves), Spawned()) == timeline(TimerLevel(waves), [])
+
+
+def test_random_waves_match_timer():
+    rng = random.Random(14)
+    for _ in range(300):
+        waves = random_waves(rng)
+        assert timeline(main.GameLevel(waves), Spawned()) == timeline(TimerLevel(waves), []), waves
+
+
+def test_endless_levels_match_timer():
+    for level, _ in zip(main.endless_levels(7), range(12)):
+        assert timeline(level, Spawned()) == timeline(TimerLevel(level.waves), [])
+
+
+def test_bad_wave_rejected():
+    with pytest.raises(ValueError):
+        main.compile_waves([(main.Goblin, 0, 10)])
+    with pytest.raises(ValueError):
+        main.compile_waves([(main.Goblin, 3, -1)])
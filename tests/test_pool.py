@@ -0,0 +1,34 @@
+"""
+Пул спрайтов PooledGroup: удалённый спрайт переиспользуется spawn(),
+но только пока он снова не оказался в группе.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+
+
+def test_spawn_reuses_removed_sprite():
+    group = main.PooledGroup()
+    bullet = group.spawn(main.Bullet, 0, 0, None)
+    bullet.kill()
+    assert group.spawn(main.Bullet, 5, 5, None) is bullet
+    assert bullet.rect.center == (5, 5)
+    assert group.pool_stats()["reused"] == 1
+
+
+def test_sprite_added_back_leaves_pool():
+    group = main.PooledGroup()
+    bullet = group.spawn(main.Bullet, 0, 0, None)
+    group.remove(bullet)
+    group.add(bullet)
+    other = group.spawn(main.Bullet, 5, 5, None)
+    assert other is not bullet
+    assert bullet.rect.center == (0, 0)
+    assert len(group) == 2
+    assert group.pool_stats()["free"] == 0
@@ -0,0 +1,103 @@
+"""
+Аналитические снаряды (ProjectileGroup) против самонаводящихся пуль (Bullet.update):
+тик попадания должен совпадать и тогда, когда цель посреди полёта пули
+останавливается атаковать башню. Режим приближённый: целая игра с ним
+кончается так же, но не обязательно в тот же тик.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+import batch  # noqa: E402
+
+
+class HoldLevel:
+    """
+    Уровень без спавна: монстр и оружие ставятся в тесте.
+    """
+    done = False
+
+    def update(self, monsters_group):
+        pass
+
+
+def first_hit(analytic, monster_pos, weapon_pos):
+    """
+    Один гоблин, одно оружие и один выстрел в первом тике. Возвращает тик
+    попадания и состояния гоблина в момент выстрела и в момент попадания.
+    """
+    sim = main.Simulation(levels=[HoldLevel()], tower_health=10 ** 9, analytic_bullets=analytic)
+    goblin = main.Goblin(*monster_pos)
+    goblin.health = goblin.max_health = 10 ** 6
+    sim.monsters.add(goblin)
+    weapon = main.Weapon(*weapon_pos)
+    weapon.fire_delay = 10 ** 6
+    sim.weapons.add(weapon)
+    sim.tick()
+    state_at_fire = goblin.state
+    while goblin.health == goblin.max_health and sim.tick_count < 500:
+        sim.tick()
+    return sim.tick_count, state_at_fire, goblin.state
+
+
+# Гоблин идёт к башне (400, 300, 93x121) и встаёт у неё, пока пуля ещё летит
+STOPS_MID_FLIGHT = [
+    ((593, 481), (760, 560)),  # уходит от оружия, пока не упрётся в башню
+    ((340, 240), (760, 0)),
+    ((320, 451), (760, 560)),
+    ((553, 230), (760, 0)),
+]
+
+
+@pytest.mark.parametrize("monster_pos, weapon_pos", STOPS_MID_FLIGHT)
+def test_hit_tick_when_target_stops_mid_flight(monster_pos, weapon_pos):
+    homing = first_hit(False, monster_pos, weapon_pos)
+    analytic = first_hit(True, monster_pos, weapon_pos)
+    assert homing[1:] == (main.MONSTER_MOVE, main.MONSTER_ATTACK)
+    assert analytic[1:] == homing[1:]
+    assert abs(analytic[0] - homing[0]) <= 1
+
+
+def test_bullet_reaims_when_target_stops():
+    sim = main.Simulation(levels=[HoldLevel()], tower_health=10 ** 9, analytic_bullets=True)
+    goblin = main.Goblin(593, 481)
+    goblin.health = goblin.max_health = 10 ** 6
+    sim.monsters.add(goblin)
+    weapon = main.Weapon(760, 560)
+    weapon.fire_delay = 10 ** 6
+    sim.weapons.add(weapon)
+    while goblin.state == main.MONSTER_MOVE:
+        sim.tick()
+    # Пуля летит в то место, где гоблин встал, а не за него
+    bullet, = sim.bullets
+    assert goblin.rect.inflate(2 * bullet.speed, 2 * bullet.speed).collidepoint(bullet.aim)
+    assert bullet.hit_tick - sim.tick_count < 40
+
+
+def play(seed, analytic):
+    """
+    Игра со случайной расстановкой (стратегия random из batch.py) до конца.
+    """
+    sim = main.Simulation(analytic_bullets=analytic)
+    strategy = batch.STRATEGIES["random"](random.Random(seed))
+    while sim.running and sim.tick_count < 20000:
+        strategy(sim)
+        sim.tick()
+    return sim
+
+
+@pytest.mark.parametrize("seed", [1, 4, 5])
+def test_whole_game_close_to_homing(seed):
+    homing = play(seed, False)
+    analytic = play(seed, True)
+    # Исход, счёт и здоровье башни те же, длина игры — в пределах 3%
+    assert (analytic.won, analytic.score, analytic.tower.health) == (homing.won, homing.score, homing.tower.health)
+    assert abs(analytic.tick_count - homing.tick_count) <= 0.03 * homing.tick_count
@@ -0,0 +1,81 @@
+"""
+Таблица рекордов SqliteScoreTable: старый CSV переносится ровно один раз,
+две копии игры пишут в один файл без потерь, а игра открывает таблицу
+только при первом обращении.
+"""
+import os
+import sys
+import csv
+import threading
+
+import pygame
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+
+
+def write_legacy(path, rows):
+    with open(path, mode='w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Имя", "Очки"])
+        writer.writerows(rows)
+
+
+def test_legacy_csv_imported_once(tmp_path):
+    db, legacy = str(tmp_path / "results.db"), str(tmp_path / "results.csv")
+    write_legacy(legacy, [("Аня", 30), ("Боря", 50), ("битая", "строка"), ("Вова", 50)])
+    first = main.SqliteScoreTable(db, legacy)
+    second = main.SqliteScoreTable(db, legacy)
+    second.add_record("Гена", 40)
+    first.close()
+    second.close()
+    table = main.SqliteScoreTable(db, legacy)
+    assert table.get_best_scores(10) == [("Боря", 50), ("Вова", 50), ("Гена", 40), ("Аня", 30)]
+    table.close()
+
+
+def test_two_writers_keep_every_record(tmp_path):
+    db, legacy = str(tmp_path / "results.db"), str(tmp_path / "results.csv")
+    write_legacy(legacy, [("Аня", 30)])
+    per_writer = 200
+    errors = []
+
+    def play(name):
+        # Каждая копия игры — своё соединение; sqlite3 не делит соединение между потоками
+        try:
+            table = main.SqliteScoreTable(db, legacy)
+            for score in range(per_writer):
+                table.add_record(name, score)
+            table.close()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=play, args=(f"игрок{n}",)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    table = main.SqliteScoreTable(db, legacy)
+    assert table.conn.execute("SELECT COUNT(*) FROM scores").fetchone() == (2 * per_writer + 1,)
+    assert sorted(table.get_best_scores(2)) == [("игрок0", per_writer - 1), ("игрок1", per_writer - 1)]
+    table.close()
+
+
+def test_game_opens_score_table_lazily(monkeypatch):
+    opened = []
+
+    class Table:
+        def __init__(self):
+            opened.append(self)
+
+    monkeypatch.setattr(main, "SqliteScoreTable", Table)
+    screen = pygame.display.set_mode((main.WIDTH, main.HEIGHT))
+    game = main.TowerDefenceGame(screen)
+    assert opened == []
+    assert game.score_table is game.score_table
+    assert len(opened) == 1
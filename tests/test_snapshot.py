@@ -0,0 +1,70 @@
+"""
+Снимки состояния: симуляция, сохранённая в файл и загруженная обратно, дальше
+шагает точно так же, как исходная.
+"""
+import os
+import sys
+import json
+import zlib
+import random
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import main  # noqa: E402
+
+MODES = [dict(), dict(flow_field=True), dict(analytic_bullets=True)]
+if main.np is not None:
+    MODES += [dict(use_arrays=True), dict(use_arrays=True, flow_field=True)]
+
+
+def random_plan(seed, ticks=3000):
+    """
+    Команды игрока по тикам: баррикады и оружие в случайных ячейках.
+    """
+    rng = random.Random(seed)
+    plan = {}
+    for tick in range(ticks):
+        if rng.random() < 0.02:
+            kind = rng.choice((main.CMD_PLACE_BARRIER, main.CMD_PLACE_WEAPON))
+            plan[tick] = [(kind, rng.randrange(main.WIDTH), rng.randrange(main.HEIGHT))]
+    return plan
+
+
+def state(sim):
+    """
+    Содержимое снимка; пули в хранилище не упорядочены, поэтому сортируются.
+    """
+    data = json.loads(zlib.decompress(main.take_snapshot(sim)[len(main.SNAPSHOT_MAGIC):]))
+    data["bullets"].sort()
+    return data
+
+
+@pytest.mark.parametrize("kwargs", MODES, ids=lambda kwargs: ",".join(kwargs) or "sprites")
+@pytest.mark.parametrize("save_tick", [137, 900])
+def test_save_load_step_equal(tmp_path, kwargs, save_tick):
+    plan = random_plan(save_tick)
+    original = main.build_simulation(main.session_settings(**kwargs))
+    original.run(max_ticks=save_tick, commands=plan)
+    filename = str(tmp_path / "game.tdsnap")
+    main.save_snapshot(original, filename)
+    restored = main.load_snapshot(filename)
+    with open(filename, "rb") as f:
+        assert main.take_snapshot(restored) == f.read()
+
+    for _ in range(600):
+        for sim in (original, restored):
+            for command in plan.get(sim.tick_count, ()):
+                sim.submit(*command)
+        assert original.tick() == restored.tick()
+        if original.tick_count % 50 == 0:
+            assert state(original) == state(restored)
+    assert state(original) == state(restored)
+    original.run(commands=plan)
+    restored.run(commands=plan)
+    assert ((original.tick_count, original.tower.health, original.score, original.money, original.won)
+            == (restored.tick_count, restored.tower.health, restored.score, restored.money, restored.won))